@@ -0,0 +1,103 @@
+"""Стоимость разбора одного callback_query: прежняя цепочка против таблицы.
+
+    python bench_callbacks.py [повторов]
+
+legacy — как было: десять CallbackQueryHandler с regex-шаблонами проверяются
+         по очереди, затем внутри обработчика цепочка data == / startswith / replace;
+table  — callbacks.CallbackRouter.resolve: один partition + поиск в словаре
+         (старые строки callback_data — через LEGACY_EXACT / LEGACY_PREFIXES).
+"""
+import random
+import re
+import sys
+import time
+
+import callbacks as cb
+
+# ===== копия старой маршрутизации из bot.py =====
+LEGACY_PATTERNS = [re.compile(p) for p in (
+    "^menu_", "^gender_", "^age_", "^bl_", "^report_",
+    "^admin_", "^post_", "^rate_", "^filter_", "^vip_",
+)]
+
+
+def _chain(data: str, exact: tuple, prefixes: tuple):
+    for name in exact:
+        if data == name:
+            return name, None
+    for prefix in prefixes:
+        if data.startswith(prefix):
+            return prefix, data.replace(prefix, "")
+    return None, None
+
+
+LEGACY_CHAINS = [
+    (("menu_show_keyboard", "menu_search", "menu_reset_profile", "menu_blacklist", "menu_privacy", "menu_info"), ()),
+    ((), ("gender_",)),
+    ((), ("age_",)),
+    (("bl_close", "bl_list"), ("bl_page_",)),   # bl_back / bl_add_ / bl_rm_ ниже
+    ((), ("report_",)),
+    ((), ("admin_profile_", "admin_ban24_", "admin_unban_", "admin_mute30_", "admin_unmute_")),
+    (("post_newsearch", "post_blacklist", "post_partner_profile", "post_report", "post_rate"), ()),
+    (("rate_skip",), ("rate_",)),
+    (("filter_main", "filter_age", "filter_rating", "filter_reset", "filter_back", "filter_age_back",
+      "filter_rating_back", "filter_age_custom"), ("filter_age_min_", "filter_age_max_", "filter_rating_")),
+    (("vip_buy", "vip_premium", "vip_back"), ()),
+]
+
+
+def legacy(data: str):
+    for pattern, (exact, prefixes) in zip(LEGACY_PATTERNS, LEGACY_CHAINS):
+        if pattern.match(data):
+            if pattern.pattern == "^bl_":
+                name, arg = _chain(data, exact + ("bl_back",), prefixes + ("bl_add_", "bl_rm_"))
+            else:
+                name, arg = _chain(data, exact, prefixes)
+            return name, arg
+    return None, None
+
+
+# ===== выборка нажатий =====
+LEGACY_DATA = [
+    "filter_main", "filter_age", "filter_age_min_16", "filter_age_max_18", "filter_rating_3",
+    "filter_rating_back", "rate_5", "rate_skip", "post_rate", "post_newsearch",
+    "bl_list", "bl_page_2", "bl_rm_123456789", "admin_ban24_123456789", "admin_unmute_123456789",
+    "vip_back", "menu_info", "report_spam", "age_17", "gender_male",
+]
+COMPACT_DATA = [
+    cb.FILTER_MAIN, cb.FILTER_AGE, cb.pack(cb.FILTER_AGE_MIN, 16), cb.pack(cb.FILTER_AGE_MAX, 18),
+    cb.pack(cb.FILTER_MIN_RATING, 3), cb.FILTER_MAIN, cb.pack(cb.RATE, 5), cb.RATE_SKIP,
+    cb.POST_RATE, cb.POST_NEWSEARCH, cb.BL_LIST, cb.pack(cb.BL_LIST, 2), cb.pack(cb.BL_REMOVE, 123456789),
+    cb.pack(cb.ADMIN_BAN, 123456789), cb.pack(cb.ADMIN_UNMUTE, 123456789), cb.VIP_BACK, cb.MENU_INFO,
+    cb.pack(cb.REPORT, "spam"), cb.pack(cb.AGE, 17), cb.pack(cb.GENDER, "male"),
+]
+
+
+def _noop(*args):
+    pass
+
+
+def bench(name: str, fn, sample: list, repeat: int):
+    started = time.perf_counter()
+    for data in sample * repeat:
+        fn(data)
+    ns = (time.perf_counter() - started) / (len(sample) * repeat) * 1e9
+    print(f"{name:<16} {ns:8.0f} нс/нажатие")
+
+
+def main(repeat: int):
+    router = cb.CallbackRouter({code: _noop for code in set(cb.LEGACY_EXACT.values()) | {
+        code for _, code in cb.LEGACY_PREFIXES}})
+    assert all(router.resolve(d)[0] is _noop for d in LEGACY_DATA + COMPACT_DATA)
+
+    rnd = random.Random(1)
+    legacy_sample = [rnd.choice(LEGACY_DATA) for _ in range(1000)]
+    compact_sample = [rnd.choice(COMPACT_DATA) for _ in range(1000)]
+
+    bench("legacy", legacy, legacy_sample, repeat)
+    bench("table (compact)", router.resolve, compact_sample, repeat)
+    bench("table (old data)", router.resolve, legacy_sample, repeat)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
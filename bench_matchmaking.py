@@ -0,0 +1,115 @@
+"""Сравнение стоимости одного поиска собеседника на пулах разного размера.
+
+    python bench_matchmaking.py [размеры...]
+
+dense  — подходящих много, поиск заканчивается на первых кандидатах;
+sparse — почти все требуют высокий рейтинг, которого почти ни у кого нет,
+         поэтому поиск проходит пул почти целиком (вечерний пик с жёсткими фильтрами).
+
+legacy — прежний _try_match: проход по всему списку очереди с _matches_filters на каждого;
+pool   — MatchPool.candidates (корзины пол/возраст/рейтинг) + фильтры кандидата в Python;
+vector — MatchPool.ranked_for (numpy, один векторный проход).
+Порог VECTOR_MATCH_THRESHOLD в config.py — точка, где vector обгоняет pool.
+"""
+import random
+import sys
+import time
+
+from matchmaking import GENDER_CODES, MatchPool, np
+
+GENDERS = ("♂️", "♀️")
+
+
+def make_population(n: int, sparse: bool, seed: int = 1):
+    rnd = random.Random(seed)
+    profiles, filters, ratings = {}, {}, {}
+    for i in range(n):
+        uid = str(1_000_000 + i)
+        profiles[uid] = {"gender": rnd.choice(GENDERS), "age": str(rnd.randint(14, 25))}
+        lo = rnd.randint(14, 20)
+        filters[uid] = {
+            "gender": rnd.choice(("male", "female", "all")),
+            "min_age": lo,
+            "max_age": lo + rnd.randint(0, 6),
+            "min_rating": float(rnd.choice((4, 4, 4, 3) if sparse else (0, 0, 0, 1, 2, 3, 4))),
+        }
+        count = rnd.randint(0, 5)
+        low, high = (1, 4) if sparse and rnd.random() > 0.01 else (1, 5)
+        ratings[uid] = {"total": sum(rnd.randint(low, high) for _ in range(count)), "count": count}
+    return profiles, filters, ratings
+
+
+def main(sizes):
+    for sparse in (False, True):
+        print("sparse" if sparse else "dense")
+        for n in sizes:
+            bench(n, sparse)
+
+    if np is None:
+        print("numpy не установлен — векторный вариант пропущен")
+
+
+def bench(n: int, sparse: bool):
+    profiles, filters, ratings = make_population(n, sparse)
+    queue = list(profiles)
+
+    # ===== копия старых помощников из bot.py =====
+    def average_rating(uid):
+        r = ratings.get(uid) or {"total": 0, "count": 0}
+        return round(r["total"] / r["count"], 1) if r["count"] else 0.0
+
+    def matches_filters(uid, pid):
+        f = filters[uid]
+        p = profiles.get(pid, {})
+        if not p:
+            return False
+        g = f.get("gender", "all")
+        if g == "male" and p.get("gender") != "♂️":
+            return False
+        if g == "female" and p.get("gender") != "♀️":
+            return False
+        try:
+            age = int(p.get("age", 0))
+            if age < f.get("min_age", 16) or age > f.get("max_age", 99):
+                return False
+        except (ValueError, TypeError):
+            return False
+        return average_rating(pid) >= f.get("min_rating", 0.0)
+
+    pool = MatchPool(max_wait=3600)
+    for uid in queue:
+        pool.add(uid, profiles[uid], 0, None, filters[uid], average_rating(uid))
+
+    seekers = random.Random(2).sample(queue, min(200, n))
+
+    def legacy(uid):
+        for u in queue:
+            if u != uid and matches_filters(uid, u) and matches_filters(u, uid):
+                return u
+
+    def pooled(uid):
+        f = filters[uid]
+        cands = pool.candidates(GENDER_CODES.get(f["gender"]), f["min_age"], f["max_age"], f["min_rating"])
+        for u in cands:
+            if u != uid and matches_filters(u, uid):
+                return u
+
+    def vector(uid):
+        for u in pool.ranked_for(uid):
+            return u
+
+    row = [f"n={n:>6}"]
+    runs = [("legacy", legacy), ("pool", pooled)]
+    if np is not None:
+        runs.append(("vector", vector))
+    for name, fn in runs:
+        started = time.perf_counter()
+        for uid in seekers:
+            fn(uid)
+        us = (time.perf_counter() - started) / len(seekers) * 1e6
+        row.append(f"{name}: {us:9.1f} µs")
+    print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [100, 500, 1000, 2000, 5000, 20000, 50000])
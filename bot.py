@@ -9,26 +9,95 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
-
-from config import ADMINS, BOT_TOKEN, MOD_LOG_CHAT_ID, MAX_REPORTS
+from telegram.error import Forbidden
+from telegram.helpers import escape_markdown
+
+from processor import PerUserUpdateProcessor
+from webhook import run_webhook
+
+from config import (
+    ADMINS,
+    BOT_TOKEN,
+    MOD_LOG_CHAT_ID,
+    MAX_REPORTS,
+    PERSIST_INTERVAL,
+    JOURNAL_COMPACT_BYTES,
+    STORAGE_BACKEND,
+    SQLITE_FILE,
+    MATCH_MAX_WAIT,
+    BATCH_MATCH_INTERVAL,
+    BATCH_MATCH_CHUNK,
+    VECTOR_MATCH_THRESHOLD,
+    VIP_EXPIRY_CHECK_INTERVAL,
+    SANCTION_SWEEP_INTERVAL,
+    REPORT_DIGEST_INTERVAL,
+    REPORT_DEDUP_WINDOW,
+    REPORT_ESCALATE_RATIO,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    FLOOD_WINDOW,
+    FLOOD_MAX_MESSAGES,
+    FLOOD_REPEAT_HISTORY,
+    FLOOD_MAX_REPEATS,
+    FLOOD_REPEAT_MIN_LEN,
+    FLOOD_MUTE_MINUTES,
+    PHRASES_FILE,
+    PHRASES_RELOAD_INTERVAL,
+    VIP_EXPIRY_NOTIFY,
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_INTERVAL,
+    SEND_CHAT_BURST,
+    SEND_GROUP_INTERVAL,
+    SEND_MAX_RETRIES,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_CHECKPOINT_EVERY,
+    BROADCAST_PROGRESS_INTERVAL,
+    OUTBOX_BASE_DELAY,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_MAX_ATTEMPTS,
+    CONCURRENT_UPDATES,
+    UPDATE_MODE,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_QUEUE,
+)
 from states import SELECT_GENDER, SELECT_AGE
-from storage import load_data, save_data
+from storage import load_data, snapshot_sections, write_sections, Journal, WriteBehindStore
+from sqlite_storage import SqliteStorage, SqliteJournal
+from matchmaking import MatchPool, SearchQueue, GENDER_CODES
+from sender import Sender, LANE_RELAY, LANE_MATCH, LANE_MODERATION, LANE_BROADCAST
+from broadcast import Broadcast, RUNNING, PAUSED, CANCELLED
+from outbox import Outbox, CHAT, LANE, TEXT, KB
+from usercache import UserCache
+from flood import FloodGuard
+from phrases import PhraseFilter, WARN as PHRASE_WARN, REPORT as PHRASE_REPORT
 from moderation import (
     admin_actions_keyboard,
     report_keyboard,
     add_report,
-    report_text,
+    digest_text,
+    ReportDigest,
     is_admin,
     set_sanction,
     clear_sanction,
-    is_active,
+    SanctionIndex,
 )
 
 from telegram.constants import ChatAction
 
+import asyncio
+import heapq
+from itertools import islice
+
+import callbacks as cb
+
 # ===== STATES =====
 STATE_IDLE = "idle"
 STATE_SEARCH = "search"
@@ -37,12 +106,20 @@ STATE_DIALOG = "dialog"
 USER_STATE: dict[str, str] = {}  # user_id -> state
 
 # ===== DATA =====
-DATA = load_data()
+if STORAGE_BACKEND == "sqlite":
+    SQLITE = SqliteStorage(SQLITE_FILE)
+    DATA = SQLITE.load()
+else:
+    SQLITE = None
+    DATA = load_data()
 PROFILES = DATA.setdefault("profiles", {})
 DIALOGS = DATA.setdefault("dialogs", {})         # user_id -> partner_id
-SEARCH_QUEUE = DATA.setdefault("queue", [])      # list[user_id]
+SEARCH_QUEUE = DATA["queue"] = SearchQueue(DATA.get("queue") or {})  # user_id -> время постановки
 BANS = DATA.setdefault("bans", {})               # sanctions storage
 REPORTS = DATA.setdefault("reports", {})
+# Активные баны/муты: проверка — поиск в словаре, истёкшие снимает _sanction_sweep_job
+SANCTIONS = SanctionIndex(BANS)
+SANCTION_PACK = {"bans": BANS, "index": SANCTIONS}
 # ===== BLACKLIST & LAST_PARTNER (храним внутри BANS, чтобы persist() работал без правок storage.py) =====
 BLACKLIST = BANS.setdefault("__blacklist__", {})       # user_id -> list[str]
 LAST_PARTNER = BANS.setdefault("__last_partner__", {}) # user_id -> last_partner_id
@@ -66,10 +143,121 @@ VIP_STATUS = {
 # VIP: user_id -> {"status": str, "expire_date": int (timestamp), "activate_date": int}
 VIP_DATA = DATA.setdefault("__vip__", {})
 
+# ===== UNREACHABLE (заблокировали бота; рассылки их пропускают) =====
+UNREACHABLE = DATA.setdefault("__unreachable__", {})   # user_id -> когда получили Forbidden
+
+# ===== OUTBOX (важные системные сообщения до доставки) =====
+OUTBOX_DATA = DATA.setdefault("__outbox__", {})        # id -> [chat_id, lane, text, kb, attempts, next_at]
+
+
+# ===== MATCH POOL =====
+# Индекс очереди по (пол, возраст, приоритет); SEARCH_QUEUE остаётся источником истины
+# для сохранения, пул заполняется из неё на старте (_rebuild_pool)
+POOL = MatchPool(MATCH_MAX_WAIT)
+
+
+def _save_snapshot(sections=None):
+    # каждая секция DATA (в т.ч. VIP_DATA и под-словари BANS) — свой файл;
+    # сериализация — здесь, на event loop, в поток уходят только готовые строки
+    snapshot = snapshot_sections(DATA, sections)
+    return lambda: write_sections(snapshot)
+
+
+# persist() больше не пишет файл сам: только помечает состояние грязным,
+# а запись делает фоновый флашер (см. _on_startup / _on_shutdown).
+# Частые мутации идут через journal() — одна строка в журнал вместо всего файла.
+if SQLITE is not None:
+    STORE = WriteBehindStore(lambda sections: SQLITE.snapshot(DATA, sections), PERSIST_INTERVAL, SqliteJournal(SQLITE))
+else:
+    STORE = WriteBehindStore(_save_snapshot, PERSIST_INTERVAL, Journal(), JOURNAL_COMPACT_BYTES)
+
+
+def persist(*sections: str):
+    STORE.mark_dirty(*sections)
+
+
+def journal(op: str, key: str, value=None):
+    STORE.record(op, key, value)
+
+
+# ===== OUTBOUND =====
+# Исходящие к другим чатам (переписка, уведомления, мод-лог, рассылка) идут через
+# планировщик с лимитами Bot API; ответы в чат самого пользователя — напрямую.
+SENDER = Sender(SEND_GLOBAL_RATE, SEND_CHAT_INTERVAL, SEND_CHAT_BURST, SEND_GROUP_INTERVAL, SEND_MAX_RETRIES)
+
+
+def _log_failure(tag: str):
+    """done-callback для отправок «в фоне»: ошибку не теряем, но и не ждём."""
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"❌ {tag}:", future.exception())
+    return callback
+
+
+def send_later(lane: int, chat_id, call, tag: str = "SEND"):
+    """Поставить вызов в очередь SENDER, не дожидаясь отправки."""
+    future = SENDER.submit(lane, chat_id, call)
+    future.add_done_callback(_log_failure(tag))
+    return future
+
+
+# Сообщения, которые нельзя терять, идут через OUTBOX: запись сохраняется,
+# доставка повторяется в фоне. Клавиатуры хранятся по имени (см. _OUTBOX_KB).
+BOT = None   # app.bot, задаётся в _on_startup
+
+
+async def _outbox_send(entry):
+    kb = _OUTBOX_KB.get(entry[KB])
+    return await SENDER.send(entry[LANE], entry[CHAT], lambda: BOT.send_message(
+        entry[CHAT], entry[TEXT], reply_markup=kb() if kb else None
+    ))
+
+
+OUTBOX = Outbox(
+    OUTBOX_DATA, _outbox_send, journal, lambda uid: _mark_unreachable(uid),
+    OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_MAX_ATTEMPTS,
+)
+
+
+def notify(chat_id, text: str, kb: str | None = None, lane: int = LANE_MATCH):
+    """Важное уведомление: доставится и после сбоев/перезапуска."""
+    OUTBOX.put(chat_id, text, kb, lane)
+
+
+# ===== USER CACHE =====
+# Имена для мод-лога и админ-профиля: из апдейтов (_remember_user), при промахе — get_chat
+USERS = UserCache(lambda uid: BOT.get_chat(uid), USER_CACHE_SIZE, USER_CACHE_TTL)
 
-def persist():
-    # НЕ трогаю сигнатуру save_data — как у тебя было
-    save_data(PROFILES, DIALOGS, SEARCH_QUEUE, BANS, REPORTS, FILTERS)
+
+async def _remember_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is not None:
+        USERS.put(user.id, user.username, user.first_name)
+
+
+async def _username(user_id: str) -> str:
+    """@username для текста с parse_mode="Markdown" (или «—»)."""
+    entry = await USERS.get(user_id)
+    return "@" + escape_markdown(entry[0]) if entry and entry[0] else "—"
+
+
+async def _notify_pair(*messages) -> list[bool]:
+    """Отправить сообщения (chat_id, text, kb) всем сразу, а не по очереди.
+    По каждому получателю: True — доставлено (или временная ошибка, и повтор
+    ушёл в OUTBOX), False — бот заблокирован."""
+    async def one(chat_id, text, kb):
+        markup = _OUTBOX_KB[kb]() if kb else None
+        try:
+            await SENDER.send(LANE_MATCH, chat_id, lambda: BOT.send_message(int(chat_id), text, reply_markup=markup))
+        except Forbidden:
+            _mark_unreachable(str(chat_id))
+            return False
+        except Exception as e:
+            print("❌ NOTIFY:", e)
+            notify(chat_id, text, kb)
+        return True
+
+    return list(await asyncio.gather(*(one(*m) for m in messages)))
 
 
 # ===== KEYBOARD =====
@@ -109,10 +297,10 @@ INFO_TEXT = (
 def menu_panel():
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton("⌨️ Показать кнопки", callback_data="menu_show_keyboard")],
-            [InlineKeyboardButton("🚫 Чёрный список", callback_data="menu_blacklist")],
-            [InlineKeyboardButton("🔒 Приватность", callback_data="menu_privacy")],
-            [InlineKeyboardButton("📖 Информация", callback_data="menu_info")],
+            [InlineKeyboardButton("⌨️ Показать кнопки", callback_data=cb.MENU_KEYBOARD)],
+            [InlineKeyboardButton("🚫 Чёрный список", callback_data=cb.MENU_BLACKLIST)],
+            [InlineKeyboardButton("🔒 Приватность", callback_data=cb.MENU_PRIVACY)],
+            [InlineKeyboardButton("📖 Информация", callback_data=cb.MENU_INFO)],
         ]
     )
 
@@ -121,11 +309,11 @@ def menu_panel():
 def post_dialog_panel():
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton("⭐ Оценить собеседника", callback_data="post_rate")],
-            [InlineKeyboardButton("🚨 Пожаловаться", callback_data="post_report")],
-            [InlineKeyboardButton("🚫 В чёрный список", callback_data="post_blacklist")],
-            [InlineKeyboardButton("👤 Профиль собеседника", callback_data="post_partner_profile")],
-            [InlineKeyboardButton("🔄 Новый поиск", callback_data="post_newsearch")],
+            [InlineKeyboardButton("⭐ Оценить собеседника", callback_data=cb.POST_RATE)],
+            [InlineKeyboardButton("🚨 Пожаловаться", callback_data=cb.POST_REPORT)],
+            [InlineKeyboardButton("🚫 В чёрный список", callback_data=cb.POST_BLACKLIST)],
+            [InlineKeyboardButton("👤 Профиль собеседника", callback_data=cb.POST_PROFILE)],
+            [InlineKeyboardButton("🔄 Новый поиск", callback_data=cb.POST_NEWSEARCH)],
         ]
     )
 
@@ -133,24 +321,32 @@ def post_dialog_panel():
 def rating_keyboard():
     return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("⭐", callback_data="rate_1"),
-            InlineKeyboardButton("⭐⭐", callback_data="rate_2"),
-            InlineKeyboardButton("⭐⭐⭐", callback_data="rate_3"),
+            InlineKeyboardButton("⭐", callback_data=cb.pack(cb.RATE, 1)),
+            InlineKeyboardButton("⭐⭐", callback_data=cb.pack(cb.RATE, 2)),
+            InlineKeyboardButton("⭐⭐⭐", callback_data=cb.pack(cb.RATE, 3)),
         ],
         [
-            InlineKeyboardButton("⭐⭐⭐⭐", callback_data="rate_4"),
-            InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data="rate_5"),
+            InlineKeyboardButton("⭐⭐⭐⭐", callback_data=cb.pack(cb.RATE, 4)),
+            InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data=cb.pack(cb.RATE, 5)),
         ],
-        [InlineKeyboardButton("❌ Пропустить", callback_data="rate_skip")],
+        [InlineKeyboardButton("❌ Пропустить", callback_data=cb.RATE_SKIP)],
     ])
 
 
+# клавиатуры для записей OUTBOX (в записи хранится только имя)
+_OUTBOX_KB = {
+    "main": lambda: MAIN_KB,
+    "rating": rating_keyboard,
+    "post": lambda: post_dialog_panel(),
+}
+
+
 # ===== ДОБАВЛЕНО: inline-панель на /start когда профиль уже есть =====
 def start_panel():
     return InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton("🔍 Искать", callback_data="menu_search")],
-            [InlineKeyboardButton("📝 Создать профиль заново", callback_data="menu_reset_profile")],
+            [InlineKeyboardButton("🔍 Искать", callback_data=cb.MENU_SEARCH)],
+            [InlineKeyboardButton("📝 Создать профиль заново", callback_data=cb.MENU_RESET)],
         ]
     )
 
@@ -158,9 +354,19 @@ def start_panel():
 # =========================
 # HELPERS (P3 stability)
 # =========================
+def _enqueue(user_id: str):
+    if SEARCH_QUEUE.push(user_id):
+        POOL.add(
+            user_id, PROFILES.get(user_id, {}), _get_priority(user_id), SEARCH_QUEUE[user_id],
+            _get_filters(user_id), _average_rating(user_id),
+        )
+        journal("queue_push", user_id, SEARCH_QUEUE[user_id])
+
+
 def _remove_from_queue(user_id: str):
-    # remove all duplicates
-    SEARCH_QUEUE[:] = [u for u in SEARCH_QUEUE if u != user_id]
+    POOL.remove(user_id)
+    if SEARCH_QUEUE.discard(user_id):
+        journal("queue_pop", user_id)
 
 
 def _set_state(user_id: str, state: str):
@@ -178,43 +384,63 @@ def _sync_state_for(user_id: str):
     _set_state(user_id, STATE_IDLE)
 
 
+def _rebuild_pool():
+    # по времени постановки: порядок в пуле (seq) должен совпадать с порядком ts
+    for u, ts in sorted(SEARCH_QUEUE.items(), key=lambda item: item[1]):
+        if u in PROFILES:
+            POOL.add(u, PROFILES[u], _get_priority(u), ts, _get_filters(u), _average_rating(u))
+            # USER_STATE не сохраняется: без этого восстановленная очередь невидима для подбора
+            _set_state(u, STATE_SEARCH)
+
+
 def _ensure_sync_all():
-    # cleanup queue from users who are in dialogs
-    SEARCH_QUEUE[:] = [u for u in SEARCH_QUEUE if u not in DIALOGS]
-    # remove duplicates while keeping order
-    seen = set()
-    newq = []
-    for u in SEARCH_QUEUE:
-        if u not in seen:
-            seen.add(u)
-            newq.append(u)
-    SEARCH_QUEUE[:] = newq
+    """Разовая чистка при старте: в очереди не должно быть тех, кто в диалоге.
+    Дальше это держат сами _try_match/_break_dialog, дубликатов SearchQueue не допускает."""
+    for u in [u for u in SEARCH_QUEUE if u in DIALOGS]:
+        _remove_from_queue(u)
 
 
 # =========================
 # BLACKLIST helpers
 # =========================
-def _bl_list(user_id: str) -> list[str]:
-    """Получить список заблокированных пользователей с очисткой дубликатов."""
-    user_id = str(user_id)
-    lst = BLACKLIST.get(user_id)
-    if not isinstance(lst, list):
-        lst = []
-        BLACKLIST[user_id] = lst
-    # чистим мусор/дубликаты
-    seen = set()
-    clean = []
-    for x in lst:
-        sx = str(x)
-        if sx not in seen:
-            seen.add(sx)
-            clean.append(sx)
-    BLACKLIST[user_id] = clean
-    return clean
+# В памяти ЧС держится множествами: владелец -> {заблокированные} (dict как
+# упорядоченное множество, чтобы листать в порядке добавления) и обратный индекс
+# цель -> {кто её заблокировал}. Списки в BLACKLIST остаются форматом хранения.
+_BL: dict[str, dict[str, None]] = {}
+_BL_REV: dict[str, set[str]] = {}
+_EMPTY = {}
+
+BL_PAGE_SIZE = 10
+
+
+def _bl_index():
+    """Построить индексы из сохранённых списков (с очисткой мусора/дубликатов)."""
+    _BL.clear()
+    _BL_REV.clear()
+    for owner, lst in list(BLACKLIST.items()):
+        if not isinstance(lst, list):
+            lst = []
+        items = dict.fromkeys(str(x) for x in lst)
+        BLACKLIST[owner] = list(items)
+        if items:
+            _BL[owner] = items
+            for target in items:
+                _BL_REV.setdefault(target, set()).add(owner)
+
+
+def _bl_count(user_id: str) -> int:
+    return len(_BL.get(str(user_id), _EMPTY))
+
+
+def _bl_page(user_id: str, page: int) -> list[str]:
+    """Страница ЧС без копирования всего списка."""
+    start = page * BL_PAGE_SIZE
+    return list(islice(_BL.get(str(user_id), _EMPTY), start, start + BL_PAGE_SIZE))
+
 
 def _bl_has(user_id: str, other_id: str) -> bool:
     """Проверить, заблокирован ли other_id пользователем user_id."""
-    return str(other_id) in _bl_list(str(user_id))
+    return str(other_id) in _BL.get(str(user_id), _EMPTY)
 
 def _bl_add(user_id: str, other_id: str) -> bool:
     """Добавить other_id в черный список user_id. Возвращает True если добавлен."""
@@ -222,57 +448,85 @@ def _bl_add(user_id: str, other_id: str) -> bool:
     other_id = str(other_id)
     if user_id == other_id:
         return False
-    lst = _bl_list(user_id)
-    if other_id in lst:
+    items = _BL.setdefault(user_id, {})
+    if other_id in items:
         return False
-    lst.append(other_id)
-    BLACKLIST[user_id] = lst
+    items[other_id] = None
+    _BL_REV.setdefault(other_id, set()).add(user_id)
+    BLACKLIST.setdefault(user_id, []).append(other_id)
+    journal("bl_add", user_id, other_id)
     return True
 
 def _bl_remove(user_id: str, other_id: str) -> bool:
     """Убрать other_id из черного списка user_id. Возвращает True если убран."""
     user_id = str(user_id)
     other_id = str(other_id)
-    lst = _bl_list(user_id)
-    if other_id not in lst:
+    items = _BL.get(user_id)
+    if not items or other_id not in items:
         return False
-    lst.remove(other_id)
-    BLACKLIST[user_id] = lst
+    del items[other_id]
+    if not items:
+        del _BL[user_id]
+    owners = _BL_REV.get(other_id)
+    if owners is not None:
+        owners.discard(user_id)
+        if not owners:
+            del _BL_REV[other_id]
+    lst = BLACKLIST.get(user_id)
+    if lst and other_id in lst:
+        lst.remove(other_id)
+    journal("bl_remove", user_id, other_id)
+    # оба могут ждать в пуле — теперь они снова подходят друг другу
+    POOL.touch(user_id)
     return True
 
 def _blocked_between(a: str, b: str) -> bool:
     """True если a заблокировал b ИЛИ b заблокировал a (для матчмейкинга)."""
     a = str(a)
     b = str(b)
-    return _bl_has(a, b) or _bl_has(b, a)
+    # оба направления — через прямой и обратный индекс a, без обращения к спискам b
+    return b in _BL.get(a, _EMPTY) or b in _BL_REV.get(a, _EMPTY)
+
+
+_bl_index()
 
 
 # =========================
 # RATING helpers
 # =========================
+_EMPTY_RATING = {"total": 0, "count": 0}
+_RATING_AVG: dict[str, float] = {}      # user_id -> округлённый средний рейтинг (только у кого есть оценки)
+
+
+def _rating_avg_index():
+    """Пересчитать кэш средних из RATINGS (при старте)."""
+    _RATING_AVG.clear()
+    for uid, rating in RATINGS.items():
+        if isinstance(rating, dict) and rating.get("count"):
+            _RATING_AVG[uid] = round(rating["total"] / rating["count"], 1)
+
+
 def _get_rating(user_id: str) -> dict:
-    """Получить рейтинг пользователя {total: int, count: int}."""
-    user_id = str(user_id)
-    rating = RATINGS.get(user_id)
-    if not isinstance(rating, dict):
-        rating = {"total": 0, "count": 0}
-        RATINGS[user_id] = rating
-    return rating
+    """Получить рейтинг пользователя {total: int, count: int} (только чтение, в RATINGS не пишет)."""
+    rating = RATINGS.get(str(user_id))
+    return rating if isinstance(rating, dict) else _EMPTY_RATING
 
 def _add_rating(user_id: str, stars: int):
     """Добавить оценку пользователю (1-5 звезд)."""
     user_id = str(user_id)
-    rating = _get_rating(user_id)
-    rating["total"] += stars
-    rating["count"] += 1
+    old = _get_rating(user_id)
+    rating = {"total": old["total"] + stars, "count": old["count"] + 1}
     RATINGS[user_id] = rating
+    avg = _RATING_AVG[user_id] = round(rating["total"] / rating["count"], 1)
+    journal("rating_add", user_id, rating)
+    POOL.refresh(user_id, rating=avg)
 
 def _average_rating(user_id: str) -> float:
     """Получить средний рейтинг пользователя."""
-    rating = _get_rating(user_id)
-    if rating["count"] == 0:
-        return 0.0
-    return round(rating["total"] / rating["count"], 1)
+    return _RATING_AVG.get(str(user_id), 0.0)
+
+
+_rating_avg_index()
 
 def _rating_stars(user_id: str) -> str:
     """Получить рейтинг в виде звёзд (⭐⭐⭐⭐⭐)."""
@@ -309,7 +563,8 @@ def _set_filter(user_id: str, key: str, value):
     filters = _get_filters(user_id)
     filters[key] = value
     FILTERS[user_id] = filters
-    persist()
+    journal("filter_set", user_id, filters)
+    POOL.refresh(user_id, filters=filters)
 
 
 def _matches_filters(user_id: str, partner_id: str) -> bool:
@@ -348,57 +603,98 @@ def _matches_filters(user_id: str, partner_id: str) -> bool:
     return True
 
 
+def _search_candidates(user_id: str):
+    """Ожидающие из пула, подходящие под пол, возраст и мин. рейтинг из фильтров user_id
+    (в порядке приоритета и очереди, см. MatchPool.candidates)."""
+    user_filters = _get_filters(user_id)
+    gender = GENDER_CODES.get(user_filters.get("gender", "all"))
+    try:
+        min_age = int(user_filters.get("min_age", 16))
+        max_age = int(user_filters.get("max_age", 99))
+    except (ValueError, TypeError):
+        return iter(())
+    try:
+        min_rating = float(user_filters.get("min_rating", 0.0))
+    except (ValueError, TypeError):
+        min_rating = 0.0
+    return POOL.candidates(gender, min_age, max_age, min_rating)
+
+
 # =========================
 # VIP helpers
 # =========================
 import time
 
+_NO_VIP = {"status": "user", "expire_date": None, "activate_date": None}
+_VIP_TIER: dict[str, dict] = {}             # user_id -> запись VIP_STATUS (только действующие, не user)
+_VIP_EXPIRY: list[tuple[int, str]] = []     # min-heap (expire_date, user_id); устаревшие записи пропускаются
+
+
+def _vip_cache(user_id: str):
+    """Обновить кэш уровня и очередь истечения для user_id по VIP_DATA."""
+    vip = VIP_DATA.get(user_id)
+    status = vip.get("status", "user") if isinstance(vip, dict) else "user"
+    if status == "user" or status not in VIP_STATUS:
+        _VIP_TIER.pop(user_id, None)
+        return
+    _VIP_TIER[user_id] = VIP_STATUS[status]
+    expire_date = vip.get("expire_date")
+    if expire_date:
+        heapq.heappush(_VIP_EXPIRY, (expire_date, user_id))
+
+
+def _vip_downgrade(user_id: str, vip: dict):
+    """Истёкший статус: понизить до user, сохранив даты в записи."""
+    vip["status"] = "user"
+    _VIP_TIER.pop(user_id, None)
+    journal("vip_set", user_id, vip)
+
+
+def _vip_index():
+    """Построить кэш уровней из VIP_DATA (при старте). Истёкшие до запуска понижаются
+    молча — уведомление получают только те, чей статус истёк при работающем боте."""
+    _VIP_TIER.clear()
+    _VIP_EXPIRY.clear()
+    now = int(time.time())
+    for uid, vip in VIP_DATA.items():
+        if (isinstance(vip, dict) and vip.get("status", "user") != "user"
+                and vip.get("expire_date") and vip["expire_date"] <= now):
+            _vip_downgrade(uid, vip)
+        else:
+            _vip_cache(uid)
+
+
 def _get_vip_status(user_id: str) -> dict:
     """Получить VIP-статус пользователя."""
     user_id = str(user_id)
-    vip = VIP_DATA.get(user_id)
-    if not isinstance(vip, dict):
-        return {"status": "user", "expire_date": None, "activate_date": None}
-    
-    # Проверяем, не истёк ли VIP
-    if vip.get("expire_date") and vip.get("expire_date") < int(time.time()):
-        # VIP истёк, возвращаем user
-        return {"status": "user", "expire_date": None, "activate_date": None}
-    
-    return vip
+    if user_id not in _VIP_TIER:
+        return _NO_VIP
+    return VIP_DATA[user_id]
 
 
 def _is_vip(user_id: str) -> bool:
     """Проверить, имеет ли пользователь VIP+ статус."""
-    vip = _get_vip_status(user_id)
-    return vip.get("status", "user") in ["vip", "premium", "owner"]
+    return str(user_id) in _VIP_TIER
 
 
 def _is_owner(user_id: str) -> bool:
     """Проверить, является ли пользователь владельцем."""
-    vip = _get_vip_status(user_id)
-    return vip.get("status") == "owner"
+    return _VIP_TIER.get(str(user_id)) is VIP_STATUS["owner"]
 
 
 def _get_vip_emoji(user_id: str) -> str:
     """Получить emoji-бейдж статуса."""
-    vip = _get_vip_status(user_id)
-    status = vip.get("status", "user")
-    return VIP_STATUS.get(status, VIP_STATUS["user"])["emoji"]
+    return _VIP_TIER.get(str(user_id), VIP_STATUS["user"])["emoji"]
 
 
 def _get_vip_name(user_id: str) -> str:
     """Получить название статуса."""
-    vip = _get_vip_status(user_id)
-    status = vip.get("status", "user")
-    return VIP_STATUS.get(status, VIP_STATUS["user"])["name"]
+    return _VIP_TIER.get(str(user_id), VIP_STATUS["user"])["name"]
 
 
 def _get_priority(user_id: str) -> int:
     """Получить приоритет в очереди."""
-    vip = _get_vip_status(user_id)
-    status = vip.get("status", "user")
-    return VIP_STATUS.get(status, VIP_STATUS["user"])["priority"]
+    return _VIP_TIER.get(str(user_id), VIP_STATUS["user"])["priority"]
 
 
 def _set_vip_status(user_id: str, status: str, days: int = 0):
@@ -422,7 +718,43 @@ def _set_vip_status(user_id: str, status: str, days: int = 0):
         "expire_date": expire_date,
         "activate_date": now
     }
-    persist()
+    _vip_cache(user_id)
+    journal("vip_set", user_id, VIP_DATA[user_id])
+    if user_id in POOL:
+        # новый уровень приоритета в очереди
+        POOL.add(user_id, PROFILES.get(user_id, {}), _get_priority(user_id))
+
+
+async def _vip_expiry_job(context: ContextTypes.DEFAULT_TYPE):
+    """Снимает истёкшие VIP-статусы пачкой: понижает до user, переставляет в очереди
+    и (если включено) сообщает пользователю."""
+    now = int(time.time())
+    expired = []
+    while _VIP_EXPIRY and _VIP_EXPIRY[0][0] <= now:
+        expire_date, uid = heapq.heappop(_VIP_EXPIRY)
+        vip = VIP_DATA.get(uid)
+        # статус могли продлить или сменить — тогда запись в куче устарела
+        if (not isinstance(vip, dict) or vip.get("expire_date") != expire_date
+                or vip.get("status", "user") == "user"):
+            continue
+        expired.append((uid, vip.get("status", "user")))
+        _vip_downgrade(uid, vip)
+
+    if not expired:
+        return
+
+    for uid, _ in expired:
+        if uid in POOL:
+            POOL.add(uid, PROFILES.get(uid, {}), _get_priority(uid))
+
+    if not VIP_EXPIRY_NOTIFY:
+        return
+    for uid, status in expired:
+        name = VIP_STATUS.get(status, VIP_STATUS["user"])["name"]
+        notify(uid, f"⏰ Срок статуса {name} истёк.\n\nПодробнее: /vip", lane=LANE_MODERATION)
+
+
+_vip_index()
 
 
 def _format_expire_date(expire_date: int) -> str:
@@ -438,9 +770,9 @@ def _format_expire_date(expire_date: int) -> str:
 def vip_keyboard():
     """Клавиатура управления VIP."""
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💎 Купить VIP (в разработке)", callback_data="vip_buy")],
-        [InlineKeyboardButton("👑 Купить Premium (в разработке)", callback_data="vip_premium")],
-        [InlineKeyboardButton("« Назад", callback_data="vip_back")],
+        [InlineKeyboardButton("💎 Купить VIP (в разработке)", callback_data=cb.VIP_BUY)],
+        [InlineKeyboardButton("👑 Купить Premium (в разработке)", callback_data=cb.VIP_PREMIUM)],
+        [InlineKeyboardButton("« Назад", callback_data=cb.VIP_BACK)],
     ])
 
 
@@ -482,38 +814,38 @@ def vip_text(user_id: str) -> str:
 def filters_main_keyboard():
     """Главная клавиатура фильтров."""
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📅 Возраст", callback_data="filter_age")],
-        [InlineKeyboardButton("⭐ Рейтинг", callback_data="filter_rating")],
-        [InlineKeyboardButton("🔄 Сбросить", callback_data="filter_reset")],
-        [InlineKeyboardButton("« Назад", callback_data="filter_back")],
+        [InlineKeyboardButton("📅 Возраст", callback_data=cb.FILTER_AGE)],
+        [InlineKeyboardButton("⭐ Рейтинг", callback_data=cb.FILTER_RATING)],
+        [InlineKeyboardButton("🔄 Сбросить", callback_data=cb.FILTER_RESET)],
+        [InlineKeyboardButton("« Назад", callback_data=cb.FILTER_MAIN)],
     ])
 
 
 def filter_age_min_keyboard():
     """Выбор мин. возраста."""
-    buttons = [[InlineKeyboardButton(str(i), callback_data=f"filter_age_min_{i}") for i in range(14, 19)]]
-    buttons.append([InlineKeyboardButton("⌨️ Ввести свой", callback_data="filter_age_custom")])
-    buttons.append([InlineKeyboardButton("« Назад", callback_data="filter_age_back")])
+    buttons = [[InlineKeyboardButton(str(i), callback_data=cb.pack(cb.FILTER_AGE_MIN, i)) for i in range(14, 19)]]
+    buttons.append([InlineKeyboardButton("⌨️ Ввести свой", callback_data=cb.FILTER_AGE_CUSTOM)])
+    buttons.append([InlineKeyboardButton("« Назад", callback_data=cb.FILTER_MAIN)])
     return InlineKeyboardMarkup(buttons)
 
 
 def filter_age_max_keyboard():
     """Выбор макс. возраста."""
-    buttons = [[InlineKeyboardButton(str(i), callback_data=f"filter_age_max_{i}") for i in range(14, 19)]]
-    buttons.append([InlineKeyboardButton("⌨️ Ввести свой", callback_data="filter_age_custom")])
-    buttons.append([InlineKeyboardButton("« Назад", callback_data="filter_age_back")])
+    buttons = [[InlineKeyboardButton(str(i), callback_data=cb.pack(cb.FILTER_AGE_MAX, i)) for i in range(14, 19)]]
+    buttons.append([InlineKeyboardButton("⌨️ Ввести свой", callback_data=cb.FILTER_AGE_CUSTOM)])
+    buttons.append([InlineKeyboardButton("« Назад", callback_data=cb.FILTER_MAIN)])
     return InlineKeyboardMarkup(buttons)
 
 
 def filter_rating_keyboard():
     """Выбор мин. рейтинга."""
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⭐ 0+", callback_data="filter_rating_0")],
-        [InlineKeyboardButton("⭐ 1+", callback_data="filter_rating_1")],
-        [InlineKeyboardButton("⭐ 2+", callback_data="filter_rating_2")],
-        [InlineKeyboardButton("⭐ 3+", callback_data="filter_rating_3")],
-        [InlineKeyboardButton("⭐ 4+", callback_data="filter_rating_4")],
-        [InlineKeyboardButton("« Назад", callback_data="filter_rating_back")],
+        [InlineKeyboardButton("⭐ 0+", callback_data=cb.pack(cb.FILTER_MIN_RATING, 0))],
+        [InlineKeyboardButton("⭐ 1+", callback_data=cb.pack(cb.FILTER_MIN_RATING, 1))],
+        [InlineKeyboardButton("⭐ 2+", callback_data=cb.pack(cb.FILTER_MIN_RATING, 2))],
+        [InlineKeyboardButton("⭐ 3+", callback_data=cb.pack(cb.FILTER_MIN_RATING, 3))],
+        [InlineKeyboardButton("⭐ 4+", callback_data=cb.pack(cb.FILTER_MIN_RATING, 4))],
+        [InlineKeyboardButton("« Назад", callback_data=cb.FILTER_MAIN)],
     ])
 
 
@@ -534,8 +866,11 @@ def filters_text(user_id: str) -> str:
     )
 
 
-async def _break_dialog(user_id: str, context: ContextTypes.DEFAULT_TYPE, notify_partner: bool = True):
-    """Break dialog for user; notify partner if existed."""
+async def _break_dialog(user_id: str, context: ContextTypes.DEFAULT_TYPE, notify_partner: bool = True,
+                        own: tuple | None = None):
+    """Break dialog for user; notify partner if existed.
+    own=(text, kb) — сообщение самому user_id, уходит одновременно с уведомлением партнёра
+    (только если диалог был)."""
     partner = DIALOGS.pop(user_id, None)
     if not partner:
         _sync_state_for(user_id)
@@ -544,6 +879,8 @@ async def _break_dialog(user_id: str, context: ContextTypes.DEFAULT_TYPE, notify
 
     # remove reverse link
     DIALOGS.pop(partner, None)
+    FLOOD.forget(user_id)
+    FLOOD.forget(partner)
 
     # states
     _set_state(user_id, STATE_IDLE)
@@ -561,69 +898,75 @@ async def _break_dialog(user_id: str, context: ContextTypes.DEFAULT_TYPE, notify
     PENDING_RATINGS[user_id] = partner
     PENDING_RATINGS[partner] = user_id
     
-    persist()
+    journal("dialog_close", user_id, partner)
+    journal("last_partner_set", user_id, partner)
+    journal("last_partner_set", partner, user_id)
+    journal("pending_rating_set", user_id, partner)
+    journal("pending_rating_set", partner, user_id)
 
+    messages = []
     if notify_partner:
-        try:
-            await context.bot.send_message(
-                int(partner),
-                "❌ Собеседник завершил диалог.\n\n"
-                "Оцени собеседника 👇",
-                reply_markup=rating_keyboard()
-            )
-        except Exception:
-            pass
+        messages.append((partner, "❌ Собеседник завершил диалог.\n\nОцени собеседника 👇", "rating"))
+    if own:
+        messages.append((user_id, *own))
+    if messages:
+        await _notify_pair(*messages)
     return partner
 
 
-async def _try_match(user_id: str, context: ContextTypes.DEFAULT_TYPE):
-    """Try to match user with someone from queue. Returns partner_id or None."""
-    _ensure_sync_all()
-
-    user_priority = _get_priority(user_id)
-
-    # Если VIP с приоритетом - ищем сразу первого подходящего
-    if user_priority > 0:
-        # VIP пользователи получают первого доступного
-        for u in SEARCH_QUEUE:
-            if u == user_id:
-                continue
-            if u in DIALOGS:
-                continue
-            if USER_STATE.get(u) != STATE_SEARCH:
-                continue
-            if _blocked_between(user_id, u):
-                continue
-            if not _matches_filters(user_id, u):
-                continue
-            # Нашли!
-            partner = u
-            break
-    else:
-        # Обычные пользователи - проверяем всех по очереди
-        partner = None
-        for u in SEARCH_QUEUE:
-            if u == user_id:
-                continue
+def _find_partner(user_id: str):
+    """Первый подходящий ожидающий для user_id или None (без изменения состояния)."""
+    # на большом пуле фильтры обеих сторон считаются одним векторным проходом
+    # (порог — см. bench_matchmaking.py)
+    ranked = POOL.ranked_for(user_id) if len(POOL) >= VECTOR_MATCH_THRESHOLD else None
+    if ranked is not None:
+        for u in ranked:
             if u in DIALOGS:
                 continue
             if USER_STATE.get(u) != STATE_SEARCH:
                 continue
             if _blocked_between(user_id, u):
                 continue
-            if not _matches_filters(user_id, u):
-                continue
-            # Также проверяем - не VIP ли u (тогда он уже с кем-то)
-            if _get_priority(u) > 0:
-                # Это VIP, он уже должен был получить match раньше
-                continue
-            partner = u
-            break
-
-    if not partner:
+            return u
         return None
 
-    # remove both from queue
+    # пол, возраст и мин. рейтинг по фильтрам user_id уже отсеял пул
+    # кандидаты идут по уровню VIP/Premium/Owner, а дождавшиеся MATCH_MAX_WAIT — первыми
+    for u in _search_candidates(user_id):
+        if u == user_id:
+            continue
+        if u in DIALOGS:
+            continue
+        if USER_STATE.get(u) != STATE_SEARCH:
+            continue
+        if _blocked_between(user_id, u):
+            continue
+        # фильтры кандидата тоже должны пропускать user_id
+        if not _matches_filters(u, user_id):
+            continue
+        return u
+    return None
+
+
+# Поиск пары и её связывание — одна критическая секция: апдейты обрабатываются
+# параллельно (см. processor.py), и два _try_match не должны забрать одного
+# ожидающего или оставить в DIALOGS половину пары. Внутри секции нет await.
+MATCH_LOCK = asyncio.Lock()
+
+
+def _claimable(user_id: str) -> bool:
+    return USER_STATE.get(user_id) == STATE_SEARCH and user_id not in DIALOGS
+
+
+def _link_pair(user_id: str, partner: str, seeker_waited: bool = True) -> bool:
+    """Снять обоих с очереди и открыть диалог (False — кто-то из них уже занят).
+    seeker_waited=False — user_id только что встал в поиск (_try_match): его ~0 с
+    не пишем в статистику ожидания, иначе p50/p99 уровней тянет к нулю."""
+    if user_id == partner or not (_claimable(user_id) and _claimable(partner)):
+        return False
+    # remove both from queue (с учётом времени ожидания для статистики)
+    POOL.remove(user_id, matched=seeker_waited)
+    POOL.remove(partner, matched=True)
     _remove_from_queue(user_id)
     _remove_from_queue(partner)
 
@@ -638,36 +981,98 @@ async def _try_match(user_id: str, context: ContextTypes.DEFAULT_TYPE):
     LAST_PARTNER[user_id] = partner
     LAST_PARTNER[partner] = user_id
 
-    persist()
+    journal("dialog_open", user_id, partner)
+    journal("last_partner_set", user_id, partner)
+    journal("last_partner_set", partner, user_id)
+    return True
+
 
-    # notify both with partner info
-    # Получаем информацию о партнёре для user_id
-    partner_profile = PROFILES.get(partner, {})
-    partner_rating = _rating_stars(partner)
-    partner_gender = partner_profile.get("gender", "—")
-    partner_age = partner_profile.get("age", "—")
-    
-    # Получаем информацию о user_id для partner
-    user_profile = PROFILES.get(user_id, {})
-    user_rating = _rating_stars(user_id)
-    user_gender = user_profile.get("gender", "—")
-    user_age = user_profile.get("age", "—")
-    
-    # Отправляем партнёру информацию о user_id
-    await context.bot.send_message(
-        int(partner),
+def _match_found_text(about_id: str, tail: str = "Можешь писать сообщение 💬") -> str:
+    """Текст «собеседник найден» с анкетой about_id."""
+    profile = PROFILES.get(about_id, {})
+    return (
         f"✨ Собеседник найден!\n\n"
         f"👤 Информация о собеседнике:\n"
-        f"🧑 Пол: {user_gender}\n"
-        f"🎂 Возраст: {user_age}\n"
-        f"⭐ Рейтинг: {user_rating}\n\n"
-        f"Можешь писать сообщение 💬",
-        reply_markup=MAIN_KB
+        f"🧑 Пол: {profile.get('gender', '—')}\n"
+        f"🎂 Возраст: {profile.get('age', '—')}\n"
+        f"⭐ Рейтинг: {_rating_stars(about_id)}\n\n"
+        f"{tail}"
     )
-    
+
+
+def _unlink_pair(user_id: str, partner: str, requeue=()):
+    """Откатить _link_pair: закрыть диалог; тех, кто в requeue, вернуть в поиск."""
+    DIALOGS.pop(user_id, None)
+    DIALOGS.pop(partner, None)
+    FLOOD.forget(user_id)
+    FLOOD.forget(partner)
+    journal("dialog_close", user_id, partner)
+    for u in (user_id, partner):
+        if u in requeue:
+            _set_state(u, STATE_SEARCH)
+            _enqueue(u)
+            notify(u, "⚠️ Собеседник недоступен — продолжаю поиск…", "main")
+        else:
+            _set_state(u, STATE_IDLE)
+
+
+async def _notify_match(a: str, b: str, tail_a: str = "Можешь писать сообщение 💬",
+                        tail_b: str = "Можешь писать сообщение 💬") -> bool:
+    """Сообщить обоим о найденной паре одновременно. Если кто-то из них заблокировал
+    бота — пара откатывается, доступная сторона продолжает поиск. True — диалог остался."""
+    a_ok, b_ok = await _notify_pair(
+        (a, _match_found_text(b, tail_a), "main"),
+        (b, _match_found_text(a, tail_b), "main"),
+    )
+    if a_ok and b_ok:
+        return True
+    if DIALOGS.get(a) == b:
+        _unlink_pair(a, b, requeue=[u for u, ok in ((a, a_ok), (b, b_ok)) if ok])
+    return False
+
+
+async def _try_match(user_id: str, context: ContextTypes.DEFAULT_TYPE):
+    """Try to match user with someone from queue. Returns partner_id or None.
+    Сообщения «собеседник найден» уходят обоим сразу (см. _notify_match)."""
+    async with MATCH_LOCK:
+        partner = _find_partner(user_id)
+        if not partner or not _link_pair(user_id, partner, seeker_waited=False):
+            return None
+
+    if not await _notify_match(user_id, partner, tail_a="Можешь начинать общение 💬"):
+        return None
     return partner
 
 
+# ===== BATCH MATCHER =====
+async def _batch_match_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сводит уже ожидающих, взаимно подходящих друг другу.
+    Проверяются только те, кто встал в поиск или сменил анкету/фильтры/рейтинг
+    с прошлого прохода (POOL.take_dirty) — по приоритету, каждый берёт первого
+    свободного совместимого кандидата. Работа режется на порции: MATCH_LOCK
+    отпускается между ними, и апдейты не ждут весь проход."""
+    dirty = POOL.take_dirty()
+    if len(POOL) < 2:
+        return
+
+    pairs = []
+    for start in range(0, len(dirty), BATCH_MATCH_CHUNK):
+        async with MATCH_LOCK:
+            for u in dirty[start:start + BATCH_MATCH_CHUNK]:
+                # между порциями пул меняется: кого-то уже свели или сняли с поиска
+                if u not in POOL or not _claimable(u):
+                    continue
+                partner = _find_partner(u)
+                if partner and _link_pair(u, partner):
+                    pairs.append((u, partner))
+        await asyncio.sleep(0)
+
+    if not pairs:
+        return
+
+    await asyncio.gather(*(_notify_match(a, b) for a, b in pairs))
+
+
 # ===== MENU =====
 # =========================
 # HANDLERS
@@ -679,19 +1084,20 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = str(update.effective_user.id)
+    # раз пишет — снова доступен для рассылок
+    _mark_reachable(user_id)
 
     # break anything stale
     await _break_dialog(user_id, context, notify_partner=True)
     _remove_from_queue(user_id)
     _set_state(user_id, STATE_IDLE)
-    persist()
 
     # ДОБАВЛЕНО: если профиль уже есть — показываем его (и кнопка создать заново)
     p = PROFILES.get(user_id)
     if p:
         vip_emoji = _get_vip_emoji(user_id)
         vip_name = _get_vip_name(user_id)
-        bl_count = len(_bl_list(user_id))
+        bl_count = _bl_count(user_id)
         reports_count = int(REPORTS.get(user_id, 0))
 
         await update.message.reply_text(
@@ -708,7 +1114,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    kb = [[InlineKeyboardButton("♂️ Мужской", callback_data="gender_male")]]
+    kb = [[InlineKeyboardButton("♂️ Мужской", callback_data=cb.pack(cb.GENDER, "male"))]]
     await update.message.reply_text(
         "👋 Добро пожаловать!\n\n"
         "Для начала выбери пол 👇",
@@ -718,12 +1124,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ===== REG: GENDER =====
-async def select_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def select_gender(update: Update, context: ContextTypes.DEFAULT_TYPE, gender: str = "male"):
     q = update.callback_query
-    await q.answer()
     context.user_data["step"] = SELECT_AGE
 
-    kb = [[InlineKeyboardButton(str(i), callback_data=f"age_{i}") for i in range(16, 21)]]
+    kb = [[InlineKeyboardButton(str(i), callback_data=cb.pack(cb.AGE, i)) for i in range(16, 21)]]
     await q.edit_message_text(
         "🎂 Выбери возраст:",
         reply_markup=InlineKeyboardMarkup(kb)
@@ -758,56 +1163,49 @@ async def cmd_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ===== VIP CALLBACKS =====
-async def vip_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback-запросов для VIP."""
+async def vip_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "💎 *Покупка VIP*\n\n"
+        "⏳ Покупка временно недоступна\n\n"
+        "🚀 Мы работаем над добавлением оплаты!\n"
+        "Следите за обновлениями 👆",
+        parse_mode="Markdown",
+        reply_markup=vip_keyboard()
+    )
+
+
+async def vip_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "👑 *Покупка Premium*\n\n"
+        "⏳ Покупка временно недоступна\n\n"
+        "🚀 Мы работаем над добавлением оплаты!\n"
+        "Следите за обновлениями 👆",
+        parse_mode="Markdown",
+        reply_markup=vip_keyboard()
+    )
+
+
+async def vip_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
-    
-    user_id = str(q.from_user.id)
-    data = q.data
-    
-    if data == "vip_buy":
-        await q.edit_message_text(
-            "💎 *Покупка VIP*\n\n"
-            "⏳ Покупка временно недоступна\n\n"
-            "🚀 Мы работаем над добавлением оплаты!\n"
-            "Следите за обновлениями 👆",
-            parse_mode="Markdown",
-            reply_markup=vip_keyboard()
-        )
-        return
-    
-    if data == "vip_premium":
-        await q.edit_message_text(
-            "👑 *Покупка Premium*\n\n"
-            "⏳ Покупка временно недоступна\n\n"
-            "🚀 Мы работаем над добавлением оплаты!\n"
-            "Следите за обновлениями 👆",
-            parse_mode="Markdown",
-            reply_markup=vip_keyboard()
-        )
-        return
-    
-    if data == "vip_back":
-        await q.edit_message_text(
-            vip_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=vip_keyboard()
-        )
-        return
+    await q.edit_message_text(
+        vip_text(str(q.from_user.id)),
+        parse_mode="Markdown",
+        reply_markup=vip_keyboard()
+    )
 
 
 # ===== REG: AGE =====
-async def select_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def select_age(update: Update, context: ContextTypes.DEFAULT_TYPE, age: str):
     q = update.callback_query
-    await q.answer()
-
     user_id = str(q.from_user.id)
-    age = q.data.replace("age_", "")
 
     PROFILES[user_id] = {"gender": "♂️", "age": age}
     _set_state(user_id, STATE_IDLE)
-    persist()
+    journal("profile_set", user_id, PROFILES[user_id])
+    if user_id in POOL:
+        # профиль поменялся во время поиска — перекладываем в новую корзину;
+        # add сохраняет прежний seq, так что место в очереди не теряется
+        POOL.add(user_id, PROFILES[user_id], _get_priority(user_id))
 
     await q.edit_message_text("✅ Профиль создан!")
     await context.bot.send_message(
@@ -826,7 +1224,7 @@ async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
 
     # ban check (admins bypass)
-    if is_active(BANS, user_id, "ban") and int(user_id) not in ADMINS:
+    if SANCTIONS.is_active(user_id, "ban") and int(user_id) not in ADMINS:
         await update.message.reply_text(
             "⛔ Доступ ограничен.\n\n"
             "Ты временно заблокирован.",
@@ -859,27 +1257,13 @@ async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # mark searching + enqueue
     _set_state(user_id, STATE_SEARCH)
-    SEARCH_QUEUE.append(user_id)
-    persist()
+    _enqueue(user_id)
 
-    # try immediate match
+    # try immediate match (обе стороны уже получили «собеседник найден»)
     partner = await _try_match(user_id, context)
     if partner:
-        # Получаем информацию о партнёре
-        partner_profile = PROFILES.get(partner, {})
-        partner_rating = _rating_stars(partner)
-        partner_gender = partner_profile.get("gender", "—")
-        partner_age = partner_profile.get("age", "—")
-        
-        await update.message.reply_text(
-            f"✨ Собеседник найден!\n\n"
-            f"👤 Информация о собеседнике:\n"
-            f"🧑 Пол: {partner_gender}\n"
-            f"🎂 Возраст: {partner_age}\n"
-            f"⭐ Рейтинг: {partner_rating}\n\n"
-            f"Можешь начинать общение 💬",
-            reply_markup=MAIN_KB
-        )
+        return
+    if USER_STATE.get(user_id) != STATE_SEARCH:
         return
 
     await update.message.reply_text(
@@ -897,7 +1281,7 @@ async def new_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
 
     # ban check
-    if is_active(BANS, user_id, "ban") and int(user_id) not in ADMINS:
+    if SANCTIONS.is_active(user_id, "ban") and int(user_id) not in ADMINS:
         await update.message.reply_text(
             "⛔ Доступ ограничен.\n\n"
             "Ты временно заблокирован.",
@@ -905,20 +1289,20 @@ async def new_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # break dialog if exists
-    await _break_dialog(user_id, context, notify_partner=True)
+    # break dialog if exists (уведомление партнёру и ответ себе — одновременно)
+    partner = await _break_dialog(user_id, context, notify_partner=True, own=("🔄 Начинаю новый поиск…", "main"))
 
     # also remove from queue
     _remove_from_queue(user_id)
 
     # start fresh search
     _set_state(user_id, STATE_IDLE)
-    persist()
 
-    await update.message.reply_text(
-        "🔄 Начинаю новый поиск…",
-        reply_markup=MAIN_KB
-    )
+    if not partner:
+        await update.message.reply_text(
+            "🔄 Начинаю новый поиск…",
+            reply_markup=MAIN_KB
+        )
     await start_search(update, context)
 
 
@@ -929,24 +1313,20 @@ async def end_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = str(update.effective_user.id)
 
-    # If in dialog -> notify partner
-    partner = await _break_dialog(user_id, context, notify_partner=True)
+    # If in dialog -> notify partner; панель после диалога (жалоба / ЧС / новый поиск / профиль)
+    # уходит одновременно с уведомлением партнёра
+    partner = await _break_dialog(
+        user_id, context, notify_partner=True,
+        own=("⛔ Диалог завершён.\n\nЧто будем делать дальше?", "post"),
+    )
 
     # If in queue -> remove
     _remove_from_queue(user_id)
 
     # state idle
     _set_state(user_id, STATE_IDLE)
-    persist()
 
-    # ДОБАВЛЕНО: панель после диалога (жалоба / ЧС / новый поиск / профиль)
-    if partner:
-        await update.message.reply_text(
-            "⛔ Диалог завершён.\n\n"
-            "Что будем делать дальше?",
-            reply_markup=post_dialog_panel()
-        )
-    else:
+    if not partner:
         await update.message.reply_text(
             "⛔ Диалог завершён.\n\n"
             "Ты вышел из чата.",
@@ -963,7 +1343,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     p = PROFILES.get(user_id)
 
     if not p:
-        kb = [[InlineKeyboardButton("♂️ Мужской", callback_data="gender_male")]]
+        kb = [[InlineKeyboardButton("♂️ Мужской", callback_data=cb.pack(cb.GENDER, "male"))]]
         await update.message.reply_text(
             "👤 Профиль не найден.\n\n"
             "Давай создадим его 👇",
@@ -972,7 +1352,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     vip_status = "Обычный"  # задел под VIP/Premium
-    bl_count = len(_bl_list(user_id))
+    bl_count = _bl_count(user_id)
     reports_count = int(REPORTS.get(user_id, 0))
     rating_display = _rating_stars(user_id)
     rating_count = _get_rating(user_id)["count"]
@@ -1023,9 +1403,48 @@ async def report_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Жалобы копятся в REPORT_DIGEST и уходят модераторам сводкой по нарушителю
+REPORT_DIGEST = ReportDigest(REPORT_DEDUP_WINDOW, max(1, round(MAX_REPORTS * REPORT_ESCALATE_RATIO)))
+
+
+async def _send_report_digest(bot, target_id: str, entry: dict, urgent: bool = False):
+    text = digest_text(target_id, entry, REPORTS.get(target_id, 0), urgent, await _username(target_id))
+    send_later(LANE_MODERATION, MOD_LOG_CHAT_ID, lambda: bot.send_message(
+        MOD_LOG_CHAT_ID,
+        text,
+        reply_markup=admin_actions_keyboard(target_id),
+        parse_mode="Markdown"
+    ), "MOD LOG")
+
+
+async def _report_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    for target_id, entry in REPORT_DIGEST.flush():
+        await _send_report_digest(context.bot, target_id, entry)
+
+
+async def _file_report(bot, reporter_id: str, target_id: str, reason: str) -> bool:
+    """Учесть жалобу и поставить её в сводку. False — повтор, не учтена."""
+    if REPORT_DIGEST.is_duplicate(reporter_id, target_id):
+        return False
+
+    add_report(
+        reporter_id,
+        target_id,
+        reason,
+        {"reports": REPORTS, "bans": BANS, "max_reports": MAX_REPORTS}
+    )
+    journal("report_set", target_id, REPORTS[target_id])
+    if target_id in BANS:
+        journal("sanction_set", target_id, BANS[target_id])
+
+    # в мод-лог — сводкой раз в REPORT_DIGEST_INTERVAL, сразу — только при пороге
+    if REPORT_DIGEST.add(reporter_id, target_id, reason, REPORTS[target_id]):
+        await _send_report_digest(bot, target_id, REPORT_DIGEST.take(target_id), urgent=True)
+    return True
+
+
+async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE, reason: str):
     q = update.callback_query
-    await q.answer()
 
     reporter = q.from_user
 
@@ -1038,23 +1457,9 @@ async def report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("ℹ️ Нет данных о собеседнике для жалобы.")
         return
 
-    target_user = await context.bot.get_chat(int(target_id))
-    reason = q.data.replace("report_", "")
-
-    add_report(
-        str(reporter.id),
-        target_id,
-        reason,
-        {"reports": REPORTS, "bans": BANS, "max_reports": MAX_REPORTS}
-    )
-    persist()
-
-    await context.bot.send_message(
-        MOD_LOG_CHAT_ID,
-        report_text(reporter, target_user, reason, REPORTS.get(target_id, 0)),
-        reply_markup=admin_actions_keyboard(target_id),
-        parse_mode="Markdown"
-    )
+    if not await _file_report(context.bot, str(reporter.id), target_id, reason):
+        await q.edit_message_text("ℹ️ Жалоба на этого собеседника уже отправлена.")
+        return
 
     await q.edit_message_text("✅ Жалоба отправлена. Спасибо!")
 
@@ -1068,12 +1473,12 @@ def _blacklist_kb(user_id: str, partner_id: str | None = None):
     if partner_id:
         in_bl = _bl_has(user_id, partner_id)
         if in_bl:
-            rows.append([InlineKeyboardButton("✅ Убрать собеседника из ЧС", callback_data=f"bl_rm_{partner_id}")])
+            rows.append([InlineKeyboardButton("✅ Убрать собеседника из ЧС", callback_data=cb.pack(cb.BL_REMOVE, partner_id))])
         else:
-            rows.append([InlineKeyboardButton("⛔ Добавить собеседника в ЧС", callback_data=f"bl_add_{partner_id}")])
+            rows.append([InlineKeyboardButton("⛔ Добавить собеседника в ЧС", callback_data=cb.pack(cb.BL_ADD, partner_id))])
 
-    rows.append([InlineKeyboardButton("📋 Показать мой ЧС", callback_data="bl_list")])
-    rows.append([InlineKeyboardButton("❌ Закрыть", callback_data="bl_close")])
+    rows.append([InlineKeyboardButton("📋 Показать мой ЧС", callback_data=cb.BL_LIST)])
+    rows.append([InlineKeyboardButton("❌ Закрыть", callback_data=cb.BL_CLOSE)])
     return InlineKeyboardMarkup(rows)
 
 
@@ -1084,7 +1489,7 @@ async def cmd_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     partner_id = DIALOGS.get(user_id)  # если сейчас в диалоге
 
-    count = len(_bl_list(user_id))
+    count = _bl_count(user_id)
     text = (
         "⛔ *Чёрный список*\n\n"
         f"В списке: *{count}* пользователей.\n\n"
@@ -1099,199 +1504,267 @@ async def cmd_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def blacklist_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-
-    user_id = str(q.from_user.id)
-    data = q.data
-
-    if data == "bl_close":
-        await q.edit_message_text("✅ Закрыто.")
-        return
-
-    # показать список
-    if data == "bl_list":
-        lst = _bl_list(user_id)
-        if not lst:
-            await q.edit_message_text(
-                "📋 *Чёрный список пуст.*",
-                parse_mode="Markdown",
-                reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
-            )
-            return
-
-        # кнопки удаления (первые 10, чтобы не раздувать)
-        rows = []
-        show = lst[:10]
-        for uid in show:
-            rows.append([InlineKeyboardButton(f"❌ Убрать {uid}", callback_data=f"bl_rm_{uid}")])
-        rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="bl_back")])
+async def bl_close(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text("✅ Закрыто.")
 
-        text = "📋 *Твой ЧС:*\n\n" + "\n".join([f"• `{x}`" for x in show])
-        if len(lst) > 10:
-            text += f"\n\n…и ещё *{len(lst) - 10}* (пока не показываю, чтобы не спамить кнопками)."
 
-        await q.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(rows))
-        return
+async def bl_list(update: Update, context: ContextTypes.DEFAULT_TYPE, page: str = "0"):
+    """Показать ЧС постранично."""
+    q = update.callback_query
+    user_id = str(q.from_user.id)
 
-    if data == "bl_back":
+    total = _bl_count(user_id)
+    if not total:
         await q.edit_message_text(
-            "⛔ *Чёрный список*",
+            "📋 *Чёрный список пуст.*",
             parse_mode="Markdown",
             reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
         )
         return
 
-    # добавить
-    if data.startswith("bl_add_"):
-        target_id = data.replace("bl_add_", "")
-        ok = _bl_add(user_id, target_id)
-        persist()
+    pages = (total + BL_PAGE_SIZE - 1) // BL_PAGE_SIZE
+    page = max(0, min(int(page), pages - 1))
+    show = _bl_page(user_id, page)
 
-        # если сейчас был в диалоге с ним — разрываем сразу
-        if DIALOGS.get(user_id) == target_id:
-            await _break_dialog(user_id, context, notify_partner=True)
+    # кнопки удаления — только для текущей страницы
+    rows = []
+    for uid in show:
+        rows.append([InlineKeyboardButton(f"❌ Убрать {uid}", callback_data=cb.pack(cb.BL_REMOVE, uid))])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=cb.pack(cb.BL_LIST, page - 1)))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=cb.pack(cb.BL_LIST, page + 1)))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=cb.BL_BACK)])
 
-        await q.edit_message_text(
-            "✅ Добавлен в ЧС." if ok else "ℹ️ Он уже был в ЧС.",
-            reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
-        )
-        return
+    text = f"📋 *Твой ЧС* ({page + 1}/{pages}, всего {total}):\n\n" + "\n".join([f"• `{x}`" for x in show])
 
-    # убрать
-    if data.startswith("bl_rm_"):
-        target_id = data.replace("bl_rm_", "")
-        ok = _bl_remove(user_id, target_id)
-        persist()
-        await q.edit_message_text(
-            "✅ Убран из ЧС." if ok else "ℹ️ Его нет в ЧС.",
-            reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
-        )
-        return
+    await q.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(rows))
 
 
-# ===== ДОБАВЛЕНО: POST actions (после диалога) =====
-async def post_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def bl_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    user_id = str(q.from_user.id)
+    await q.edit_message_text(
+        "⛔ *Чёрный список*",
+        parse_mode="Markdown",
+        reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
+    )
 
+
+async def bl_add(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = update.callback_query
     user_id = str(q.from_user.id)
-    partner = LAST_PARTNER.get(user_id)
+    ok = _bl_add(user_id, target_id)
 
-    if q.data == "post_newsearch":
-        # запускаем новый поиск
-        try:
-            await q.edit_message_text("🔄 Запускаю новый поиск…")
-        except Exception:
-            pass
-        # “фальш” update.message нет, но start_search проверяет update.message
-        # поэтому шлём сообщение и далее запускаем через send_message → пользователь нажмёт кнопку
-        await context.bot.send_message(
-            int(user_id),
-            "Нажми «🔍 Искать», чтобы начать новый поиск 👇",
-            reply_markup=MAIN_KB
-        )
-        return
+    # если сейчас был в диалоге с ним — разрываем сразу
+    if DIALOGS.get(user_id) == target_id:
+        await _break_dialog(user_id, context, notify_partner=True)
 
+    await q.edit_message_text(
+        "✅ Добавлен в ЧС." if ok else "ℹ️ Он уже был в ЧС.",
+        reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
+    )
+
+
+async def bl_remove(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = update.callback_query
+    user_id = str(q.from_user.id)
+    ok = _bl_remove(user_id, target_id)
+    await q.edit_message_text(
+        "✅ Убран из ЧС." if ok else "ℹ️ Его нет в ЧС.",
+        reply_markup=_blacklist_kb(user_id, DIALOGS.get(user_id))
+    )
+
+
+# ===== ДОБАВЛЕНО: POST actions (после диалога) =====
+async def post_newsearch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    user_id = str(q.from_user.id)
+    # запускаем новый поиск
+    try:
+        await q.edit_message_text("🔄 Запускаю новый поиск…")
+    except Exception:
+        pass
+    # “фальш” update.message нет, но start_search проверяет update.message
+    # поэтому шлём сообщение и далее запускаем через send_message → пользователь нажмёт кнопку
+    await context.bot.send_message(
+        int(user_id),
+        "Нажми «🔍 Искать», чтобы начать новый поиск 👇",
+        reply_markup=MAIN_KB
+    )
+
+
+async def _last_partner(q) -> str | None:
+    """Последний собеседник для кнопок после диалога (или сообщение, что его нет)."""
+    partner = LAST_PARTNER.get(str(q.from_user.id))
     if not partner:
         await q.edit_message_text("ℹ️ Нет данных о последнем собеседнике.")
-        return
+    return partner
 
-    if q.data == "post_blacklist":
-        ok = _bl_add(user_id, partner)
-        persist()
-        await q.edit_message_text(
-            "🚫 Добавлен в чёрный список." if ok else "ℹ️ Он уже в твоём чёрном списке."
-        )
+
+async def post_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    partner = await _last_partner(q)
+    if not partner:
         return
+    ok = _bl_add(str(q.from_user.id), partner)
+    await q.edit_message_text(
+        "🚫 Добавлен в чёрный список." if ok else "ℹ️ Он уже в твоём чёрном списке."
+    )
 
-    if q.data == "post_partner_profile":
-        p = PROFILES.get(partner)
-        if not p:
-            await q.edit_message_text("ℹ️ Профиль собеседника не найден.")
-            return
 
-        await q.edit_message_text(
-            f"👤 *ПРОФИЛЬ СОБЕСЕДНИКА*\n\n"
-            f"🆔 ID: `{partner}`\n"
-            f"🧑 Пол: {p.get('gender', '—')}\n"
-            f"🎂 Возраст: {p.get('age', '—')}\n\n"
-            f"🚨 Жалоб на него: *{int(REPORTS.get(partner, 0))}*\n"
-            f"🚫 В твоём ЧС: *{'Да' if _bl_has(user_id, partner) else 'Нет'}*",
-            parse_mode="Markdown",
-        )
+async def post_partner_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    partner = await _last_partner(q)
+    if not partner:
+        return
+    user_id = str(q.from_user.id)
+    p = PROFILES.get(partner)
+    if not p:
+        await q.edit_message_text("ℹ️ Профиль собеседника не найден.")
         return
 
-    if q.data == "post_report":
-        # показываем причины (а обработает report_reason по report_*)
-        await q.edit_message_text("🚨 Выбери причину жалобы:", reply_markup=report_keyboard())
+    await q.edit_message_text(
+        f"👤 *ПРОФИЛЬ СОБЕСЕДНИКА*\n\n"
+        f"🆔 ID: `{partner}`\n"
+        f"🧑 Пол: {p.get('gender', '—')}\n"
+        f"🎂 Возраст: {p.get('age', '—')}\n\n"
+        f"🚨 Жалоб на него: *{int(REPORTS.get(partner, 0))}*\n"
+        f"🚫 В твоём ЧС: *{'Да' if _bl_has(user_id, partner) else 'Нет'}*",
+        parse_mode="Markdown",
+    )
+
+
+async def post_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not await _last_partner(q):
         return
+    # показываем причины (а обработает report_reason по cb.REPORT)
+    await q.edit_message_text("🚨 Выбери причину жалобы:", reply_markup=report_keyboard())
 
-    if q.data == "post_rate":
-        # показываем клавиатуру оценки
-        await q.edit_message_text("⭐ Оцени собеседника:", reply_markup=rating_keyboard())
+
+async def post_rate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not await _last_partner(q):
         return
+    # показываем клавиатуру оценки
+    await q.edit_message_text("⭐ Оцени собеседника:", reply_markup=rating_keyboard())
 
 
 # ===== ДОБАВЛЕНО: обработчик оценок =====
-async def rating_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def rate_skip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    user_id = str(q.from_user.id)
+    PENDING_RATINGS.pop(user_id, None)
+    journal("pending_rating_del", user_id)
+    await q.edit_message_text("✅ Оценка пропущена.")
+
 
+async def rate_partner(update: Update, context: ContextTypes.DEFAULT_TYPE, stars: str):
+    """Получить оценку (1-5)."""
+    q = update.callback_query
     user_id = str(q.from_user.id)
-    
-    if q.data == "rate_skip":
-        # пропустить оценку
-        PENDING_RATINGS.pop(user_id, None)
-        persist()
-        await q.edit_message_text("✅ Оценка пропущена.")
-        return
+    stars = int(stars)
+    partner = PENDING_RATINGS.pop(user_id, None)
 
-    # получить оценку (1-5)
-    if q.data.startswith("rate_"):
-        stars = int(q.data.replace("rate_", ""))
-        partner = PENDING_RATINGS.pop(user_id, None)
-        
-        if not partner:
-            await q.edit_message_text("ℹ️ Нет данных о собеседнике для оценки.")
-            return
-        
-        # добавить оценку
-        _add_rating(partner, stars)
-        persist()
-        
-        await q.edit_message_text(
-            f"✅ Спасибо за оценку!\n\n"
-            f"Ты поставил {'⭐' * stars}"
-        )
+    if not partner:
+        await q.edit_message_text("ℹ️ Нет данных о собеседнике для оценки.")
         return
 
+    # добавить оценку
+    _add_rating(partner, stars)
+    journal("pending_rating_del", user_id)
 
-# ===== ДОБАВЛЕНО: menu actions на /start =====
-async def menu_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
+    await q.edit_message_text(
+        f"✅ Спасибо за оценку!\n\n"
+        f"Ты поставил {'⭐' * stars}"
+    )
 
-    user_id = str(q.from_user.id)
 
-    if q.data == "menu_reset_profile":
-        # удаляем только профиль пользователя (как ты и хотел — создать заново)
-        PROFILES.pop(user_id, None)
-        persist()
+# ===== BROADCAST =====
+BROADCAST: Broadcast | None = None   # текущая рассылка (одна за раз)
+BROADCAST_TASK: asyncio.Task | None = None   # её задача; не через app.create_task — stop() ждал бы всю рассылку
 
-        kb = [[InlineKeyboardButton("♂️ Мужской", callback_data="gender_male")]]
-        await q.edit_message_text(
-            "📝 Ок, создаём профиль заново.\n\nВыбери пол:",
-            reply_markup=InlineKeyboardMarkup(kb)
+
+def _mark_unreachable(user_id: str):
+    if user_id not in UNREACHABLE:
+        UNREACHABLE[user_id] = int(time.time())
+        journal("unreachable_set", user_id, UNREACHABLE[user_id])
+
+
+def _mark_reachable(user_id: str):
+    if UNREACHABLE.pop(user_id, None) is not None:
+        journal("unreachable_del", user_id)
+
+
+def _broadcast_keyboard(bc: Broadcast):
+    if bc.finished:
+        return None
+    toggle = (InlineKeyboardButton("▶️ Продолжить", callback_data=cb.BROADCAST_RESUME) if bc.state == PAUSED
+              else InlineKeyboardButton("⏸ Пауза", callback_data=cb.BROADCAST_PAUSE))
+    return InlineKeyboardMarkup([[toggle, InlineKeyboardButton("⛔ Отменить", callback_data=cb.BROADCAST_CANCEL)]])
+
+
+def _broadcast_text(bc: Broadcast) -> str:
+    title = {
+        RUNNING: "📣 Рассылка идёт",
+        PAUSED: "⏸ Рассылка на паузе",
+        CANCELLED: "⛔ Рассылка отменена",
+    }.get(bc.state, "✅ Рассылка завершена")
+    percent = bc.done * 100 // bc.total if bc.total else 100
+    return (
+        f"{title}\n\n"
+        f"Обработано: {bc.done}/{bc.total} ({percent}%)\n"
+        f"✅ Доставлено: {bc.sent}\n"
+        f"🚫 Заблокировали бота: {bc.blocked}\n"
+        f"⚠️ Ошибок: {bc.failed}\n"
+        f"⏱ Идёт: {int(time.time() - bc.started)}с"
+    )
+
+
+async def _broadcast_progress(bot, bc: Broadcast):
+    """Обновить сообщение с прогрессом у админа (ошибки не мешают рассылке)."""
+    try:
+        await bot.edit_message_text(
+            _broadcast_text(bc),
+            chat_id=bc.admin_chat,
+            message_id=bc.progress_message,
+            reply_markup=_broadcast_keyboard(bc)
         )
-        return
+    except Exception as e:
+        if "not modified" not in str(e):
+            print("❌ BROADCAST PROGRESS:", e)
+
+
+async def _run_broadcast(bot, bc: Broadcast):
+    global BROADCAST
+    BROADCAST = bc
+
+    async def send(uid):
+        return await SENDER.send(LANE_BROADCAST, uid, lambda: bot.send_message(int(uid), bc.text))
+
+    try:
+        await bc.run(
+            send,
+            _mark_unreachable,
+            lambda b: _broadcast_progress(bot, b),
+            concurrency=BROADCAST_CONCURRENCY,
+            checkpoint_every=BROADCAST_CHECKPOINT_EVERY,
+            progress_interval=BROADCAST_PROGRESS_INTERVAL,
+        )
+    except Exception as e:
+        print("❌ BROADCAST:", e)
+    finally:
+        if BROADCAST is bc and bc.finished:
+            BROADCAST = None
 
-    if q.data == "menu_search":
-        # удобно — просто подсказка и клавиатура
-        await q.edit_message_text("Нажми «🔍 Искать» снизу 👇")
-        await context.bot.send_message(int(user_id), "Жми «🔍 Искать» 👇", reply_markup=MAIN_KB)
-        return
+
+def _start_broadcast(bot, bc: Broadcast):
+    global BROADCAST_TASK
+    BROADCAST_TASK = asyncio.create_task(_run_broadcast(bot, bc))
 
 
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1301,113 +1774,320 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMINS:
         return
 
+    if BROADCAST is not None and not BROADCAST.finished:
+        await update.message.reply_text("ℹ️ Уже идёт рассылка — дождись её или отмени.")
+        return
+
     text = update.message.text.replace("/broadcast", "", 1).strip()
     if not text:
         await update.message.reply_text("❌ Напиши текст после /broadcast")
         return
 
-    sent = 0
-    for uid in PROFILES.keys():
-        try:
-            await context.bot.send_message(int(uid), text)
-            sent += 1
-        except:
-            pass
+    # заблокировавших бота пропускаем сразу
+    recipients = [uid for uid in list(PROFILES) if uid not in UNREACHABLE]
+    bc = Broadcast(text, recipients, update.effective_chat.id)
+    msg = await update.message.reply_text(_broadcast_text(bc), reply_markup=_broadcast_keyboard(bc))
+    bc.progress_message = msg.message_id
+    await bc.save()
+
+    # рассылка идёт в фоне самой младшей полосой — живые диалоги её обгоняют
+    _start_broadcast(context.bot, bc)
+
+
+async def _broadcast_control(update: Update, action):
+    q = update.callback_query
+    if not is_admin(q.from_user.id):
+        return
+    if BROADCAST is None or BROADCAST.finished:
+        await q.edit_message_text("ℹ️ Активной рассылки нет.")
+        return
+    action(BROADCAST)
+    if not BROADCAST.finished:
+        await BROADCAST.checkpoint()
+    await q.edit_message_text(_broadcast_text(BROADCAST), reply_markup=_broadcast_keyboard(BROADCAST))
+
+
+async def broadcast_pause(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _broadcast_control(update, Broadcast.pause)
+
+
+async def broadcast_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _broadcast_control(update, Broadcast.resume)
+
+
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _broadcast_control(update, Broadcast.cancel)
+
+
+def _wait_stats_text() -> str:
+    names = {v["priority"]: v["name"] for v in VIP_STATUS.values()}
+    lines = [
+        f"{names.get(prio, prio)}: {w['n']} подборов, ср. {w['avg']}с, p50 {w['p50']}с, p99 {w['p99']}с"
+        for prio, w in sorted(POOL.wait_stats().items())
+    ]
+    return ("\n\n⏳ Ожидание подбора:\n" + "\n".join(lines)) if lines else ""
+
+
+def _sender_stats_text() -> str:
+    lines = [
+        f"{name}: в очереди {st['depth']}, отправлено {st['sent']}, ошибок {st['failed']}, "
+        f"429: {st['retry_after']}, ожидание ср. {st['avg_ms']} мс, p99 {st['p99_ms']} мс"
+        for name, st in SENDER.stats().items()
+    ]
+    return "\n\n📤 Исходящие:\n" + "\n".join(lines)
+
+
+def _outbox_stats_text() -> str:
+    st = OUTBOX.stats
+    return (
+        f"\n\n📬 Outbox: ждут {len(OUTBOX)}, доставлено {st['delivered']}, повторов {st['retried']}, "
+        f"заблокировали {st['blocked']}, брошено {st['dropped']}"
+    )
+
+
+def _phrases_stats_text() -> str:
+    top = ", ".join(f"«{phrase}» ×{n}" for phrase, n in PHRASES.top())
+    return f"\n🔤 Фильтр фраз: шаблонов {len(PHRASES)}" + (f"; чаще всего: {top}" if top else "")
+
+
+def _moderation_stats_text() -> str:
+    st = REPORT_DIGEST.stats
+    return (
+        f"\n\n🛡 Модерация: банов {SANCTIONS.count('ban')}, мутов {SANCTIONS.count('mute')}; "
+        f"жалоб принято {st['accepted']}, повторов {st['duplicates']}, "
+        f"сводок {st['digests']}, срочных {st['escalations']}; "
+        f"автомутов за флуд {sum(FLOOD.stats.values())}"
+        + _phrases_stats_text()
+    )
+
+
+def _user_cache_stats_text() -> str:
+    st = USERS.stats
+    return (
+        f"\n\n🗂 Кэш имён: {len(USERS)}, попаданий {st['hits']}, запросов {st['misses']}, "
+        f"объединено {st['coalesced']}, ошибок {st['errors']}"
+    )
 
-    await update.message.reply_text(f"✅ Рассылка отправлена ({sent} пользователей)")
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMINS:
         return
+    st = STORE.stats()
     await update.message.reply_text(
         f"👥 Пользователей: {len(PROFILES)}\n"
         f"💬 В диалогах: {len(DIALOGS) // 2}\n"
-        f"🔍 В поиске: {len(SEARCH_QUEUE)}"
+        f"🔍 В поиске: {len(SEARCH_QUEUE)}\n\n"
+        f"💾 Сохранений: {st['flushes']} (объединено: {st['coalesced']}, ошибок: {st['errors']}, "
+        f"секций записано: {st['sections_written']})\n"
+        f"📝 Журнал: {st['records']} записей, {st['journal_bytes']} байт, fsync: {st['syncs']}\n"
+        f"⏱ Запись: посл. {st['last_ms']} мс, ср. {st['avg_ms']} мс, макс. {st['max_ms']} мс"
+        + _wait_stats_text()
+        + _sender_stats_text()
+        + _outbox_stats_text()
+        + _moderation_stats_text()
+        + _user_cache_stats_text()
     )
 
 
 # ===== ADMIN =====
-async def admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
+def _journal_sanctions(target_id: str):
+    """Записать текущий пакет санкций пользователя (или его удаление)."""
+    if target_id in BANS:
+        journal("sanction_set", target_id, BANS[target_id])
+    else:
+        journal("sanction_clear", target_id)
+
 
+async def _admin_query(update: Update):
+    """callback_query админа или None (с ответом «нет доступа»)."""
+    q = update.callback_query
     if not is_admin(q.from_user.id):
         await q.edit_message_text("⛔ Нет доступа.")
+        return None
+    return q
+
+
+async def _deny_self_or_admin(q, target_id: str, text: str) -> bool:
+    if target_id == str(q.from_user.id) or int(target_id) in ADMINS:
+        await q.edit_message_text(text)
+        return True
+    return False
+
+
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = await _admin_query(update)
+    if q is None:
+        return
+    p = PROFILES.get(target_id)
+    if not p:
+        await q.edit_message_text("Профиль не найден.")
         return
 
-    data = q.data
-    data_pack = {"bans": BANS}
+    await q.edit_message_text(
+        f"👤 Профиль\n\n"
+        f"ID: `{target_id}`\n"
+        f"Ник: {await _username(target_id)}\n"
+        f"Пол: {p['gender']}\n"
+        f"Возраст: {p['age']}\n"
+        f"Жалоб: {REPORTS.get(target_id, 0)}\n"
+        f"Бан: {'Да' if SANCTIONS.is_active(target_id, 'ban') else 'Нет'}\n"
+        f"Мут: {'Да' if SANCTIONS.is_active(target_id, 'mute') else 'Нет'}",
+        parse_mode="Markdown",
+        reply_markup=admin_actions_keyboard(target_id)
+    )
 
-    if data.startswith("admin_profile_"):
-        target_id = data.replace("admin_profile_", "")
-        p = PROFILES.get(target_id)
-        if not p:
-            await q.edit_message_text("Профиль не найден.")
-            return
 
-        await q.edit_message_text(
-            f"👤 Профиль\n\n"
-            f"ID: `{target_id}`\n"
-            f"Пол: {p['gender']}\n"
-            f"Возраст: {p['age']}\n"
-            f"Жалоб: {REPORTS.get(target_id, 0)}\n"
-            f"Бан: {'Да' if is_active(BANS, target_id, 'ban') else 'Нет'}\n"
-            f"Мут: {'Да' if is_active(BANS, target_id, 'mute') else 'Нет'}",
-            parse_mode="Markdown",
-            reply_markup=admin_actions_keyboard(target_id)
-        )
+async def admin_ban(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = await _admin_query(update)
+    if q is None or await _deny_self_or_admin(q, target_id, "⚠️ Нельзя банить администратора или себя."):
         return
+    set_sanction("ban", target_id, SANCTION_PACK, q.from_user.id, 24 * 60, "бан 24ч")
+    _journal_sanctions(target_id)
+    notify(target_id, "🚫 Ты заблокирован на 24 часа за нарушение правил.", lane=LANE_MODERATION)
+    await q.edit_message_text(
+        "🚫 Бан на 24 часа установлен.",
+        reply_markup=admin_actions_keyboard(target_id)
+    )
 
-    if data.startswith("admin_ban24_"):
-        target_id = data.replace("admin_ban24_", "")
-        if target_id == str(q.from_user.id) or int(target_id) in ADMINS:
-            await q.edit_message_text("⚠️ Нельзя банить администратора или себя.")
-            return
 
-        set_sanction("ban", target_id, data_pack, q.from_user.id, 24 * 60, "бан 24ч")
-        persist()
-        await q.edit_message_text(
-            "🚫 Бан на 24 часа установлен.",
-            reply_markup=admin_actions_keyboard(target_id)
-        )
+async def admin_unban(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = await _admin_query(update)
+    if q is None:
         return
+    clear_sanction("ban", target_id, SANCTION_PACK, q.from_user.id)
+    _journal_sanctions(target_id)
+    await q.edit_message_text(
+        "🔓 Бан снят.",
+        reply_markup=admin_actions_keyboard(target_id)
+    )
 
-    if data.startswith("admin_unban_"):
-        target_id = data.replace("admin_unban_", "")
-        clear_sanction("ban", target_id, data_pack, q.from_user.id)
-        persist()
-        await q.edit_message_text(
-            "🔓 Бан снят.",
-            reply_markup=admin_actions_keyboard(target_id)
-        )
+
+async def admin_mute(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = await _admin_query(update)
+    if q is None or await _deny_self_or_admin(q, target_id, "⚠️ Нельзя мутить администратора или себя."):
         return
+    set_sanction("mute", target_id, SANCTION_PACK, q.from_user.id, 30, "мут 30м")
+    _journal_sanctions(target_id)
+    notify(target_id, "🔇 Тебе выдан мут на 30 минут за нарушение правил.", lane=LANE_MODERATION)
+    await q.edit_message_text(
+        "🔇 Мут на 30 минут установлен.",
+        reply_markup=admin_actions_keyboard(target_id)
+    )
 
-    if data.startswith("admin_mute30_"):
-        target_id = data.replace("admin_mute30_", "")
-        if target_id == str(q.from_user.id) or int(target_id) in ADMINS:
-            await q.edit_message_text("⚠️ Нельзя мутить администратора или себя.")
-            return
 
-        set_sanction("mute", target_id, data_pack, q.from_user.id, 30, "мут 30м")
-        persist()
-        await q.edit_message_text(
-            "🔇 Мут на 30 минут установлен.",
-            reply_markup=admin_actions_keyboard(target_id)
-        )
+async def admin_unmute(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id: str):
+    q = await _admin_query(update)
+    if q is None:
         return
+    clear_sanction("mute", target_id, SANCTION_PACK, q.from_user.id)
+    _journal_sanctions(target_id)
+    await q.edit_message_text(
+        "🔊 Мут снят.",
+        reply_markup=admin_actions_keyboard(target_id)
+    )
 
-    if data.startswith("admin_unmute_"):
-        target_id = data.replace("admin_unmute_", "")
-        clear_sanction("mute", target_id, data_pack, q.from_user.id)
-        persist()
-        await q.edit_message_text(
-            "🔊 Мут снят.",
-            reply_markup=admin_actions_keyboard(target_id)
-        )
+
+_LIFTED_TEXT = {
+    "ban": "🔓 Срок блокировки истёк — снова можно искать собеседника.",
+    "mute": "🔊 Мут закончился — сообщения снова доходят до собеседника.",
+}
+
+
+def _purge_expired_sanctions():
+    """При старте: молча убрать санкции, истёкшие, пока бот не работал (одна запись секции).
+    Уведомления шлёт только _sanction_sweep_job — о снятых при работающем боте."""
+    if SANCTIONS.sweep(BANS):
+        persist("bans")
+
+
+async def _sanction_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    """Снимает истёкшие баны и муты пачкой, сохраняет и сообщает пользователям."""
+    lifted = SANCTIONS.sweep(BANS)
+    if not lifted:
         return
+    for uid in {uid for uid, _ in lifted}:
+        _journal_sanctions(uid)
+    for uid, kind in lifted:
+        text = _LIFTED_TEXT.get(kind)
+        if text:
+            notify(uid, text, lane=LANE_MODERATION)
+
+
+# ===== FLOOD =====
+# Частые или повторяющиеся сообщения в диалоге — автоматический мут
+FLOOD = FloodGuard(FLOOD_WINDOW, FLOOD_MAX_MESSAGES, FLOOD_REPEAT_HISTORY, FLOOD_MAX_REPEATS)
+
+
+def _content_key(message):
+    """Что сравнивать на копипасту: текст/подпись или file_unique_id вложения."""
+    text = message.text or message.caption
+    if text:
+        text = text.strip().lower()
+        return text if len(text) >= FLOOD_REPEAT_MIN_LEN else None
+    attachment = message.effective_attachment
+    if isinstance(attachment, (list, tuple)):   # фото — список размеров
+        attachment = attachment[-1] if attachment else None
+    return getattr(attachment, "file_unique_id", None)
+
+
+async def _flood_mute(message, bot, user_id: str):
+    set_sanction("mute", user_id, SANCTION_PACK, 0, FLOOD_MUTE_MINUTES, "авто: флуд")
+    _journal_sanctions(user_id)
+    await message.reply_text(f"🔇 Слишком много сообщений подряд — мут на {FLOOD_MUTE_MINUTES} мин.")
+    text = (
+        f"🤖 *Автомут* `{user_id}` {await _username(user_id)}\n"
+        f"Флуд в диалоге, {FLOOD_MUTE_MINUTES} мин."
+    )
+    send_later(LANE_MODERATION, MOD_LOG_CHAT_ID, lambda: bot.send_message(
+        MOD_LOG_CHAT_ID,
+        text,
+        reply_markup=admin_actions_keyboard(user_id),
+        parse_mode="Markdown"
+    ), "MOD LOG")
+
+
+# ===== BANNED PHRASES =====
+# Запрещённые фразы и ссылки (phrases.py); список перечитывается _phrases_reload_job
+PHRASES = PhraseFilter(PHRASES_FILE)
+PHRASE_REPORTER = "0"   # от чьего имени фильтр подаёт жалобы
+
+
+async def _phrase_check(message, bot, user_id: str) -> bool:
+    """Проверить текст/подпись. True — можно доставлять."""
+    hit = PHRASES.check(message.text or message.caption)
+    if hit is None:
+        return True
+    action, _ = hit
+    if action == PHRASE_WARN:
+        await message.reply_text("⚠️ Пожалуйста, соблюдай правила общения.")
+        return True
+    if action == PHRASE_REPORT:
+        # повтор в пределах REPORT_DEDUP_WINDOW не считается — спамер не накрутит себе счётчик
+        await _file_report(bot, PHRASE_REPORTER, user_id, "filter")
+    await message.reply_text("🚫 Сообщение не доставлено: запрещённое содержание.")
+    return False
+
+
+async def _phrases_reload_job(context: ContextTypes.DEFAULT_TYPE):
+    PHRASES.reload_if_changed()
 
 
 # ===== RELAY =====
+def _relay_blocked(user_id: str, partner: str):
+    """done-callback пересылки: собеседник заблокировал бота — закрыть диалог
+    и сказать отправителю, а не писать дальше в пустоту (как в _notify_pair)."""
+    def callback(future):
+        if future.cancelled() or not isinstance(future.exception(), Forbidden):
+            return
+        _mark_unreachable(partner)
+        # следующие сообщения из очереди упадут так же — диалог закрываем один раз
+        if DIALOGS.get(user_id) != partner:
+            return
+        _unlink_pair(user_id, partner)
+        notify(user_id, "⚠️ Собеседник заблокировал бота — диалог завершён.\n\nНажми «🔍 Искать», чтобы найти нового.", "main")
+    return callback
+
+
 async def relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.effective_user:
         return
@@ -1415,7 +2095,7 @@ async def relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
 
     # mute check (admins bypass)
-    if is_active(BANS, user_id, "mute") and int(user_id) not in ADMINS:
+    if SANCTIONS.is_active(user_id, "mute") and int(user_id) not in ADMINS:
         await update.message.reply_text("🔇 Ты в муте.")
         return
 
@@ -1427,12 +2107,22 @@ async def relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if DIALOGS.get(partner) != user_id:
         # stale, cleanup
         DIALOGS.pop(user_id, None)
+        FLOOD.forget(user_id)
+        journal("dialog_drop", user_id)
         _set_state(user_id, STATE_IDLE)
         _remove_from_queue(user_id)
-        persist()
         return
 
-    await update.message.copy(chat_id=int(partner))
+    message = update.message
+    if int(user_id) not in ADMINS:
+        if FLOOD.check(user_id, _content_key(message)) is not None:
+            await _flood_mute(message, context.bot, user_id)
+            return
+        if not await _phrase_check(message, context.bot, user_id):
+            return
+
+    future = send_later(LANE_RELAY, partner, lambda: message.copy(chat_id=int(partner)), "RELAY")
+    future.add_done_callback(_relay_blocked(user_id, partner))
 
 
 # ===== ERROR =====
@@ -1440,207 +2130,167 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     print("❌ ERROR:", context.error)
 
 # ===== MENU CALLBACKS =====
-async def menu_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def menu_show_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    await q.edit_message_text(
+        "⌨️ Клавиатура показана.\n\n"
+        "Используй кнопки внизу экрана 👇"
+    )
+    await context.bot.send_message(
+        chat_id=q.from_user.id,
+        text="⬇️ Главное меню",
+        reply_markup=MAIN_KB
+    )
+
+
+async def menu_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск из меню / старта."""
+    q = update.callback_query
+    await q.edit_message_text("🔍 Нажми «🔍 Искать» снизу 👇")
+    await context.bot.send_message(int(q.from_user.id), "Жми «🔍 Искать» 👇", reply_markup=MAIN_KB)
+
 
+async def menu_reset_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
     user_id = str(q.from_user.id)
-    data = q.data
+    PROFILES.pop(user_id, None)
+    journal("profile_del", user_id)
+    # без профиля в поиске делать нечего
+    _remove_from_queue(user_id)
 
-    # ===== ПОКАЗАТЬ КЛАВИАТУРУ =====
-    if q.data == "menu_show_keyboard":
-        await q.edit_message_text(
-            "⌨️ Клавиатура показана.\n\n"
-            "Используй кнопки внизу экрана 👇"
-        )
-        await context.bot.send_message(
-            chat_id=q.from_user.id,
-            text="⬇️ Главное меню",
-            reply_markup=MAIN_KB
+    await q.edit_message_text(
+        "📝 Профиль удалён.\n\n"
+        "Давай создадим новый 👇",
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("♂️ Мужской", callback_data=cb.pack(cb.GENDER, "male"))]]
         )
-        return
+    )
 
-    # ===== ПОИСК ИЗ МЕНЮ / СТАРТА =====
-    if data == "menu_search":
-        await q.edit_message_text("🔍 Нажми «🔍 Искать» снизу 👇")
-        await context.bot.send_message(int(user_id), "Жми «🔍 Искать» 👇", reply_markup=MAIN_KB)
-        return
 
-    # ===== СБРОС ПРОФИЛЯ =====
-    if data == "menu_reset_profile":
-        PROFILES.pop(user_id, None)
-        persist()
+async def menu_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "🚫 *Чёрный список*\n\n"
+        "Здесь отображаются пользователи,\n"
+        "с которыми ты не хочешь общаться.",
+        parse_mode="Markdown"
+    )
 
-        await q.edit_message_text(
-            "📝 Профиль удалён.\n\n"
-            "Давай создадим новый 👇",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("♂️ Мужской", callback_data="gender_male")]]
-            )
-        )
-        return
 
-    # ===== ЧЁРНЫЙ СПИСОК =====
-    if data == "menu_blacklist":
-        await q.edit_message_text(
-            "🚫 *Чёрный список*\n\n"
-            "Здесь отображаются пользователи,\n"
-            "с которыми ты не хочешь общаться.",
-            parse_mode="Markdown"
-        )
-        return
+async def menu_privacy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "🔒 *Политика приватности*\n\n"
+        "• Бот не сохраняет переписки\n"
+        "• Все диалоги анонимны\n"
+        "• Жалобы видят только модераторы",
+        parse_mode="Markdown"
+    )
 
-    # ===== ПРИВАТНОСТЬ =====
-    if data == "menu_privacy":
-        await q.edit_message_text(
-            "🔒 *Политика приватности*\n\n"
-            "• Бот не сохраняет переписки\n"
-            "• Все диалоги анонимны\n"
-            "• Жалобы видят только модераторы",
-            parse_mode="Markdown"
-        )
-        return
 
-    # ===== ИНФОРМАЦИЯ =====
-    if data == "menu_info":
-        await q.edit_message_text(
-            "📖 *Правила пользования*\n\n"
-            "• Запрещены оскорбления\n"
-            "• Запрещён спам\n"
-            "• За нарушения — блокировка",
-            parse_mode="Markdown"
-        )
-        return
+async def menu_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "📖 *Правила пользования*\n\n"
+        "• Запрещены оскорбления\n"
+        "• Запрещён спам\n"
+        "• За нарушения — блокировка",
+        parse_mode="Markdown"
+    )
 
 
 # ===== FILTERS CALLBACKS =====
-async def filters_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback-запросов для фильтров."""
+async def filter_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Главное меню фильтров (и «Назад» из любого подменю)."""
+    q = update.callback_query
+    await q.edit_message_text(
+        filters_text(str(q.from_user.id)),
+        parse_mode="Markdown",
+        reply_markup=filters_main_keyboard()
+    )
+
+
+async def filter_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "📅 *Выбери возрастной диапазон*\n\n"
+        "Сначала минимальный возраст:",
+        parse_mode="Markdown",
+        reply_markup=filter_age_min_keyboard()
+    )
+
+
+async def filter_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "⭐ *Выбери минимальный рейтинг*\n\n"
+        "Будут показаны только собеседники с рейтингом не ниже выбранного.",
+        parse_mode="Markdown",
+        reply_markup=filter_rating_keyboard()
+    )
+
+
+async def filter_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
-    
     user_id = str(q.from_user.id)
-    data = q.data
-    
-    # Главное меню фильтров
-    if data == "filter_main":
-        await q.edit_message_text(
-            filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Выбор возраста
-    if data == "filter_age":
-        await q.edit_message_text(
-            "📅 *Выбери возрастной диапазон*\n\n"
-            "Сначала минимальный возраст:",
-            parse_mode="Markdown",
-            reply_markup=filter_age_min_keyboard()
-        )
-        return
-    
-    # Выбор рейтинга
-    if data == "filter_rating":
-        await q.edit_message_text(
-            "⭐ *Выбери минимальный рейтинг*\n\n"
-            "Будут показаны только собеседники с рейтингом не ниже выбранного.",
-            parse_mode="Markdown",
-            reply_markup=filter_rating_keyboard()
-        )
-        return
-    
-    # Сброс фильтров
-    if data == "filter_reset":
-        FILTERS[user_id] = {
-            "gender": "male",
-            "min_age": 14,
-            "max_age": 18,
-            "min_rating": 0.0
-        }
-        persist()
-        await q.edit_message_text(
-            "✅ Фильтры сброшены!\n\n" + filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Назад в главное меню
-    if data == "filter_back":
-        await q.edit_message_text(
-            filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Назад из меню возраста
-    if data == "filter_age_back":
-        await q.edit_message_text(
-            filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Назад из меню рейтинга
-    if data == "filter_rating_back":
-        await q.edit_message_text(
-            filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Запрос на ввод своего возраста
-    if data == "filter_age_custom":
-        context.user_data["waiting_for_age"] = True
-        await q.edit_message_text(
-            "⌨️ *Введи свой возраст*\n\n"
-            "Введи число от 14 до 99",
-            parse_mode="Markdown"
-        )
-        return
-    
-    # Обработка выбора мин. возраста
-    if data.startswith("filter_age_min_"):
-        min_age = int(data.replace("filter_age_min_", ""))
-        context.user_data["filter_min_age"] = min_age
-        _set_filter(user_id, "min_age", min_age)
-        
-        await q.edit_message_text(
-            f"📅 Мин. возраст: {min_age}\n\nТеперь максимальный возраст:",
-            parse_mode="Markdown",
-            reply_markup=filter_age_max_keyboard()
-        )
-        return
-    
-    # Обработка выбора макс. возраста
-    if data.startswith("filter_age_max_"):
-        max_age = int(data.replace("filter_age_max_", ""))
-        min_age = context.user_data.get("filter_min_age", 14)
-        _set_filter(user_id, "max_age", max_age)
-        
-        await q.edit_message_text(
-            f"✅ Возрастной диапазон: {min_age}-{max_age}\n\n" + filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
-    
-    # Обработка выбора мин. рейтинга
-    if data.startswith("filter_rating_"):
-        min_rating = float(data.replace("filter_rating_", ""))
-        _set_filter(user_id, "min_rating", min_rating)
-        
-        await q.edit_message_text(
-            f"✅ Мин. рейтинг: {min_rating}\n\n" + filters_text(user_id),
-            parse_mode="Markdown",
-            reply_markup=filters_main_keyboard()
-        )
-        return
+    FILTERS[user_id] = {
+        "gender": "male",
+        "min_age": 14,
+        "max_age": 18,
+        "min_rating": 0.0
+    }
+    journal("filter_set", user_id, FILTERS[user_id])
+    POOL.refresh(user_id, filters=FILTERS[user_id])
+    await q.edit_message_text(
+        "✅ Фильтры сброшены!\n\n" + filters_text(user_id),
+        parse_mode="Markdown",
+        reply_markup=filters_main_keyboard()
+    )
+
+
+async def filter_age_custom(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запрос на ввод своего возраста."""
+    context.user_data["waiting_for_age"] = True
+    await update.callback_query.edit_message_text(
+        "⌨️ *Введи свой возраст*\n\n"
+        "Введи число от 14 до 99",
+        parse_mode="Markdown"
+    )
+
+
+async def filter_age_min(update: Update, context: ContextTypes.DEFAULT_TYPE, min_age: str):
+    q = update.callback_query
+    min_age = int(min_age)
+    context.user_data["filter_min_age"] = min_age
+    _set_filter(str(q.from_user.id), "min_age", min_age)
+
+    await q.edit_message_text(
+        f"📅 Мин. возраст: {min_age}\n\nТеперь максимальный возраст:",
+        parse_mode="Markdown",
+        reply_markup=filter_age_max_keyboard()
+    )
+
+
+async def filter_age_max(update: Update, context: ContextTypes.DEFAULT_TYPE, max_age: str):
+    q = update.callback_query
+    user_id = str(q.from_user.id)
+    max_age = int(max_age)
+    min_age = context.user_data.get("filter_min_age", 14)
+    _set_filter(user_id, "max_age", max_age)
+
+    await q.edit_message_text(
+        f"✅ Возрастной диапазон: {min_age}-{max_age}\n\n" + filters_text(user_id),
+        parse_mode="Markdown",
+        reply_markup=filters_main_keyboard()
+    )
+
+
+async def filter_min_rating(update: Update, context: ContextTypes.DEFAULT_TYPE, min_rating: str):
+    q = update.callback_query
+    user_id = str(q.from_user.id)
+    min_rating = float(min_rating)
+    _set_filter(user_id, "min_rating", min_rating)
+
+    await q.edit_message_text(
+        f"✅ Мин. рейтинг: {min_rating}\n\n" + filters_text(user_id),
+        parse_mode="Markdown",
+        reply_markup=filters_main_keyboard()
+    )
 
 
 # ===== FILTERS COMMAND =====
@@ -1695,9 +2345,126 @@ async def handle_age_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# ===== MESSAGE ROUTER =====
+# Кнопки reply-клавиатуры: точный текст -> обработчик
+BUTTON_ROUTES = {
+    "🔍 Искать": start_search,
+    "🔄 Новый поиск": new_search,
+    "🚫 Завершить": end_dialog,
+    "👤 Профиль": profile,
+    "🚨 Пожаловаться": report_start,
+    "🔍 Фильтры": cmd_filters,
+    "👑 VIP": cmd_vip,
+}
+
+
+async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Единая точка входа для сообщений (не команд): кнопка -> ввод возраста -> relay.
+    Один поиск в словаре вместо цепочки регулярок; порядок задан здесь, а не порядком хендлеров."""
+    message = update.message
+    if not message or not update.effective_user:
+        return
+
+    text = message.text
+    if text is not None:
+        handler = BUTTON_ROUTES.get(text)
+        if handler is not None:
+            return await handler(update, context)
+        if context.user_data.get("waiting_for_age"):
+            return await handle_age_input(update, context)
+
+    # всё остальное — переписка в диалоге (relay сам проверит мут и партнёра)
+    return await relay(update, context)
+
+
+# ===== CALLBACK ROUTER =====
+# Код действия из callback_data -> обработчик(update, context, *args), см. callbacks.py
+CALLBACKS = cb.CallbackRouter({
+    cb.GENDER: select_gender,
+    cb.AGE: select_age,
+    cb.MENU_KEYBOARD: menu_show_keyboard,
+    cb.MENU_SEARCH: menu_search,
+    cb.MENU_RESET: menu_reset_profile,
+    cb.MENU_BLACKLIST: menu_blacklist,
+    cb.MENU_PRIVACY: menu_privacy,
+    cb.MENU_INFO: menu_info,
+    cb.POST_RATE: post_rate,
+    cb.POST_REPORT: post_report,
+    cb.POST_BLACKLIST: post_blacklist,
+    cb.POST_PROFILE: post_partner_profile,
+    cb.POST_NEWSEARCH: post_newsearch,
+    cb.RATE: rate_partner,
+    cb.RATE_SKIP: rate_skip,
+    cb.REPORT: report_reason,
+    cb.ADMIN_PROFILE: admin_profile,
+    cb.ADMIN_BAN: admin_ban,
+    cb.ADMIN_UNBAN: admin_unban,
+    cb.ADMIN_MUTE: admin_mute,
+    cb.ADMIN_UNMUTE: admin_unmute,
+    cb.BL_LIST: bl_list,
+    cb.BL_ADD: bl_add,
+    cb.BL_REMOVE: bl_remove,
+    cb.BL_BACK: bl_back,
+    cb.BL_CLOSE: bl_close,
+    cb.VIP_BUY: vip_buy,
+    cb.VIP_PREMIUM: vip_premium,
+    cb.VIP_BACK: vip_back,
+    cb.FILTER_MAIN: filter_main,
+    cb.FILTER_AGE: filter_age,
+    cb.FILTER_RATING: filter_rating,
+    cb.FILTER_RESET: filter_reset,
+    cb.FILTER_AGE_CUSTOM: filter_age_custom,
+    cb.FILTER_AGE_MIN: filter_age_min,
+    cb.FILTER_AGE_MAX: filter_age_max,
+    cb.FILTER_MIN_RATING: filter_min_rating,
+    cb.BROADCAST_PAUSE: broadcast_pause,
+    cb.BROADCAST_RESUME: broadcast_resume,
+    cb.BROADCAST_CANCEL: broadcast_cancel,
+})
+
+
+# ===== LIFECYCLE =====
+async def _on_startup(app: Application):
+    global BOT
+    BOT = app.bot
+    _ensure_sync_all()
+    _purge_expired_sanctions()
+    _rebuild_pool()
+    STORE.start()
+    SENDER.start()
+    OUTBOX.start()
+    # недоделанная до перезапуска рассылка продолжается с контрольной точки
+    bc = Broadcast.load()
+    if bc is not None:
+        _start_broadcast(app.bot, bc)
+
+
+async def _on_shutdown(app: Application):
+    # рассылку — до SENDER.close(): отменённая задача дожидается своих отправок
+    # и пишет контрольную точку
+    if BROADCAST_TASK is not None and not BROADCAST_TASK.done():
+        BROADCAST_TASK.cancel()
+        await asyncio.gather(BROADCAST_TASK, return_exceptions=True)
+    await OUTBOX.close()
+    await SENDER.close()
+    # финальный сброс, чтобы не потерять последние изменения
+    await STORE.close()
+
+
 # ===== MAIN =====
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # разные пользователи — параллельно, один пользователь — по порядку
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
+
+    # ===== USER CACHE: до всех остальных обработчиков, ничего не блокирует =====
+    app.add_handler(TypeHandler(Update, _remember_user), group=-1)
 
     # ===== COMMANDS =====
     app.add_handler(CommandHandler("start", start))
@@ -1712,37 +2479,29 @@ def main():
     app.add_handler(CommandHandler("vip", cmd_vip))
 
     # ===== INLINE CALLBACKS =====
-    app.add_handler(CallbackQueryHandler(menu_callbacks, pattern="^menu_"))
-    app.add_handler(CallbackQueryHandler(select_gender, pattern="^gender_"))
-    app.add_handler(CallbackQueryHandler(select_age, pattern="^age_"))
-    app.add_handler(CallbackQueryHandler(blacklist_actions, pattern="^bl_"))
-    app.add_handler(CallbackQueryHandler(report_reason, pattern="^report_"))
-    app.add_handler(CallbackQueryHandler(admin_actions, pattern="^admin_"))
-    app.add_handler(CallbackQueryHandler(post_actions, pattern="^post_"))
-    app.add_handler(CallbackQueryHandler(rating_handler, pattern="^rate_"))
-    app.add_handler(CallbackQueryHandler(filters_callbacks, pattern="^filter_"))
-    app.add_handler(CallbackQueryHandler(vip_callbacks, pattern="^vip_"))
-
-    # ===== REPLY KEYBOARD BUTTONS =====
-    app.add_handler(MessageHandler(filters.Regex("^🔍 Искать$"), start_search))
-    app.add_handler(MessageHandler(filters.Regex("^🔄 Новый поиск$"), new_search))
-    app.add_handler(MessageHandler(filters.Regex("^🚫 Завершить$"), end_dialog))
-    app.add_handler(MessageHandler(filters.Regex("^👤 Профиль$"), profile))
-    app.add_handler(MessageHandler(filters.Regex("^🚨 Пожаловаться$"), report_start))
-    app.add_handler(MessageHandler(filters.Regex("^🔍 Фильтры$"), cmd_filters))
-    app.add_handler(MessageHandler(filters.Regex("^👑 VIP$"), cmd_vip))
-
-    # ===== AGE INPUT HANDLER =====
-    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_age_input))
-
-    # ===== CHAT RELAY =====
-    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, relay))
+    app.add_handler(CallbackQueryHandler(CALLBACKS.dispatch))
+
+    # ===== MESSAGES: кнопки, ввод возраста, переписка =====
+    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, route_message))
 
     # ===== ERRORS =====
     app.add_error_handler(error_handler)
 
+    # ===== JOBS =====
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(_batch_match_job, interval=BATCH_MATCH_INTERVAL, first=BATCH_MATCH_INTERVAL)
+        app.job_queue.run_repeating(_vip_expiry_job, interval=VIP_EXPIRY_CHECK_INTERVAL, first=1)
+        app.job_queue.run_repeating(_sanction_sweep_job, interval=SANCTION_SWEEP_INTERVAL, first=1)
+        app.job_queue.run_repeating(_report_digest_job, interval=REPORT_DIGEST_INTERVAL, first=REPORT_DIGEST_INTERVAL)
+        app.job_queue.run_repeating(_phrases_reload_job, interval=PHRASES_RELOAD_INTERVAL, first=PHRASES_RELOAD_INTERVAL)
+    else:
+        print("⚠️ JobQueue недоступен: pip install \"python-telegram-bot[job-queue]\"")
+
     print("✅ Bot started")
-    app.run_polling()
+    if UPDATE_MODE == "webhook":
+        run_webhook(app, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL, WEBHOOK_MAX_QUEUE)
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
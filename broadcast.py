@@ -0,0 +1,197 @@
+# broadcast.py
+# Рассылка: ограниченная параллельность поверх sender.py, контрольная точка на диске,
+# пауза/отмена. Одновременно идёт не больше одной рассылки.
+
+import asyncio
+import json
+import os
+import time
+
+from telegram.error import Forbidden
+
+from storage import write_atomic
+
+CHECKPOINT_FILE = "data/broadcast.json"             # состояние и счётчики (переписывается часто)
+RECIPIENTS_FILE = "data/broadcast_recipients.json"  # список получателей (пишется один раз)
+
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+
+
+def _write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, text)
+
+
+def _remove_files():
+    for path in (CHECKPOINT_FILE, RECIPIENTS_FILE):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Broadcast:
+    """Одна рассылка: текст, получатели и курсор.
+
+    cursor — индекс, до которого все получатели уже обработаны; счётчики
+    sent/failed/blocked считают только их. После перезапуска рассылка
+    продолжается с cursor, так что повторно могут получить сообщение
+    не больше concurrency человек, бывших «в полёте».
+    """
+
+    def __init__(self, text: str, recipients: list, admin_chat: int, progress_message: int | None = None,
+                 cursor: int = 0, sent: int = 0, failed: int = 0, blocked: int = 0,
+                 state: str = RUNNING, started: float | None = None):
+        self.text = text
+        self.recipients = recipients
+        self.admin_chat = admin_chat
+        self.progress_message = progress_message
+        self.cursor = cursor
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.state = state
+        self.started = started or time.time()
+        self._resume = asyncio.Event()
+        self._io = asyncio.Lock()   # записи на диск по очереди: у них общий .tmp
+        if state != PAUSED:
+            self._resume.set()
+
+    # ===== СОСТОЯНИЕ =====
+    @property
+    def total(self) -> int:
+        return len(self.recipients)
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (CANCELLED, DONE)
+
+    def pause(self):
+        if self.state == RUNNING:
+            self.state = PAUSED
+            self._resume.clear()
+
+    def resume(self):
+        if self.state == PAUSED:
+            self.state = RUNNING
+            self._resume.set()
+
+    def cancel(self):
+        if not self.finished:
+            self.state = CANCELLED
+            self._resume.set()   # разбудить, если стояла на паузе
+
+    # ===== КОНТРОЛЬНАЯ ТОЧКА =====
+    # снимок берётся в цикле событий, запись с fsync — в потоке, как у STORE
+    async def checkpoint(self):
+        text = json.dumps({
+            "text": self.text,
+            "admin_chat": self.admin_chat,
+            "progress_message": self.progress_message,
+            "cursor": self.cursor,
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "state": self.state,
+            "started": self.started,
+        }, ensure_ascii=False)
+        async with self._io:
+            await asyncio.to_thread(_write, CHECKPOINT_FILE, text)
+
+    async def save(self):
+        """Первое сохранение: список получателей и контрольная точка."""
+        recipients = json.dumps(self.recipients)
+        async with self._io:
+            await asyncio.to_thread(_write, RECIPIENTS_FILE, recipients)
+        await self.checkpoint()
+
+    @staticmethod
+    def load():
+        """Незавершённая рассылка с диска или None."""
+        try:
+            with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            with open(RECIPIENTS_FILE, "r", encoding="utf-8") as f:
+                recipients = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("state") not in (RUNNING, PAUSED):
+            return None
+        return Broadcast(recipients=recipients, **state)
+
+    async def clear(self):
+        async with self._io:
+            await asyncio.to_thread(_remove_files)
+
+    # ===== ЗАПУСК =====
+    async def run(self, send, on_blocked, on_progress, concurrency: int = 20,
+                  checkpoint_every: int = 200, progress_interval: float = 5.0):
+        """send(uid) — корутина отправки; on_blocked(uid) — пользователь заблокировал бота;
+        on_progress(self) — обновить сообщение с прогрессом (вызывается не чаще progress_interval)."""
+        slots = asyncio.Semaphore(concurrency)
+        outcomes: dict[int, str] = {}   # завершённые за курсором: индекс -> счётчик
+        tasks: set[asyncio.Task] = set()
+        last_progress = 0.0
+
+        def advance():
+            # курсор и счётчики двигаются вместе: в контрольную точку не попадает
+            # то, что после перезапуска будет отправлено ещё раз
+            while self.cursor in outcomes:
+                counter = outcomes.pop(self.cursor)
+                setattr(self, counter, getattr(self, counter) + 1)
+                self.cursor += 1
+
+        async def one(index: int, uid: str):
+            try:
+                await send(uid)
+            except Forbidden:
+                outcomes[index] = "blocked"
+                on_blocked(uid)
+            except Exception:
+                outcomes[index] = "failed"
+            else:
+                outcomes[index] = "sent"
+            finally:
+                slots.release()
+                advance()
+
+        index = self.cursor
+        try:
+            while index < self.total:
+                await self._resume.wait()
+                if self.state == CANCELLED:
+                    break
+                await slots.acquire()
+                task = asyncio.create_task(one(index, self.recipients[index]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+
+                if index % checkpoint_every == 0:
+                    await self.checkpoint()
+                now = time.monotonic()
+                if now - last_progress >= progress_interval:
+                    last_progress = now
+                    await on_progress(self)
+
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            # остановка бота: недоставленные остаются за курсором до перезапуска
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.checkpoint()
+            raise
+
+        if self.state != CANCELLED:
+            self.state = DONE
+        await self.clear()
+        await on_progress(self)
@@ -0,0 +1,163 @@
+# callbacks.py
+# Компактный callback_data: короткий код действия + аргументы через ":".
+# Разбирается один раз в CallbackRouter.dispatch, дальше — прямой переход по таблице.
+
+SEP = ":"
+
+# ===== КОДЫ ДЕЙСТВИЙ =====
+# регистрация
+GENDER = "g"               # g:<male>
+AGE = "a"                  # a:<age>
+
+# меню /start и /menu
+MENU_KEYBOARD = "mk"
+MENU_SEARCH = "ms"
+MENU_RESET = "mr"
+MENU_BLACKLIST = "mb"
+MENU_PRIVACY = "mp"
+MENU_INFO = "mi"
+
+# после диалога
+POST_RATE = "pt"
+POST_REPORT = "pr"
+POST_BLACKLIST = "pb"
+POST_PROFILE = "pp"
+POST_NEWSEARCH = "pn"
+
+# оценки и жалобы
+RATE = "r"                 # r:<1..5>
+RATE_SKIP = "rs"
+REPORT = "rp"              # rp:<reason>
+
+# модерация (кнопки в чате модераторов)
+ADMIN_PROFILE = "ap"       # ap:<user_id>
+ADMIN_BAN = "ab"
+ADMIN_UNBAN = "au"
+ADMIN_MUTE = "am"
+ADMIN_UNMUTE = "an"
+
+# чёрный список
+BL_LIST = "bl"             # bl[:<page>]
+BL_ADD = "ba"              # ba:<user_id>
+BL_REMOVE = "br"           # br:<user_id>
+BL_BACK = "bb"
+BL_CLOSE = "bx"
+
+# VIP
+VIP_BUY = "vb"
+VIP_PREMIUM = "vp"
+VIP_BACK = "vk"
+
+# фильтры
+FILTER_MAIN = "f"
+FILTER_AGE = "fa"
+FILTER_RATING = "fr"
+FILTER_RESET = "fx"
+FILTER_AGE_CUSTOM = "fc"
+FILTER_AGE_MIN = "fn"      # fn:<age>
+FILTER_AGE_MAX = "fm"      # fm:<age>
+FILTER_MIN_RATING = "fv"   # fv:<rating>
+
+# рассылка (у админа)
+BROADCAST_PAUSE = "xp"
+BROADCAST_RESUME = "xr"
+BROADCAST_CANCEL = "xc"
+
+
+# ===== СТАРЫЙ ФОРМАТ =====
+# Кнопки в уже отправленных сообщениях несут прежние строки — разбираем и их.
+LEGACY_EXACT = {
+    "menu_show_keyboard": MENU_KEYBOARD,
+    "menu_search": MENU_SEARCH,
+    "menu_reset_profile": MENU_RESET,
+    "menu_blacklist": MENU_BLACKLIST,
+    "menu_privacy": MENU_PRIVACY,
+    "menu_info": MENU_INFO,
+    "post_rate": POST_RATE,
+    "post_report": POST_REPORT,
+    "post_blacklist": POST_BLACKLIST,
+    "post_partner_profile": POST_PROFILE,
+    "post_newsearch": POST_NEWSEARCH,
+    "rate_skip": RATE_SKIP,
+    "bl_list": BL_LIST,
+    "bl_back": BL_BACK,
+    "bl_close": BL_CLOSE,
+    "vip_buy": VIP_BUY,
+    "vip_premium": VIP_PREMIUM,
+    "vip_back": VIP_BACK,
+    "filter_main": FILTER_MAIN,
+    "filter_back": FILTER_MAIN,
+    "filter_age_back": FILTER_MAIN,
+    "filter_rating_back": FILTER_MAIN,
+    "filter_age": FILTER_AGE,
+    "filter_rating": FILTER_RATING,
+    "filter_reset": FILTER_RESET,
+    "filter_age_custom": FILTER_AGE_CUSTOM,
+}
+
+LEGACY_PREFIXES = (
+    ("gender_", GENDER),
+    ("age_", AGE),
+    ("report_", REPORT),
+    ("rate_", RATE),
+    ("admin_profile_", ADMIN_PROFILE),
+    ("admin_ban24_", ADMIN_BAN),
+    ("admin_unban_", ADMIN_UNBAN),
+    ("admin_mute30_", ADMIN_MUTE),
+    ("admin_unmute_", ADMIN_UNMUTE),
+    ("bl_page_", BL_LIST),
+    ("bl_add_", BL_ADD),
+    ("bl_rm_", BL_REMOVE),
+    ("filter_age_min_", FILTER_AGE_MIN),
+    ("filter_age_max_", FILTER_AGE_MAX),
+    ("filter_rating_", FILTER_MIN_RATING),
+)
+
+
+def pack(code: str, *args) -> str:
+    """Собрать callback_data: pack(BL_ADD, 123) -> "ba:123"."""
+    if not args:
+        return code
+    return code + SEP + SEP.join(map(str, args))
+
+
+def unpack(data: str) -> tuple[str, list[str]]:
+    """Разобрать callback_data в (код, аргументы). Понимает и старый формат."""
+    code, sep, rest = data.partition(SEP)
+    if sep:
+        return code, rest.split(SEP)
+    if len(data) <= 2:
+        return data, []
+
+    legacy = LEGACY_EXACT.get(data)
+    if legacy is not None:
+        return legacy, []
+    for prefix, legacy in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return legacy, [data[len(prefix):]]
+    return data, []
+
+
+class CallbackRouter:
+    """Один CallbackQueryHandler на всё: код -> обработчик(update, context, *args)."""
+
+    def __init__(self, table: dict | None = None):
+        self.table = dict(table or {})
+
+    def add(self, code: str, handler):
+        self.table[code] = handler
+
+    def resolve(self, data: str):
+        """(обработчик, аргументы) или (None, []) для неизвестных кнопок."""
+        code, args = unpack(data or "")
+        return self.table.get(code), args
+
+    async def dispatch(self, update, context):
+        q = update.callback_query
+        if q is None:
+            return
+        handler, args = self.resolve(q.data)
+        await q.answer()
+        if handler is None:
+            return
+        await handler(update, context, *args)
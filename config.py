@@ -14,3 +14,95 @@ ADMINS = [
 ]
 
 
+
+# Как часто (сек) фоновый флашер сбрасывает состояние на диск
+PERSIST_INTERVAL = 2.0
+
+# Размер журнала операций (байт), после которого он сворачивается в снимок
+JOURNAL_COMPACT_BYTES = 1_000_000
+
+# Хранилище: "json" (data/data.json + журнал) или "sqlite" (data/data.db).
+# Перед переключением на sqlite: python sqlite_storage.py migrate
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_FILE = "data/data.db"
+
+# Сколько секунд можно ждать в очереди, прежде чем подняться над VIP-уровнями
+MATCH_MAX_WAIT = 60
+
+# Как часто (сек) фоновый матчер сводит уже ожидающих пользователей
+BATCH_MATCH_INTERVAL = 5
+
+# Сколько ожидающих фоновый матчер проверяет за один захват MATCH_LOCK
+BATCH_MATCH_CHUNK = 200
+
+# С какого размера очереди подбор идёт векторно через numpy (если установлен).
+# Замер: python bench_matchmaking.py
+VECTOR_MATCH_THRESHOLD = 100
+
+# Как часто (сек) снимаются истёкшие VIP-статусы и сообщать ли об этом пользователю
+VIP_EXPIRY_CHECK_INTERVAL = 60
+VIP_EXPIRY_NOTIFY = True
+
+# Лимиты исходящих вызовов Bot API (sender.py): всего в секунду, интервал и запас
+# подряд для личного чата, интервал для групп (мод-лог), повторов после RetryAfter
+SEND_GLOBAL_RATE = 25
+SEND_CHAT_INTERVAL = 1.0
+SEND_CHAT_BURST = 3
+SEND_GROUP_INTERVAL = 3.0
+SEND_MAX_RETRIES = 3
+
+# Рассылка: сколько сообщений одновременно «в полёте», как часто (в отправках)
+# сохранять контрольную точку и как часто (сек) обновлять прогресс у админа
+BROADCAST_CONCURRENCY = 20
+BROADCAST_CHECKPOINT_EVERY = 200
+BROADCAST_PROGRESS_INTERVAL = 5.0
+
+# Outbox важных уведомлений: первая пауза перед повтором (сек, дальше удваивается),
+# потолок паузы и число попыток до отказа
+OUTBOX_BASE_DELAY = 2.0
+OUTBOX_MAX_DELAY = 600.0
+OUTBOX_MAX_ATTEMPTS = 8
+
+# Сколько апдейтов обрабатывать одновременно (апдейты одного пользователя — всё равно по очереди)
+CONCURRENT_UPDATES = 64
+
+# Получение апдейтов: "polling" или "webhook" (встроенный HTTP-сервер, см. webhook.py).
+# WEBHOOK_URL — внешний адрес без пути; пустой — setWebhook не вызывается (локальная проверка).
+# WEBHOOK_SECRET пустой — на каждый запуск генерируется случайный
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов может ждать в очереди, прежде чем отвечать Telegram 503
+WEBHOOK_MAX_QUEUE = 1000
+
+# Как часто (сек) снимаются истёкшие баны и муты (moderation.SanctionIndex)
+SANCTION_SWEEP_INTERVAL = 30
+
+# Жалобы в мод-лог: сводка по нарушителю раз в REPORT_DIGEST_INTERVAL сек; повторная
+# жалоба того же человека на того же нарушителя в течение REPORT_DEDUP_WINDOW сек
+# не считается; при REPORT_ESCALATE_RATIO * MAX_REPORTS жалоб — сообщение сразу
+REPORT_DIGEST_INTERVAL = 120
+REPORT_DEDUP_WINDOW = 3600
+REPORT_ESCALATE_RATIO = 0.5
+
+# Кэш имён пользователей (usercache.py): сколько записей держать и сколько секунд им верить
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 3600
+
+# Флуд в диалоге (flood.py): FLOOD_MAX_MESSAGES сообщений за FLOOD_WINDOW сек
+# или FLOOD_MAX_REPEATS одинаковых среди последних FLOOD_REPEAT_HISTORY (тексты короче
+# FLOOD_REPEAT_MIN_LEN не сравниваются) — автоматический мут на FLOOD_MUTE_MINUTES минут
+FLOOD_WINDOW = 10
+FLOOD_MAX_MESSAGES = 10
+FLOOD_REPEAT_HISTORY = 6
+FLOOD_MAX_REPEATS = 3
+FLOOD_REPEAT_MIN_LEN = 8
+FLOOD_MUTE_MINUTES = 10
+
+# Запрещённые фразы и ссылки в переписке (формат — в phrases.py) и как часто (сек)
+# проверять, не изменился ли файл
+PHRASES_FILE = "data/banned_phrases.txt"
+PHRASES_RELOAD_INTERVAL = 30
@@ -0,0 +1,56 @@
+# flood.py
+# Защита переписки от флуда: на пользователя — последние N отметок времени
+# (скользящее окно) и хэши последних сообщений (копипаста). Проверка — O(1).
+
+import time
+from collections import deque
+
+RATE = "rate"        # слишком много сообщений за окно
+REPEAT = "repeat"    # одно и то же сообщение несколько раз подряд
+
+
+class FloodGuard:
+    """check(user_id, content) -> None или причина (RATE / REPEAT).
+
+    Состояние есть только у тех, кто пишет в диалоге; forget() вызывается при
+    закрытии диалога, так что память ограничена числом активных диалогов.
+    """
+
+    def __init__(self, window: float, max_messages: int, history: int, max_repeats: int):
+        self.window = window
+        self.max_messages = max_messages
+        self.history = history
+        self.max_repeats = max_repeats
+        self._users: dict[str, tuple[deque, deque]] = {}   # user_id -> (времена, хэши)
+        self.stats = {RATE: 0, REPEAT: 0}
+
+    def __len__(self):
+        return len(self._users)
+
+    def check(self, user_id: str, content=None):
+        """content — текст/подпись или file_unique_id вложения; None — не сравнивать."""
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = (deque(maxlen=self.max_messages), deque(maxlen=self.history))
+        times, hashes = state
+
+        now = time.monotonic()
+        times.append(now)
+        # окно заполнено, и самое старое из max_messages сообщений — моложе window
+        if len(times) == self.max_messages and now - times[0] < self.window:
+            return self._hit(user_id, RATE)
+
+        if content is not None:
+            h = hash(content)
+            hashes.append(h)
+            if hashes.count(h) >= self.max_repeats:
+                return self._hit(user_id, REPEAT)
+        return None
+
+    def _hit(self, user_id: str, reason: str) -> str:
+        self.stats[reason] += 1
+        self.forget(user_id)
+        return reason
+
+    def forget(self, user_id: str):
+        self._users.pop(user_id, None)
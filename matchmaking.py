@@ -0,0 +1,362 @@
+import heapq
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # векторный подбор — опционально, без numpy работает обычный путь
+    np = None
+
+# ===== MATCH POOL =====
+# Индекс ожидающих поиска: корзины (пол, возраст), внутри — FIFO по корзинам рейтинга
+# и уровням приоритета.
+# Поиск смотрит только корзины, попадающие в фильтр, а не всю очередь, и сливает
+# их кучей по ключу (приоритет, порядок постановки). Кто ждёт дольше max_wait,
+# поднимается над всеми уровнями — так обычные пользователи не голодают из-за VIP.
+
+GENDER_CODES = {"male": "♂️", "female": "♀️"}  # значение фильтра -> пол в профиле
+
+_PROMOTED = float("-inf")   # ранг тех, кто ждёт дольше max_wait
+_WAIT_SAMPLES = 1000        # сколько последних ожиданий хранить на уровень
+
+
+def profile_age(profile: dict):
+    try:
+        return int(profile.get("age", 0))
+    except (ValueError, TypeError):
+        return None
+
+
+def rating_band(rating: float) -> int:
+    """Корзина рейтинга: целая часть среднего (0..5)."""
+    return min(max(int(rating or 0), 0), 5)
+
+
+def _insert_by_seq(fifo: dict, user_id: str, entry: tuple):
+    """Вставить в FIFO, сохранив порядок по seq (обычно — просто в конец)."""
+    if not fifo or next(reversed(fifo.values()))[0] < entry[0]:
+        fifo[user_id] = entry
+        return
+    items = list(fifo.items())
+    pos = next(i for i, (_, e) in enumerate(items) if e[0] > entry[0])
+    items.insert(pos, (user_id, entry))
+    fifo.clear()
+    fifo.update(items)
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[i]
+
+
+class MatchPool:
+    def __init__(self, max_wait: float = 60.0):
+        self.max_wait = max_wait
+        # gender -> {age: {(band, priority): {user_id: (seq, ts, rating)}}}
+        self._by_gender: dict[str, dict] = {}
+        self._where: dict[str, tuple] = {}      # user_id -> (gender, age, band, priority, seq, ts, rating)
+        self._seq = 0
+        self._waits: dict[int, deque] = {}      # priority -> последние ожидания (сек)
+        self._dirty: set[str] = set()           # добавлены/изменены после прошлого take_dirty()
+        self._packed = PackedPool() if np is not None else None
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, user_id):
+        return user_id in self._where
+
+    def add(self, user_id: str, profile: dict, priority: int = 0, ts: float | None = None,
+            filters: dict | None = None, rating: float | None = None):
+        """Поставить в конец очереди своего уровня. Повторный add (смена профиля,
+        уровня VIP) переносит в новую корзину с прежними seq и ts: место в очереди
+        и накопленное ожидание сохраняются, а каждая FIFO остаётся упорядоченной
+        по seq — и по ts, так что дождавшиеся max_wait идут в ней первыми.
+        Явный ts при первой постановке должен идти по возрастанию (см. _rebuild_pool).
+        filters нужны только векторному подбору (ranked_for)."""
+        old = self._where.get(user_id)
+        if old is not None:
+            self._drop(user_id, old)
+            seq = old[4]
+            if ts is None:
+                ts = old[5]
+            if rating is None:
+                rating = old[6]
+        else:
+            self._seq += 1
+            seq = self._seq
+        if ts is None:
+            ts = time.time()
+        rating = rating or 0.0
+        gender = profile.get("gender", "")
+        age = profile_age(profile)
+        band = rating_band(rating)
+        tiers = self._by_gender.setdefault(gender, {}).setdefault(age, {})
+        _insert_by_seq(tiers.setdefault((band, priority), {}), user_id, (seq, ts, rating))
+        self._where[user_id] = (gender, age, band, priority, seq, ts, rating)
+        self._dirty.add(user_id)
+        if self._packed is not None:
+            self._packed.put(user_id, gender, age, priority, seq, ts, filters, rating)
+
+    def refresh(self, user_id: str, filters: dict | None = None, rating: float | None = None):
+        """Обновить фильтры/рейтинг ожидающего без потери места в очереди."""
+        where = self._where.get(user_id)
+        if where is None:
+            return
+        self._dirty.add(user_id)
+        if self._packed is not None:
+            self._packed.update(user_id, filters, rating)
+        if rating is None or rating == where[6]:
+            return
+        gender, age, band, priority, seq, ts, _ = where
+        new_band = rating_band(rating)
+        tiers = self._by_gender[gender][age]
+        if new_band == band:
+            tiers[(band, priority)][user_id] = (seq, ts, rating)   # ключ есть — порядок не меняется
+        else:
+            self._drop(user_id, where)
+            tiers = self._by_gender.setdefault(gender, {}).setdefault(age, {})
+            _insert_by_seq(tiers.setdefault((new_band, priority), {}), user_id, (seq, ts, rating))
+        self._where[user_id] = (gender, age, new_band, priority, seq, ts, rating)
+
+    def remove(self, user_id: str, matched: bool = False) -> bool:
+        where = self._where.pop(user_id, None)
+        if where is None:
+            return False
+        self._drop(user_id, where)
+        self._dirty.discard(user_id)
+        if self._packed is not None:
+            self._packed.discard(user_id)
+        if matched:
+            priority, ts = where[3], where[5]
+            waits = self._waits.get(priority)
+            if waits is None:
+                waits = self._waits[priority] = deque(maxlen=_WAIT_SAMPLES)
+            waits.append(max(time.time() - ts, 0.0))
+        return True
+
+    def touch(self, user_id: str):
+        """Отметить ожидающего для take_dirty(): сменилось что-то вне пула (чёрный список)."""
+        if user_id in self._where:
+            self._dirty.add(user_id)
+
+    def take_dirty(self) -> list:
+        """Ожидающие, добавленные или изменённые с прошлого вызова, — по уровню и очереди.
+        Пару из двух «чистых» проверять не нужно: тот из них, кто изменился позже,
+        уже искал собеседника, когда второй был в пуле в нынешнем виде."""
+        dirty, self._dirty = self._dirty, set()
+        where = self._where
+        return sorted(dirty, key=lambda u: (-where[u][3], where[u][4]))
+
+    def _drop(self, user_id: str, where: tuple):
+        gender, age, tier = where[0], where[1], (where[2], where[3])
+        ages = self._by_gender[gender]
+        tiers = ages[age]
+        fifo = tiers[tier]
+        fifo.pop(user_id, None)
+        if not fifo:
+            del tiers[tier]
+            if not tiers:
+                del ages[age]
+                if not ages:
+                    del self._by_gender[gender]
+
+    def candidates(self, gender: str | None, min_age: int, max_age: int, min_rating: float = 0.0):
+        """Ожидающие нужного пола, возраста и рейтинга: сначала дождавшиеся max_wait,
+        затем по уровню приоритета, внутри уровня — по очереди.
+        Корзины рейтинга ниже min_rating отбрасываются целиком.
+        Ленивый обход без копий: пока он не закончен, пул менять нельзя."""
+        genders = [gender] if gender is not None else list(self._by_gender)
+        min_band = rating_band(min_rating)
+        # в пограничной корзине рейтинг надо проверить поштучно, если порог не целый
+        edge_band = min_band if min_rating > min_band else None
+        buckets = []
+        for g in genders:
+            ages = self._by_gender.get(g)
+            if not ages:
+                continue
+            # корзин по возрастам немного — берём меньший из двух обходов
+            if max_age - min_age + 1 <= len(ages):
+                hits = (ages.get(a) for a in range(min_age, max_age + 1))
+            else:
+                hits = (b for a, b in ages.items() if a is not None and min_age <= a <= max_age)
+            for tiers in hits:
+                if not tiers:
+                    continue
+                for (band, priority), fifo in tiers.items():
+                    if band >= min_band:
+                        buckets.append((priority, fifo, min_rating if band == edge_band else None))
+
+        return self._merge(buckets)
+
+    def _merge(self, buckets: list):
+        cutoff = time.time() - self.max_wait
+        if len(buckets) == 1 and buckets[0][2] is None:
+            # внутри одной FIFO повышенные и так идут первыми
+            return iter(buckets[0][1])
+        streams = [self._stream(priority, fifo, cutoff, floor) for priority, fifo, floor in buckets]
+        return (u for _, u in heapq.merge(*streams))
+
+    @staticmethod
+    def _stream(priority: int, fifo: dict, cutoff: float, floor: float | None):
+        rank = -priority
+        for uid, (seq, ts, rating) in fifo.items():
+            if floor is not None and rating < floor:
+                continue
+            yield (_PROMOTED if ts <= cutoff else rank, seq), uid
+
+    def ranked_for(self, user_id: str):
+        """Векторный подбор: взаимно подходящие по полу/возрасту/рейтингу кандидаты
+        в порядке candidates(). None, если numpy нет или user_id не в пуле."""
+        if self._packed is None or user_id not in self._where:
+            return None
+        return self._packed.ranked_for(user_id, time.time() - self.max_wait)
+
+    def wait_stats(self) -> dict:
+        """priority -> {n, avg, p50, p99} по последним совпадениям (сек)."""
+        out = {}
+        for priority, waits in self._waits.items():
+            values = sorted(waits)
+            if not values:
+                continue
+            out[priority] = {
+                "n": len(values),
+                "avg": round(sum(values) / len(values), 1),
+                "p50": round(_percentile(values, 0.50), 1),
+                "p99": round(_percentile(values, 0.99), 1),
+            }
+        return out
+
+
+# ===== PACKED POOL (numpy) =====
+# Те же ожидающие, но столбцами: предикат совместимости и ранжирование считаются
+# одним векторным проходом по всему пулу вместо вызова фильтров на каждого кандидата.
+
+_ANY = 0  # код «любой пол» в фильтре
+
+
+class PackedPool:
+    _INT_FIELDS = ("gender", "age", "f_gender", "f_min_age", "f_max_age", "priority")
+    _FLOAT_FIELDS = ("f_min_rating", "rating", "ts")
+
+    def __init__(self, capacity: int = 1024):
+        self._slot: dict[str, int] = {}
+        self._uids: list = [None] * capacity
+        self._free: list[int] = []
+        self._top = 0   # слоты [0, _top) когда-либо использовались
+        self._codes: dict[str, int] = {}  # пол в профиле -> код
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        for name in self._INT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int32))
+        for name in self._FLOAT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+
+    def _code(self, gender: str) -> int:
+        code = self._codes.get(gender)
+        if code is None:
+            code = self._codes[gender] = len(self._codes) + 1
+        return code
+
+    def _grow(self):
+        size = len(self._uids) * 2
+        self._uids.extend([None] * (size - len(self._uids)))
+        for name in ("alive", "seq", *self._INT_FIELDS, *self._FLOAT_FIELDS):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def put(self, user_id, gender, age, priority, seq, ts, filters, rating):
+        i = self._slot.get(user_id)
+        if i is None:
+            if self._free:
+                i = self._free.pop()
+            else:
+                if self._top == len(self._uids):
+                    self._grow()
+                i = self._top
+                self._top += 1
+            self._slot[user_id] = i
+            self._uids[i] = user_id
+            # новый слот: значения по умолчанию как в _matches_filters
+            filters = filters or {}
+            rating = rating or 0.0
+        self.alive[i] = True
+        self.gender[i] = self._code(gender)
+        self.age[i] = -1 if age is None else age
+        self.priority[i] = priority
+        self.seq[i] = seq
+        self.ts[i] = ts
+        self._set_attrs(i, filters, rating)
+
+    def update(self, user_id, filters, rating):
+        i = self._slot.get(user_id)
+        if i is not None:
+            self._set_attrs(i, filters, rating)
+
+    def _set_attrs(self, i: int, filters: dict | None, rating: float | None):
+        if filters is not None:
+            want = GENDER_CODES.get(filters.get("gender", "all"))
+            self.f_gender[i] = _ANY if want is None else self._code(want)
+            try:
+                self.f_min_age[i] = int(filters.get("min_age", 16))
+                self.f_max_age[i] = int(filters.get("max_age", 99))
+            except (ValueError, TypeError):
+                # как в _matches_filters: кривой фильтр не пропускает никого
+                self.f_min_age[i], self.f_max_age[i] = 1, 0
+            self.f_min_rating[i] = float(filters.get("min_rating", 0.0))
+        if rating is not None:
+            self.rating[i] = rating
+
+    def discard(self, user_id: str):
+        i = self._slot.pop(user_id, None)
+        if i is not None:
+            self.alive[i] = False
+            self._uids[i] = None
+            self._free.append(i)
+
+    def ranked_for(self, user_id: str, cutoff: float):
+        s = self._slot[user_id]
+        n = self._top
+        gender, age = self.gender[:n], self.age[:n]
+
+        mask = self.alive[:n].copy()
+        mask[s] = False
+        # фильтры ищущего
+        if self.f_gender[s] != _ANY:
+            mask &= gender == self.f_gender[s]
+        mask &= (age >= self.f_min_age[s]) & (age <= self.f_max_age[s])
+        mask &= self.rating[:n] >= self.f_min_rating[s]
+        # фильтры кандидатов (взаимность)
+        f_gender = self.f_gender[:n]
+        mask &= (f_gender == _ANY) | (f_gender == gender[s])
+        mask &= (self.f_min_age[:n] <= age[s]) & (age[s] <= self.f_max_age[:n])
+        mask &= self.f_min_rating[:n] <= self.rating[s]
+
+        idx = np.flatnonzero(mask)
+        if not len(idx):
+            return iter(())
+        # тот же порядок, что у MatchPool.candidates: (повышен/уровень, seq)
+        rank = np.where(self.ts[idx] <= cutoff, -np.inf, -self.priority[idx].astype(np.float64))
+        order = idx[np.lexsort((self.seq[idx], rank))]
+        uids = self._uids
+        return (uids[i] for i in order.tolist())
+
+
+# ===== SEARCH QUEUE =====
+
+class SearchQueue(dict):
+    """Упорядоченное множество ожидающих: user_id -> время постановки.
+    Порядок вставки dict — это и есть очередь; вход, выход и проверка — O(1)."""
+
+    def push(self, user_id: str, ts: float | None = None) -> bool:
+        if user_id in self:
+            return False
+        self[user_id] = time.time() if ts is None else ts
+        return True
+
+    def discard(self, user_id: str) -> bool:
+        return self.pop(user_id, None) is not None
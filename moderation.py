@@ -1,6 +1,8 @@
+import heapq
 import time
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from config import ADMINS, MAX_REPORTS
+import callbacks as cb
 
 # ===== ВСПОМОГАТЕЛЬНОЕ =====
 
@@ -34,7 +36,62 @@ def is_active(bans: dict, user_id: str, kind: str) -> bool:
     until = int(s.get("until", 0))
     return until == 0 or until > _now()
 
+# ===== ИНДЕКС АКТИВНЫХ САНКЦИЙ =====
+
+class SanctionIndex:
+    """Активные санкции: kind -> {user_id: until} и общая min-куча сроков.
+
+    Проверка на горячем пути (мут в relay, бан в поиске) — один поиск в словаре;
+    истёкшие записи снимает sweep() пачкой, а не каждая проверка.
+    """
+
+    def __init__(self, bans: dict):
+        self.active: dict[str, dict[str, int]] = {}
+        self._heap: list[tuple[int, str, str]] = []   # (until, user_id, kind); устаревшие пропускаются
+        for uid, pack in bans.items():
+            if uid.startswith("__") or not isinstance(pack, dict):
+                continue
+            for kind, s in pack.items():
+                if isinstance(s, dict):
+                    self.add(kind, uid, int(s.get("until", 0)))
+
+    def add(self, kind: str, user_id: str, until: int):
+        self.active.setdefault(kind, {})[user_id] = until
+        if until:
+            heapq.heappush(self._heap, (until, user_id, kind))
+
+    def discard(self, kind: str, user_id: str):
+        self.active.get(kind, {}).pop(user_id, None)
+
+    def is_active(self, user_id: str, kind: str) -> bool:
+        until = self.active.get(kind, {}).get(user_id)
+        if until is None:
+            return False
+        return until == 0 or until > _now()
+
+    def count(self, kind: str) -> int:
+        return len(self.active.get(kind, ()))
+
+    def sweep(self, bans: dict, now: int | None = None) -> list[tuple[str, str]]:
+        """Снять истёкшие санкции из индекса и bans. Возвращает [(user_id, kind)]."""
+        now = _now() if now is None else now
+        lifted = []
+        while self._heap and self._heap[0][0] <= now:
+            until, uid, kind = heapq.heappop(self._heap)
+            # санкцию могли снять или переназначить — тогда запись в куче устарела
+            if self.active.get(kind, {}).get(uid) != until:
+                continue
+            self.discard(kind, uid)
+            pack = bans.get(uid)
+            if isinstance(pack, dict):
+                pack.pop(kind, None)
+                if not pack:
+                    bans.pop(uid, None)
+            lifted.append((uid, kind))
+        return lifted
+
 # ===== САНКЦИИ =====
+# data_pack: {"bans": BANS, "index": SanctionIndex} — индекс необязателен
 
 def set_sanction(kind: str, target_id: str, data_pack: dict, by_id: int, minutes: int, note: str):
     bans = data_pack["bans"]
@@ -45,10 +102,16 @@ def set_sanction(kind: str, target_id: str, data_pack: dict, by_id: int, minutes
         "by": int(by_id),
         "note": note
     }
+    index = data_pack.get("index")
+    if index is not None:
+        index.add(kind, target_id, until)
 
 
 def clear_sanction(kind: str, target_id: str, data_pack: dict, by_id: int) -> bool:
     bans = data_pack["bans"]
+    index = data_pack.get("index")
+    if index is not None:
+        index.discard(kind, target_id)
     pack = bans.get(target_id)
     if not isinstance(pack, dict):
         return False
@@ -72,6 +135,57 @@ def add_report(reporter_id: str, target_id: str, reason_key: str, data: dict):
     if reports[target_id] >= int(data.get("max_reports", MAX_REPORTS)):
         _ensure_user_pack(bans, target_id)
 
+# ===== СВОДКА ЖАЛОБ =====
+
+class ReportDigest:
+    """Копит жалобы по нарушителю и отдаёт их сводкой раз в интервал.
+
+    Повторная жалоба того же человека на того же нарушителя в пределах dedup_window
+    не считается. Нарушитель, чьё число жалоб перешло escalate_at, уходит в мод-лог
+    сразу, не дожидаясь сводки.
+    """
+
+    def __init__(self, dedup_window: int, escalate_at: int):
+        self.dedup_window = dedup_window
+        self.escalate_at = escalate_at
+        self._seen: dict[tuple[str, str], int] = {}   # (reporter, target) -> когда принята жалоба
+        self._pending: dict[str, dict] = {}            # target -> {"reasons": {reason: n}, "reporters": set}
+        self.stats = {"accepted": 0, "duplicates": 0, "digests": 0, "escalations": 0}
+
+    def is_duplicate(self, reporter_id: str, target_id: str) -> bool:
+        at = self._seen.get((reporter_id, target_id))
+        if at is None or _now() - at >= self.dedup_window:
+            return False
+        self.stats["duplicates"] += 1
+        return True
+
+    def add(self, reporter_id: str, target_id: str, reason_key: str, total: int) -> bool:
+        """Учесть жалобу (total — счётчик после add_report). True — пора эскалировать."""
+        self._seen[(reporter_id, target_id)] = _now()
+        entry = self._pending.get(target_id)
+        if entry is None:
+            entry = self._pending[target_id] = {"reasons": {}, "reporters": set()}
+        entry["reasons"][reason_key] = entry["reasons"].get(reason_key, 0) + 1
+        entry["reporters"].add(reporter_id)
+        self.stats["accepted"] += 1
+        if total - 1 < self.escalate_at <= total:
+            self.stats["escalations"] += 1
+            return True
+        return False
+
+    def take(self, target_id: str):
+        """Забрать накопленное по одному нарушителю (для эскалации)."""
+        return self._pending.pop(target_id, None)
+
+    def flush(self) -> list[tuple[str, dict]]:
+        """Все накопленные сводки; заодно забываем старые отметки для дедупликации."""
+        pending, self._pending = self._pending, {}
+        cutoff = _now() - self.dedup_window
+        for key in [k for k, at in self._seen.items() if at <= cutoff]:
+            del self._seen[key]
+        self.stats["digests"] += len(pending)
+        return list(pending.items())
+
 # ===== ТЕКСТ ЖАЛОБЫ =====
 
 def report_text(reporter_user, target_user, reason_key: str, reports_count: int) -> str:
@@ -83,28 +197,40 @@ def report_text(reporter_user, target_user, reason_key: str, reports_count: int)
         f"Жалоб на пользователя: *{reports_count}*\n"
     )
 
+def digest_text(target_id: str, entry: dict, reports_count: int, urgent: bool = False,
+                target_name: str = "—") -> str:
+    reasons = ", ".join(f"{k} ×{n}" for k, n in sorted(entry["reasons"].items(), key=lambda kv: -kv[1]))
+    head = "🚨 *Порог жалоб превышен*" if urgent else "📋 *Жалобы*"
+    return (
+        f"{head}\n\n"
+        f"На: `{target_id}` {target_name}\n"
+        f"Причины: {reasons}\n"
+        f"Жалобщиков: *{len(entry['reporters'])}*\n"
+        f"Всего жалоб на пользователя: *{reports_count}*\n"
+    )
+
 # ===== КЛАВИАТУРЫ =====
 
 def report_keyboard():
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🧨 Спам", callback_data="report_spam")],
-        [InlineKeyboardButton("🤬 Оскорбления", callback_data="report_abuse")],
-        [InlineKeyboardButton("🔞 Контент", callback_data="report_18")],
-        [InlineKeyboardButton("🚫 Другое", callback_data="report_other")],
+        [InlineKeyboardButton("🧨 Спам", callback_data=cb.pack(cb.REPORT, "spam"))],
+        [InlineKeyboardButton("🤬 Оскорбления", callback_data=cb.pack(cb.REPORT, "abuse"))],
+        [InlineKeyboardButton("🔞 Контент", callback_data=cb.pack(cb.REPORT, "18"))],
+        [InlineKeyboardButton("🚫 Другое", callback_data=cb.pack(cb.REPORT, "other"))],
     ])
 
 
 def admin_actions_keyboard(target_id: str):
     return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("🚫 Бан 24ч", callback_data=f"admin_ban24_{target_id}"),
-            InlineKeyboardButton("🔓 Разбан", callback_data=f"admin_unban_{target_id}"),
+            InlineKeyboardButton("🚫 Бан 24ч", callback_data=cb.pack(cb.ADMIN_BAN, target_id)),
+            InlineKeyboardButton("🔓 Разбан", callback_data=cb.pack(cb.ADMIN_UNBAN, target_id)),
         ],
         [
-            InlineKeyboardButton("🔇 Мут 30м", callback_data=f"admin_mute30_{target_id}"),
-            InlineKeyboardButton("🔊 Размут", callback_data=f"admin_unmute_{target_id}"),
+            InlineKeyboardButton("🔇 Мут 30м", callback_data=cb.pack(cb.ADMIN_MUTE, target_id)),
+            InlineKeyboardButton("🔊 Размут", callback_data=cb.pack(cb.ADMIN_UNMUTE, target_id)),
         ],
         [
-            InlineKeyboardButton("👤 Профиль", callback_data=f"admin_profile_{target_id}"),
+            InlineKeyboardButton("👤 Профиль", callback_data=cb.pack(cb.ADMIN_PROFILE, target_id)),
         ]
     ])
@@ -0,0 +1,130 @@
+# outbox.py
+# Исходящие системные сообщения, которые нельзя терять: «собеседник найден»,
+# «диалог завершён», уведомления о санкциях. Хранятся в секции outbox и
+# переживают перезапуск; временные ошибки повторяются с экспоненциальной паузой.
+
+import asyncio
+import heapq
+import random
+import time
+
+from telegram.error import BadRequest, Forbidden
+
+# запись: [chat_id, lane, text, kb, attempts, next_at]
+CHAT, LANE, TEXT, KB, ATTEMPTS, NEXT_AT = range(6)
+
+
+class Outbox:
+    """Очередь доставки поверх sender.Sender.
+
+    entries — словарь из DATA (id -> запись), его же видит флашер; изменения
+    записываются через record(op, key, value) (outbox_put / outbox_del).
+    send(entry) — корутина отправки; on_blocked(chat_id) — бот заблокирован.
+    """
+
+    def __init__(self, entries: dict, send, record, on_blocked, base_delay: float = 2.0,
+                 max_delay: float = 600.0, max_attempts: int = 8):
+        self.entries = entries
+        self._send = send
+        self._record = record
+        self._on_blocked = on_blocked
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._heap: list[tuple[float, str]] = [(e[NEXT_AT], k) for k, e in entries.items()]
+        heapq.heapify(self._heap)
+        self._seq = max((int(k) for k in entries if k.isdigit()), default=0)
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._in_flight: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()   # сильные ссылки: loop держит задачи лишь слабо
+        self.stats = {"queued": 0, "delivered": 0, "retried": 0, "blocked": 0, "dropped": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, chat_id, text: str, kb: str | None = None, lane: int = 1):
+        """Поставить сообщение; отправка — в фоне, вызывающий не ждёт."""
+        self._seq += 1
+        key = str(self._seq)
+        entry = [int(chat_id), lane, text, kb, 0, 0.0]
+        self.entries[key] = entry
+        self._record("outbox_put", key, entry)
+        heapq.heappush(self._heap, (0.0, key))
+        self.stats["queued"] += 1
+        self._wake.set()
+        return key
+
+    # ===== ФОН =====
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # прерванные доставки остаются в entries и уйдут после перезапуска
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                if key in self.entries and key not in self._in_flight:
+                    self._in_flight.add(key)
+                    task = asyncio.create_task(self._deliver(key))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, key: str):
+        entry = self.entries[key]
+        try:
+            await self._send(entry)
+        except Forbidden:
+            # заблокировал бота — повторять бессмысленно
+            self.stats["blocked"] += 1
+            self._on_blocked(str(entry[CHAT]))
+            self._drop(key)
+        except BadRequest as e:
+            # чат не найден / кривой текст — тоже навсегда
+            print("❌ OUTBOX:", e)
+            self.stats["dropped"] += 1
+            self._drop(key)
+        except Exception as e:
+            entry[ATTEMPTS] += 1
+            if entry[ATTEMPTS] >= self.max_attempts:
+                print("❌ OUTBOX: сдаёмся после", entry[ATTEMPTS], "попыток:", e)
+                self.stats["dropped"] += 1
+                self._drop(key)
+                return
+            # экспоненциальная пауза с джиттером, чтобы повторы не шли пачкой
+            delay = min(self.base_delay * 2 ** (entry[ATTEMPTS] - 1), self.max_delay)
+            entry[NEXT_AT] = time.time() + delay * random.uniform(0.8, 1.2)
+            self._record("outbox_put", key, entry)
+            heapq.heappush(self._heap, (entry[NEXT_AT], key))
+            self.stats["retried"] += 1
+            self._wake.set()
+        else:
+            self.stats["delivered"] += 1
+            self._drop(key)
+        finally:
+            self._in_flight.discard(key)
+
+    def _drop(self, key: str):
+        if self.entries.pop(key, None) is not None:
+            self._record("outbox_del", key, None)
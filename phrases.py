@@ -0,0 +1,134 @@
+# phrases.py
+# Фильтр запрещённых фраз и ссылок для переписки: автомат Ахо — Корасик,
+# проверка за один проход по тексту при любом числе шаблонов.
+#
+# Файл шаблонов (PHRASES_FILE), по строке на шаблон, регистр не важен:
+#   block t.me/joinchat
+#   warn  дурак
+#   report казино
+# Пустые строки и строки с "#" в начале пропускаются. Файл перечитывается
+# при изменении (reload_if_changed), перезапуск не нужен.
+
+import os
+
+BLOCK = "block"      # не доставлять
+REPORT = "report"    # не доставлять и пожаловаться модераторам
+WARN = "warn"        # доставить, но предупредить отправителя
+
+ACTIONS = (REPORT, BLOCK, WARN)    # по убыванию строгости
+
+
+class Automaton:
+    """Ахо — Корасик над строками в нижнем регистре."""
+
+    def __init__(self, patterns: list[str]):
+        self.patterns = patterns
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(index)
+
+        # ссылки неудач — обходом в ширину; выходы наследуются по ним
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def search(self, text: str) -> set[int]:
+        """Индексы шаблонов, встретившихся в text (text — уже в нижнем регистре)."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class PhraseFilter:
+    """check(text) -> (действие, [фразы]) или None; hits — срабатывания по фразам."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._actions: list[str] = []
+        self._automaton = Automaton([])
+        self.hits: dict[str, int] = {}
+        self.reload_if_changed()
+
+    def __len__(self):
+        return len(self._actions)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        self._load()
+        return True
+
+    def _load(self):
+        rules: dict[str, str] = {}
+        if self._mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            except (OSError, UnicodeDecodeError) as e:
+                # битый файл — работаем со старым списком до следующей правки
+                print("❌ PHRASES:", e)
+                return
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                action, _, phrase = line.partition(" ")
+                phrase = phrase.strip().lower()
+                if action not in ACTIONS or not phrase:
+                    print("⚠️ PHRASES: пропущена строка:", line)
+                    continue
+                # одна фраза в нескольких строках — берём самое строгое действие
+                if phrase not in rules or ACTIONS.index(action) < ACTIONS.index(rules[phrase]):
+                    rules[phrase] = action
+        # новый автомат подменяется целиком — проверки не видят полусобранного
+        self._automaton, self._actions = Automaton(list(rules)), list(rules.values())
+        print(f"✅ PHRASES: {len(rules)} шаблонов")
+
+    def check(self, text: str):
+        if not self._actions or not text:
+            return None
+        automaton, actions = self._automaton, self._actions
+        found = automaton.search(text.lower())
+        if not found:
+            return None
+        phrases = [automaton.patterns[i] for i in found]
+        for phrase in phrases:
+            self.hits[phrase] = self.hits.get(phrase, 0) + 1
+        action = min((actions[i] for i in found), key=ACTIONS.index)
+        return action, phrases
+
+    def top(self, n: int = 5) -> list[tuple[str, int]]:
+        return sorted(self.hits.items(), key=lambda kv: -kv[1])[:n]
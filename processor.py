@@ -0,0 +1,59 @@
+# processor.py
+# Параллельная обработка апдейтов: разные пользователи — одновременно,
+# апдейты одного пользователя — строго по очереди.
+
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """До max_concurrent_updates апдейтов сразу, но с замком на пользователя:
+    сообщения одного человека обрабатываются в порядке прихода.
+
+    Сначала берётся замок пользователя, потом общий слот: апдейты, ждущие своей
+    очереди у одного пользователя, слотов не занимают, так что флудящий
+    пользователь не останавливает остальных.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # семафор базового класса берётся до do_process_update, то есть до замка
+        # пользователя, — поэтому он фактически снят, а лимит держит _slots
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: dict[int, list] = {}   # user_id -> [lock, сколько апдейтов его ждут/держат]
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        slot = self._locks.get(key)
+        if slot is None:
+            slot = self._locks[key] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            async with slot[0], self._slots:
+                await coroutine
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                # замки живут, только пока у пользователя есть апдейты в работе
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
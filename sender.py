@@ -0,0 +1,242 @@
+# sender.py
+# Планировщик исходящих вызовов Bot API: полосы приоритета, общий и поканальный лимиты,
+# отложенный повтор по RetryAfter.
+
+import asyncio
+import time
+from collections import deque
+from itertools import islice
+
+from telegram.error import RetryAfter
+
+# ===== ПОЛОСЫ (меньше — важнее) =====
+LANE_RELAY = 0        # переписка в диалоге
+LANE_MATCH = 1        # «собеседник найден», «диалог завершён»
+LANE_MODERATION = 2   # лог модерации, уведомления о санкциях
+LANE_BROADCAST = 3    # рассылки
+
+LANE_NAMES = {
+    LANE_RELAY: "relay",
+    LANE_MATCH: "match",
+    LANE_MODERATION: "moderation",
+    LANE_BROADCAST: "broadcast",
+}
+
+_SCAN = 64            # сколько задач полосы просматривать в поисках готового чата
+_SAMPLES = 500        # последних задержек на полосу для статистики
+
+
+class _Rate:
+    """GCRA: не чаще одного вызова в interval, с запасом на burst подряд."""
+
+    __slots__ = ("interval", "slack")
+
+    def __init__(self, interval: float, burst: int = 1):
+        self.interval = interval
+        self.slack = interval * max(burst - 1, 0)
+
+    def wait(self, tat: float, now: float) -> float:
+        """Сколько ждать до разрешённого вызова (0 — можно сейчас)."""
+        return max(tat - self.slack - now, 0.0)
+
+    def take(self, tat: float, now: float) -> float:
+        """Новое tat после вызова."""
+        return max(tat, now) + self.interval
+
+
+class _Job:
+    __slots__ = ("lane", "chat_id", "call", "future", "queued", "retries")
+
+    def __init__(self, lane, chat_id, call, future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.queued = time.monotonic()
+        self.retries = 0
+
+
+class Sender:
+    """Очередь исходящих вызовов.
+
+    submit(lane, chat_id, call) ставит call — функцию без аргументов, возвращающую
+    корутину (например lambda: bot.send_message(...)), — и сразу отдаёт future.
+    Диспетчер берёт задачи по приоритету полос, соблюдая общий лимит (global_rate в сек)
+    и лимит на чат (chat_interval, у групп — group_interval). В один чат вызовы идут
+    по одному; внутри полосы — в порядке постановки, более важная полоса может обогнать.
+    """
+
+    def __init__(self, global_rate: float = 25.0, chat_interval: float = 1.0, chat_burst: int = 3,
+                 group_interval: float = 3.0, max_retries: int = 3):
+        self._global = _Rate(1.0 / global_rate, burst=max(int(global_rate), 1))
+        self._global_tat = 0.0
+        self._private = _Rate(chat_interval, chat_burst)
+        self._group = _Rate(group_interval, 1)
+        self._chat_tat: dict[int, float] = {}          # chat_id -> tat (или конец RetryAfter)
+        self._busy: set[int] = set()                   # чаты с вызовом в полёте
+        self._lanes = {lane: deque() for lane in LANE_NAMES}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._deliveries: set[asyncio.Task] = set()    # сильные ссылки: loop держит задачи лишь слабо
+        self.max_retries = max_retries
+
+        self._stats = {
+            lane: {"sent": 0, "failed": 0, "retry_after": 0, "waits": deque(maxlen=_SAMPLES)}
+            for lane in LANE_NAMES
+        }
+
+    # ===== ПОСТАНОВКА =====
+    def submit(self, lane: int, chat_id: int, call) -> asyncio.Future:
+        chat_id = int(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(lane, chat_id, call, future)
+        self._lanes[lane].append(job)
+        self._wake.set()
+        return future
+
+    async def send(self, lane: int, chat_id: int, call):
+        """submit и дождаться результата (исключение вызова пробрасывается)."""
+        return await self.submit(lane, chat_id, call)
+
+    def pending(self, lane: int | None = None) -> int:
+        if lane is not None:
+            return len(self._lanes[lane])
+        return sum(len(q) for q in self._lanes.values())
+
+    # ===== ДИСПЕТЧЕР =====
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._deliveries):
+            task.cancel()
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+        for q in self._lanes.values():
+            while q:
+                job = q.popleft()
+                if not job.future.done():
+                    job.future.cancel()
+
+    def _rate(self, chat_id: int) -> _Rate:
+        return self._group if chat_id < 0 else self._private
+
+    def _chat_wait(self, chat_id: int, now: float) -> float | None:
+        """0 — чат готов, >0 — через сколько, None — ждать завершения вызова в полёте."""
+        if chat_id in self._busy:
+            return None
+        return self._rate(chat_id).wait(self._chat_tat.get(chat_id, 0.0), now)
+
+    def _pick(self, now: float):
+        """Первая готовая задача по приоритету полос; иначе (None, через сколько проверить).
+        Более ранняя задача того же чата в полосе всегда встречается раньше — порядок сохраняется."""
+        soonest = None
+        for q in self._lanes.values():
+            for i, job in enumerate(islice(q, _SCAN)):
+                wait = self._chat_wait(job.chat_id, now)
+                if wait is None:
+                    continue
+                if wait == 0.0:
+                    del q[i]
+                    return job, None
+                soonest = wait if soonest is None else min(soonest, wait)
+        return None, soonest
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            delay = self._global.wait(self._global_tat, now)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            job, wait = self._pick(now)
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global_tat = self._global.take(self._global_tat, now)
+            rate = self._rate(job.chat_id)
+            self._chat_tat[job.chat_id] = rate.take(self._chat_tat.get(job.chat_id, 0.0), now)
+            self._busy.add(job.chat_id)
+            task = asyncio.create_task(self._deliver(job))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+            if len(self._chat_tat) > 10_000:
+                self._prune(now)
+
+    async def _deliver(self, job: _Job):
+        stats = self._stats[job.lane]
+        try:
+            if job.future.cancelled():
+                return
+            if not job.retries:
+                stats["waits"].append(time.monotonic() - job.queued)
+            try:
+                result = await job.call()
+            except RetryAfter as e:
+                stats["retry_after"] += 1
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                # чат заморожен до конца RetryAfter; задача возвращается в голову полосы
+                self._chat_tat[job.chat_id] = time.monotonic() + float(retry_after) + self._rate(job.chat_id).slack
+                if job.retries < self.max_retries:
+                    job.retries += 1
+                    self._lanes[job.lane].appendleft(job)
+                    return
+                stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except Exception as e:
+                stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                stats["sent"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+        except asyncio.CancelledError:
+            # close(): ждущий send() не должен висеть
+            job.future.cancel()
+            raise
+        finally:
+            self._busy.discard(job.chat_id)
+            self._wake.set()
+
+    def _prune(self, now: float):
+        """Забыть чаты, чей лимит уже полностью восстановился."""
+        for chat_id, tat in list(self._chat_tat.items()):
+            if tat <= now and chat_id not in self._busy:
+                del self._chat_tat[chat_id]
+
+    # ===== СТАТИСТИКА =====
+    def stats(self) -> dict:
+        """По полосам: depth, sent, failed, retry_after, wait avg/p99/max (мс)."""
+        out = {}
+        for lane, st in self._stats.items():
+            waits = sorted(st["waits"])
+            n = len(waits)
+            out[LANE_NAMES[lane]] = {
+                "depth": len(self._lanes[lane]),
+                "sent": st["sent"],
+                "failed": st["failed"],
+                "retry_after": st["retry_after"],
+                "avg_ms": round(sum(waits) / n * 1000, 1) if n else 0.0,
+                "p99_ms": round(waits[min(int(n * 0.99), n - 1)] * 1000, 1) if n else 0.0,
+                "max_ms": round(waits[-1] * 1000, 1) if n else 0.0,
+            }
+        return out
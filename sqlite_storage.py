@@ -0,0 +1,445 @@
+import json
+import sqlite3
+import sys
+from collections import deque
+
+from storage import SECTIONS, load_data, queue_from_json
+
+# Альтернативный бэкенд: те же данные, что в data/data.json, но в таблицах SQLite (WAL).
+# В памяти бот работает с прежними словарями; сюда уходят только операции журнала.
+
+DB_FILE = "data/data.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    gender  TEXT,
+    age     INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_gender_age ON profiles(gender, age);
+
+CREATE TABLE IF NOT EXISTS sanctions (
+    user_id TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    until   INTEGER NOT NULL DEFAULT 0,
+    "by"    INTEGER,
+    note    TEXT,
+    PRIMARY KEY (user_id, kind)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sanctions_kind_until ON sanctions(kind, until);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    user_id TEXT PRIMARY KEY,
+    total   INTEGER NOT NULL DEFAULT 0,
+    count   INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS blacklist (
+    owner  TEXT NOT NULL,
+    target TEXT NOT NULL,
+    pos    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, target)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_blacklist_target ON blacklist(target, owner);
+
+CREATE TABLE IF NOT EXISTS vip (
+    user_id       TEXT PRIMARY KEY,
+    status        TEXT NOT NULL,
+    expire_date   INTEGER,
+    activate_date INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_vip_expire ON vip(expire_date);
+
+CREATE TABLE IF NOT EXISTS filters (
+    user_id    TEXT PRIMARY KEY,
+    gender     TEXT,
+    min_age    INTEGER,
+    max_age    INTEGER,
+    min_rating REAL
+);
+
+CREATE TABLE IF NOT EXISTS dialogs (
+    user_id    TEXT PRIMARY KEY,
+    partner_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS queue (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE,
+    ts      REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS reports (
+    user_id TEXT PRIMARY KEY,
+    count   INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS last_partner (
+    user_id    TEXT PRIMARY KEY,
+    partner_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pending_ratings (
+    user_id    TEXT PRIMARY KEY,
+    partner_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS unreachable (
+    user_id TEXT PRIMARY KEY,
+    since   INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id    TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+"""
+
+# секция storage.SECTIONS -> таблица; save_all() перезаписывает таблицы целиком
+_TABLES = {
+    "profiles": "profiles",
+    "bans": "sanctions",
+    "ratings": "ratings",
+    "blacklist": "blacklist",
+    "vip": "vip",
+    "filters": "filters",
+    "dialogs": "dialogs",
+    "queue": "queue",
+    "reports": "reports",
+    "last_partner": "last_partner",
+    "pending_ratings": "pending_ratings",
+    "unreachable": "unreachable",
+    "outbox": "outbox",
+}
+
+
+def _age(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class SqliteStorage:
+    """Хранилище на SQLite. Кроме load() на старте, вызывается только из потока флашера."""
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._conn = None
+
+    def connect(self):
+        if self._conn is None:
+            import os
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            # базы до появления времени постановки в очередь
+            cols = {row[1] for row in conn.execute("PRAGMA table_info(queue)")}
+            if "ts" not in cols:
+                conn.execute("ALTER TABLE queue ADD COLUMN ts REAL NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ===== ЧТЕНИЕ =====
+
+    def load(self) -> dict:
+        """Собрать данные в том же виде, что и storage.load_data()."""
+        c = self.connect()
+        profiles = {
+            uid: {"gender": gender, "age": None if age is None else str(age)}
+            for uid, gender, age in c.execute("SELECT user_id, gender, age FROM profiles")
+        }
+        dialogs = dict(c.execute("SELECT user_id, partner_id FROM dialogs"))
+        queue = dict(c.execute("SELECT user_id, ts FROM queue ORDER BY seq"))
+        reports = dict(c.execute("SELECT user_id, count FROM reports"))
+
+        bans = {}
+        for uid, kind, until, by, note in c.execute(
+            'SELECT user_id, kind, until, "by", note FROM sanctions'
+        ):
+            bans.setdefault(uid, {})[kind] = {"until": until, "by": by, "note": note}
+
+        blacklist = {}
+        for owner, target in c.execute("SELECT owner, target FROM blacklist ORDER BY owner, pos"):
+            blacklist.setdefault(owner, []).append(target)
+        bans["__blacklist__"] = blacklist
+        bans["__last_partner__"] = dict(c.execute("SELECT user_id, partner_id FROM last_partner"))
+        bans["__ratings__"] = {
+            uid: {"total": total, "count": count}
+            for uid, total, count in c.execute("SELECT user_id, total, count FROM ratings")
+        }
+        bans["__pending_ratings__"] = dict(c.execute("SELECT user_id, partner_id FROM pending_ratings"))
+
+        filters = {
+            uid: {"gender": g, "min_age": lo, "max_age": hi, "min_rating": r}
+            for uid, g, lo, hi, r in c.execute(
+                "SELECT user_id, gender, min_age, max_age, min_rating FROM filters"
+            )
+        }
+        vip = {
+            uid: {"status": st, "expire_date": exp, "activate_date": act}
+            for uid, st, exp, act in c.execute(
+                "SELECT user_id, status, expire_date, activate_date FROM vip"
+            )
+        }
+        return {
+            "profiles": profiles,
+            "dialogs": dialogs,
+            "queue": queue,
+            "bans": bans,
+            "reports": reports,
+            "__filters__": filters,
+            "__vip__": vip,
+            "__unreachable__": dict(c.execute("SELECT user_id, since FROM unreachable")),
+            "__outbox__": {k: json.loads(v) for k, v in c.execute("SELECT id, entry FROM outbox")},
+        }
+
+    # ===== ЗАПИСЬ =====
+
+    def _set_sanctions(self, c, uid: str, pack):
+        c.execute("DELETE FROM sanctions WHERE user_id = ?", (uid,))
+        if not isinstance(pack, dict):
+            return
+        for kind, s in pack.items():
+            if isinstance(s, dict):
+                c.execute(
+                    'INSERT INTO sanctions (user_id, kind, until, "by", note) VALUES (?, ?, ?, ?, ?)',
+                    (uid, kind, int(s.get("until", 0)), s.get("by"), s.get("note")),
+                )
+
+    def _apply(self, c, op: str, key: str, value):
+        if op == "profile_set":
+            c.execute(
+                "INSERT OR REPLACE INTO profiles (user_id, gender, age) VALUES (?, ?, ?)",
+                (key, value.get("gender"), _age(value.get("age"))),
+            )
+        elif op == "profile_del":
+            c.execute("DELETE FROM profiles WHERE user_id = ?", (key,))
+        elif op == "dialog_open":
+            c.executemany(
+                "INSERT OR REPLACE INTO dialogs (user_id, partner_id) VALUES (?, ?)",
+                ((key, value), (value, key)),
+            )
+        elif op == "dialog_close":
+            c.executemany("DELETE FROM dialogs WHERE user_id = ?", ((key,), (value,)))
+        elif op == "dialog_drop":
+            c.execute("DELETE FROM dialogs WHERE user_id = ?", (key,))
+        elif op == "queue_push":
+            c.execute("INSERT OR IGNORE INTO queue (user_id, ts) VALUES (?, ?)", (key, value or 0.0))
+        elif op == "queue_pop":
+            c.execute("DELETE FROM queue WHERE user_id = ?", (key,))
+        elif op == "sanction_set":
+            self._set_sanctions(c, key, value)
+        elif op == "sanction_clear":
+            c.execute("DELETE FROM sanctions WHERE user_id = ?", (key,))
+        elif op == "report_set":
+            c.execute("INSERT OR REPLACE INTO reports (user_id, count) VALUES (?, ?)", (key, int(value)))
+        elif op == "rating_add":
+            c.execute(
+                "INSERT OR REPLACE INTO ratings (user_id, total, count) VALUES (?, ?, ?)",
+                (key, int(value["total"]), int(value["count"])),
+            )
+        elif op == "pending_rating_set":
+            c.execute(
+                "INSERT OR REPLACE INTO pending_ratings (user_id, partner_id) VALUES (?, ?)", (key, value)
+            )
+        elif op == "pending_rating_del":
+            c.execute("DELETE FROM pending_ratings WHERE user_id = ?", (key,))
+        elif op == "last_partner_set":
+            c.execute(
+                "INSERT OR REPLACE INTO last_partner (user_id, partner_id) VALUES (?, ?)", (key, value)
+            )
+        elif op == "bl_add":
+            c.execute(
+                "INSERT OR IGNORE INTO blacklist (owner, target, pos) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(pos), 0) + 1 FROM blacklist WHERE owner = ?))",
+                (key, value, key),
+            )
+        elif op == "bl_remove":
+            c.execute("DELETE FROM blacklist WHERE owner = ? AND target = ?", (key, value))
+        elif op == "filter_set":
+            c.execute(
+                "INSERT OR REPLACE INTO filters (user_id, gender, min_age, max_age, min_rating) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value.get("gender"), value.get("min_age"), value.get("max_age"), value.get("min_rating")),
+            )
+        elif op == "unreachable_set":
+            c.execute("INSERT OR REPLACE INTO unreachable (user_id, since) VALUES (?, ?)", (key, int(value or 0)))
+        elif op == "unreachable_del":
+            c.execute("DELETE FROM unreachable WHERE user_id = ?", (key,))
+        elif op == "outbox_put":
+            c.execute("INSERT OR REPLACE INTO outbox (id, entry) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+        elif op == "outbox_del":
+            c.execute("DELETE FROM outbox WHERE id = ?", (key,))
+        elif op == "vip_set":
+            c.execute(
+                "INSERT OR REPLACE INTO vip (user_id, status, expire_date, activate_date) VALUES (?, ?, ?, ?)",
+                (key, value.get("status"), value.get("expire_date"), value.get("activate_date")),
+            )
+        elif op == "vip_del":
+            c.execute("DELETE FROM vip WHERE user_id = ?", (key,))
+        else:
+            raise ValueError(f"unknown op: {op}")
+
+    def apply(self, ops):
+        """Применить пачку операций журнала одной транзакцией."""
+        c = self.connect()
+        c.execute("BEGIN")
+        try:
+            for op, key, value in ops:
+                self._apply(c, op, key, value)
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+    def snapshot(self, data: dict, names=None):
+        """Операции для секций names (None — все) собираются на event loop;
+        возвращает функцию записи для рабочего потока."""
+        names = [n for n in (_TABLES if names is None else names) if n in _TABLES]
+        sections = json.loads(json.dumps({n: _section_ops(data, n) for n in names}, ensure_ascii=False))
+        return lambda: self._rewrite(sections)
+
+    def save_all(self, data: dict):
+        """Полная перезапись всех таблиц из словаря в формате load_data().
+        data не должен меняться во время записи (см. snapshot)."""
+        self._rewrite({n: _section_ops(data, n) for n in _TABLES})
+
+    def _rewrite(self, sections: dict):
+        """sections: имя секции -> операции; таблица секции очищается и заполняется заново."""
+        c = self.connect()
+        c.execute("BEGIN")
+        try:
+            for name, ops in sections.items():
+                c.execute(f"DELETE FROM {_TABLES[name]}")
+                for op, key, value in ops:
+                    self._apply(c, op, key, value)
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+
+def _section_ops(data: dict, name: str) -> list:
+    """Содержимое одной секции в виде операций журнала."""
+    bans = data.get("bans") or {}
+    if name == "profiles":
+        return [("profile_set", uid, p) for uid, p in (data.get("profiles") or {}).items()]
+    if name == "dialogs":
+        return [("dialog_open", uid, partner) for uid, partner in (data.get("dialogs") or {}).items()]
+    if name == "queue":
+        return [("queue_push", uid, ts) for uid, ts in queue_from_json(data.get("queue")).items()]
+    if name == "reports":
+        return [("report_set", uid, count) for uid, count in (data.get("reports") or {}).items()]
+    if name == "bans":
+        return [("sanction_set", uid, pack) for uid, pack in bans.items() if not uid.startswith("__")]
+    if name == "blacklist":
+        return [
+            ("bl_add", uid, str(target))
+            for uid, lst in (bans.get("__blacklist__") or {}).items()
+            for target in lst or []
+        ]
+    if name == "last_partner":
+        return [("last_partner_set", uid, p) for uid, p in (bans.get("__last_partner__") or {}).items()]
+    if name == "ratings":
+        return [("rating_add", uid, r) for uid, r in (bans.get("__ratings__") or {}).items() if isinstance(r, dict)]
+    if name == "pending_ratings":
+        return [("pending_rating_set", uid, p) for uid, p in (bans.get("__pending_ratings__") or {}).items()]
+    if name == "filters":
+        return [("filter_set", uid, f) for uid, f in (data.get("__filters__") or {}).items() if isinstance(f, dict)]
+    if name == "vip":
+        return [("vip_set", uid, v) for uid, v in (data.get("__vip__") or {}).items() if isinstance(v, dict)]
+    if name == "unreachable":
+        return [("unreachable_set", uid, since) for uid, since in (data.get("__unreachable__") or {}).items()]
+    if name == "outbox":
+        return [("outbox_put", key, entry) for key, entry in (data.get("__outbox__") or {}).items()]
+    return []
+
+
+class SqliteJournal:
+    """Тот же интерфейс, что у storage.Journal, но операции копятся в памяти
+    и применяются к SQLite одной транзакцией на каждом тике флашера."""
+
+    def __init__(self, db: SqliteStorage):
+        self.db = db
+        self.size = 0          # компакция не нужна — WAL сам себе журнал
+        self._ops = deque()    # append/popleft потокобезопасны
+
+    @property
+    def pending(self) -> int:
+        return len(self._ops)
+
+    def append(self, op: str, key: str, value=None):
+        # фиксируем значение сейчас: сам словарь может поменяться до записи
+        self._ops.append(json.dumps([op, key, value], ensure_ascii=False))
+
+    def sync(self):
+        raw = []
+        while self._ops:
+            raw.append(self._ops.popleft())
+        if not raw:
+            return
+        try:
+            self.db.apply([json.loads(x) for x in raw])
+        except Exception:
+            # вернуть в начало очереди в исходном порядке и повторить на следующем тике
+            self._ops.extendleft(reversed(raw))
+            raise
+
+    def rotate(self):
+        return None
+
+    def close(self):
+        self.sync()
+        self.db.close()
+
+
+def _unmapped(data: dict) -> list[str]:
+    """Непустые ключи data (и служебные "__…" в bans), для которых нет таблицы."""
+    known = {SECTIONS[n] for n in _TABLES}
+    found = [key for key, value in data.items() if (key,) not in known and value]
+    bans = data.get("bans")
+    if isinstance(bans, dict):
+        found += [
+            "bans/" + key for key, value in bans.items()
+            if key.startswith("__") and ("bans", key) not in known and value
+        ]
+    return found
+
+
+def migrate(db_path: str = DB_FILE):
+    """Одноразовый перенос data/data.json (+ журнал) в SQLite.
+    Если в данных есть то, что в SQLite не ложится, перенос не начинается (ValueError)."""
+    data = load_data()
+    unmapped = _unmapped(data)
+    if unmapped:
+        # иначе эти данные молча пропали бы при переключении бэкенда
+        raise ValueError("нет таблицы для: " + ", ".join(unmapped))
+    db = SqliteStorage(db_path)
+    db.save_all(data)
+    db.close()
+    return {
+        "profiles": len(data.get("profiles") or {}),
+        "dialogs": len(data.get("dialogs") or {}),
+        "queue": len(data.get("queue") or []),
+    }
+
+
+if __name__ == "__main__":
+    # python sqlite_storage.py migrate [путь к .db]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("usage: python sqlite_storage.py migrate [db_path]")
+        sys.exit(1)
+    try:
+        counts = migrate(sys.argv[2] if len(sys.argv) > 2 else DB_FILE)
+    except ValueError as e:
+        print("❌ Миграция отменена:", e)
+        sys.exit(1)
+    print("✅ Миграция завершена:", counts)
@@ -1,26 +1,36 @@
+import asyncio
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DATA_FILE = "data/data.json"  # у тебя так и должно быть
+JOURNAL_FILE = "data/journal.log"  # журнал операций поверх секций (см. SECTIONS)
 
 def _default():
     return {
         "profiles": {},
         "dialogs": {},
-        "queue": [],
+        "queue": {},
         "bans": {},
         "reports": {},
         "__filters__": {}
     }
 
-def load_data():
-    # если файла нет — создаём дефолт
+def write_atomic(path: str, text: str):
+    # пишем во временный файл и подменяем — при падении посреди записи
+    # старый файл остаётся целым
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _load_snapshot():
+    # старый формат: всё в одном data/data.json
     if not os.path.exists(DATA_FILE):
-        os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-        data = _default()
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return data
+        return _default()
 
     # читаем файл
     try:
@@ -41,15 +51,442 @@ def load_data():
             base[k] = _default()[k]
     return base
 
-def save_data(profiles, dialogs, queue, bans, reports, filters_data=None):
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    data = {
-        "profiles": profiles,
-        "dialogs": dialogs,
-        "queue": queue,
-        "bans": bans,
-        "reports": reports,
-        "__filters__": filters_data or {}
-    }
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# ===== SECTIONS =====
+# Каждое логическое хранилище лежит в своём файле data/shards/<имя>.json,
+# поэтому изменение, например, рейтинга переписывает только ratings.json.
+
+SHARD_DIR = "data/shards"
+_SHARD_INDEX = "_index.json"  # имя секции -> путь внутри data
+
+# имя секции -> путь внутри data
+SECTIONS = {
+    "profiles": ("profiles",),
+    "dialogs": ("dialogs",),
+    "queue": ("queue",),
+    "bans": ("bans",),
+    "reports": ("reports",),
+    "filters": ("__filters__",),
+    "vip": ("__vip__",),
+    "blacklist": ("bans", "__blacklist__"),
+    "last_partner": ("bans", "__last_partner__"),
+    "ratings": ("bans", "__ratings__"),
+    "pending_ratings": ("bans", "__pending_ratings__"),
+    "unreachable": ("__unreachable__",),
+    "outbox": ("__outbox__",),
+}
+
+
+# ===== QUEUE FORMAT =====
+# В памяти очередь — упорядоченный dict user_id -> время постановки.
+# На диске — список, как и раньше: старые файлы хранят просто id,
+# новые — пары [id, ts].
+
+def queue_from_json(raw) -> dict:
+    if isinstance(raw, dict):
+        return dict(raw)
+    queue = {}
+    for item in raw or []:
+        if isinstance(item, list) and item:
+            uid, ts = str(item[0]), (item[1] if len(item) > 1 else None)
+        else:
+            uid, ts = str(item), None
+        queue.setdefault(uid, ts or 0.0)
+    return queue
+
+
+def queue_to_json(queue: dict) -> list:
+    return [[uid, ts] for uid, ts in queue.items()]
+
+
+def register_section(name: str, path: tuple):
+    SECTIONS[name] = tuple(path)
+
+
+def _discover_sections(data: dict):
+    """Всё, что лежит в data, но не описано в SECTIONS, становится отдельной секцией."""
+    known = set(SECTIONS.values())
+    for key in list(data):
+        if (key,) not in known:
+            register_section(key.strip("_") or key, (key,))
+    bans = data.get("bans")
+    if isinstance(bans, dict):
+        for key in list(bans):
+            if key.startswith("__") and ("bans", key) not in known:
+                register_section(key.strip("_"), ("bans", key))
+
+
+def _shard_path(name: str) -> str:
+    return os.path.join(SHARD_DIR, name + ".json")
+
+
+def _section_value(data: dict, path: tuple):
+    node = data
+    for name in path:
+        node = node.get(name) if isinstance(node, dict) else None
+    if isinstance(node, dict):
+        # вложенные секции (например, __blacklist__ внутри bans) пишутся отдельно
+        nested = {p[-1] for p in SECTIONS.values() if len(p) == len(path) + 1 and p[:-1] == path}
+        if nested:
+            node = {k: v for k, v in list(node.items()) if k not in nested}
+    return node
+
+
+def snapshot_sections(data: dict, names=None) -> list[tuple[str, str]]:
+    """Сериализовать секции (None — все) в [(файл, текст)]. Вызывается на event loop —
+    пока идёт сериализация, словари никто не меняет, и снимок целостный."""
+    out = []
+    for name in (SECTIONS if names is None else names):
+        path = SECTIONS.get(name)
+        if path is None:
+            continue
+        value = _section_value(data, path)
+        if value is None:
+            continue
+        if path == ("queue",):
+            value = queue_to_json(value)
+        out.append((_shard_path(name), json.dumps(value, ensure_ascii=False)))
+
+    index = {name: list(path) for name, path in SECTIONS.items()}
+    out.append((os.path.join(SHARD_DIR, _SHARD_INDEX), json.dumps(index, ensure_ascii=False)))
+    return out
+
+
+def write_sections(snapshot: list[tuple[str, str]]):
+    """Записать готовый снимок (snapshot_sections) на диск. Можно из рабочего потока."""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    for path, text in snapshot:
+        write_atomic(path, text)
+
+
+def save_sections(data: dict, names=None):
+    """Снять и сразу записать секции — при загрузке, пока фоновой записи ещё нет."""
+    write_sections(snapshot_sections(data, names))
+
+
+def _read_shard(name: str):
+    try:
+        with open(_shard_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _load_shards() -> dict:
+    with open(os.path.join(SHARD_DIR, _SHARD_INDEX), "r", encoding="utf-8") as f:
+        for name, path in json.load(f).items():
+            SECTIONS.setdefault(name, tuple(path))
+
+    # секции читаются параллельно; родительские ставятся раньше вложенных
+    names = sorted(SECTIONS, key=lambda n: len(SECTIONS[n]))
+    with ThreadPoolExecutor(max_workers=min(len(names), 8)) as pool:
+        values = list(pool.map(_read_shard, names))
+
+    data = _default()
+    for name, value in zip(names, values):
+        if value is None:
+            continue
+        *parents, leaf = SECTIONS[name]
+        node = data
+        for p in parents:
+            node = node.setdefault(p, {})
+        node[leaf] = value
+    return data
+
+
+def load_data():
+    """Секции (или старый data.json) + хвост журнала, в т.ч. недоделанной компакции."""
+    sharded = os.path.exists(os.path.join(SHARD_DIR, _SHARD_INDEX))
+    data = _load_shards() if sharded else _load_snapshot()
+    data["queue"] = queue_from_json(data.get("queue"))
+    replayed = 0
+    for path in (JOURNAL_FILE + ".old", JOURNAL_FILE):
+        replayed += replay_journal(path, data)
+    _discover_sections(data)
+
+    # сразу сворачиваем журнал в секции, чтобы на старте он был пустым;
+    # старый data.json при этом один раз раскладывается по секциям
+    if replayed or not sharded:
+        save_sections(data)
+    for path in (JOURNAL_FILE + ".old", JOURNAL_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    return data
+
+# ===== JOURNAL =====
+# Каждая мутация — одна строка [op, key, value]. Операции пишут итоговое
+# значение по ключу (а не дельту), поэтому повторное применение безопасно:
+# журнал можно проигрывать поверх снимка, который уже частично его содержит.
+
+# op -> (путь к словарю/списку внутри data, действие)
+JOURNAL_OPS = {
+    "profile_set": (("profiles",), "set"),
+    "profile_del": (("profiles",), "del"),
+    "dialog_open": (("dialogs",), "link"),
+    "dialog_close": (("dialogs",), "unlink"),
+    "dialog_drop": (("dialogs",), "del"),
+    "queue_push": (("queue",), "push"),
+    "queue_pop": (("queue",), "pop"),
+    "sanction_set": (("bans",), "set"),       # value — весь пакет санкций пользователя
+    "sanction_clear": (("bans",), "del"),
+    "report_set": (("reports",), "set"),
+    "rating_add": (("bans", "__ratings__"), "set"),  # value — итоговый {total, count}
+    "pending_rating_set": (("bans", "__pending_ratings__"), "set"),
+    "pending_rating_del": (("bans", "__pending_ratings__"), "del"),
+    "last_partner_set": (("bans", "__last_partner__"), "set"),
+    "bl_add": (("bans", "__blacklist__"), "add"),
+    "bl_remove": (("bans", "__blacklist__"), "discard"),
+    "filter_set": (("__filters__",), "set"),
+    "unreachable_set": (("__unreachable__",), "set"),   # value — когда бот получил Forbidden
+    "unreachable_del": (("__unreachable__",), "del"),
+    "outbox_put": (("__outbox__",), "set"),             # value — запись целиком (см. outbox.py)
+    "outbox_del": (("__outbox__",), "del"),
+    "vip_set": (("__vip__",), "set"),                   # value — запись VIP целиком
+    "vip_del": (("__vip__",), "del"),
+}
+
+# op -> секция, которую он меняет (для точечной компакции)
+OP_SECTIONS = {
+    op: next(name for name, p in SECTIONS.items() if p == path)
+    for op, (path, _) in JOURNAL_OPS.items()
+}
+
+
+def _container(data: dict, path: tuple, kind):
+    node = data
+    for i, name in enumerate(path):
+        default = kind() if i == len(path) - 1 else {}
+        child = node.get(name)
+        if not isinstance(child, type(default)):
+            child = default
+            node[name] = child
+        node = child
+    return node
+
+
+def apply_op(data: dict, op: str, key: str, value=None):
+    path, action = JOURNAL_OPS[op]
+    target = _container(data, path, dict)
+    if action == "push":
+        target.setdefault(key, value or 0.0)
+    elif action == "pop":
+        target.pop(key, None)
+    elif action == "set":
+        target[key] = value
+    elif action == "del":
+        target.pop(key, None)
+    elif action == "link":
+        target[key] = value
+        target[value] = key
+    elif action == "unlink":
+        target.pop(key, None)
+        target.pop(value, None)
+    elif action == "add":
+        lst = target.setdefault(key, [])
+        if value not in lst:
+            lst.append(value)
+    elif action == "discard":
+        lst = target.get(key) or []
+        if value in lst:
+            lst.remove(value)
+
+
+def replay_journal(path: str, data: dict) -> int:
+    """Проиграть журнал поверх data. Битая последняя строка (падение посреди записи) пропускается."""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                op, key, value = json.loads(line)
+                apply_op(data, op, key, value)
+            except Exception:
+                continue
+            count += 1
+    return count
+
+
+class Journal:
+    """Append-only лог операций. append() — O(1) на event loop, fsync — в рабочем потоке."""
+
+    def __init__(self, path: str = JOURNAL_FILE):
+        self.path = path
+        self.size = 0
+        self.pending = 0   # записей после последнего fsync
+        self._fd = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self._fd).st_size
+
+    def append(self, op: str, key: str, value=None):
+        if self._fd is None:
+            self.open()
+        line = json.dumps([op, key, value], ensure_ascii=False, separators=(",", ":")) + "\n"
+        raw = line.encode("utf-8")
+        os.write(self._fd, raw)
+        self.size += len(raw)
+        self.pending += 1
+
+    def sync(self):
+        n = self.pending
+        if n and self._fd is not None:
+            os.fsync(self._fd)
+        self.pending -= n
+
+    def rotate(self):
+        """Начать новый файл; старый остаётся как .old до конца компакции."""
+        if self._fd is None or self.size == 0:
+            return None
+        old = self.path + ".old"
+        os.close(self._fd)
+        self._fd = None
+        if os.path.exists(old):
+            # прошлая компакция не удалась — дописываем, а не затираем
+            with open(self.path, "rb") as src, open(old, "ab") as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, old)
+        self.open()
+        self.pending = 0
+        return old
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+# ===== WRITE-BEHIND =====
+
+class WriteBehindStore:
+    """Отложенная запись: мутации уходят в журнал (record) или помечают
+    состояние грязным (mark_dirty), а фоновый флашер не чаще раза в interval
+    секунд делает fsync журнала и, если нужно, компакцию — в рабочем потоке.
+    Запоминаются только изменённые секции, поэтому компакция переписывает лишь их файлы.
+
+    save_fn(names) вызывается на event loop: снимает копию данных и возвращает
+    функцию без аргументов, которая запишет её уже в рабочем потоке. Живые
+    словари в поток не попадают."""
+
+    def __init__(self, save_fn, interval: float = 2.0, journal: Journal | None = None,
+                 compact_bytes: int = 1_000_000):
+        self._save_fn = save_fn
+        self.interval = interval
+        self.journal = journal
+        self.compact_bytes = compact_bytes
+        self._dirty = set()         # секции, которые надо записать на ближайшем тике
+        self._dirty_all = False
+        self._journaled = set()     # секции, изменённые через журнал с прошлой компакции
+        self._task = None
+        self._lock = asyncio.Lock()
+
+        # счётчики для /stats
+        self.marks = 0          # сколько раз звали persist()
+        self.records = 0        # записей в журнал
+        self.flushes = 0        # сколько раз реально писали секции
+        self.sections_written = 0
+        self.syncs = 0          # fsync журнала
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def mark_dirty(self, *sections: str):
+        """Пометить секции грязными; без аргументов — все."""
+        if sections:
+            self._dirty.update(sections)
+        else:
+            self._dirty_all = True
+        self.marks += 1
+
+    def record(self, op: str, key: str, value=None):
+        """Записать одну операцию в журнал; без журнала — сразу пометить её секцию."""
+        section = OP_SECTIONS[op]
+        if self.journal is None:
+            self.mark_dirty(section)
+            return
+        self.journal.append(op, key, value)
+        self._journaled.add(section)
+        self.records += 1
+
+    async def flush(self):
+        """Сбросить журнал на диск и при необходимости свернуть его в снимок."""
+        async with self._lock:
+            journal = self.journal
+            if journal is not None and journal.pending:
+                try:
+                    await asyncio.to_thread(journal.sync)
+                    self.syncs += 1
+                except Exception as e:
+                    self.errors += 1
+                    print("❌ JOURNAL ERROR:", e)
+
+            compact = journal is not None and journal.size >= self.compact_bytes
+            if not self._dirty and not self._dirty_all and not compact:
+                return
+            names = None if self._dirty_all else frozenset(self._dirty | self._journaled)
+            self._dirty, self._dirty_all, self._journaled = set(), False, set()
+            started = time.perf_counter()
+            # ротация до записи: всё, что придёт после, попадёт в новый файл
+            old = journal.rotate() if journal is not None else None
+            try:
+                write = self._save_fn(names)
+                await asyncio.to_thread(write)
+                if old:
+                    await asyncio.to_thread(os.remove, old)
+            except Exception as e:
+                # не теряем изменения — попробуем на следующем тике
+                if names is None:
+                    self._dirty_all = True
+                else:
+                    self._dirty.update(names)
+                self.errors += 1
+                print("❌ PERSIST ERROR:", e)
+                return
+            self.sections_written += len(SECTIONS) if names is None else len(names)
+            ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = ms
+            self.total_flush_ms += ms
+            self.max_flush_ms = max(self.max_flush_ms, ms)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Остановить флашер и сделать финальную запись."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def stats(self) -> dict:
+        return {
+            "marks": self.marks,
+            "records": self.records,
+            "journal_bytes": self.journal.size if self.journal is not None else 0,
+            "syncs": self.syncs,
+            "flushes": self.flushes,
+            "sections_written": self.sections_written,
+            "coalesced": max(self.marks - self.flushes, 0),
+            "errors": self.errors,
+            "last_ms": round(self.last_flush_ms, 1),
+            "avg_ms": round(self.total_flush_ms / self.flushes, 1) if self.flushes else 0.0,
+            "max_ms": round(self.max_flush_ms, 1),
+        }
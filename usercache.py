@@ -0,0 +1,75 @@
+# usercache.py
+# Кэш имён пользователей (username, first_name) для мод-лога и профилей в админке.
+# Заполняется бесплатно из effective_user входящих апдейтов; промах — один get_chat,
+# одновременные промахи по одному id ждут один и тот же запрос.
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """LRU с TTL: user_id -> (username, first_name).
+
+    fetch(user_id) — корутина, возвращающая объект с .username/.first_name
+    (например, bot.get_chat) или бросающая исключение.
+    """
+
+    def __init__(self, fetch, maxsize: int = 50000, ttl: float = 3600.0):
+        self._fetch = fetch
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[str | None, str | None, float]] = OrderedDict()
+        self._loading: dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def put(self, user_id, username: str | None, first_name: str | None):
+        key = str(user_id)
+        self._data[key] = (username, first_name, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, user_id):
+        """(username, first_name) без запроса к API или None."""
+        key = str(user_id)
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[:2]
+
+    async def get(self, user_id):
+        """(username, first_name); при промахе — запрос через fetch. None, если API не ответил."""
+        key = str(user_id)
+        entry = self.peek(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        self.stats["misses"] += 1
+        pending = self._loading[key] = asyncio.get_running_loop().create_future()
+        entry = None
+        try:
+            chat = await self._fetch(int(key))
+            entry = (chat.username, chat.first_name)
+            self.put(key, *entry)
+        except Exception as e:
+            print("❌ USER CACHE:", key, e)
+            self.stats["errors"] += 1
+        finally:
+            # ждущие получают тот же ответ (или None), даже если этот вызов отменили
+            del self._loading[key]
+            pending.set_result(entry)
+        return entry
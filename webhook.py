@@ -0,0 +1,154 @@
+# webhook.py
+# Режим webhook без сторонних зависимостей: маленький HTTP-сервер на asyncio
+# принимает апдейты от Telegram и кладёт их прямо в app.update_queue.
+#
+# Без WEBHOOK_SECRET секрет генерируется случайный: без проверки заголовка любой,
+# кто узнал адрес, мог бы слать апдейты от имени админа.
+#
+# Локальная проверка (WEBHOOK_URL пустой — setWebhook не вызывается):
+#   UPDATE_MODE=webhook WEBHOOK_SECRET=s3cret python bot.py
+#   curl -X POST localhost:8080/telegram -H "X-Telegram-Bot-Api-Secret-Token: s3cret" \
+#        -H "Content-Type: application/json" --data @update.json
+#   curl localhost:8080/healthz
+
+import asyncio
+import hmac
+import json
+import secrets
+import signal
+
+from telegram import Update
+
+_MAX_BODY = 1 << 20        # апдейт Telegram заметно меньше мегабайта
+_READ_TIMEOUT = 10         # сек на заголовки и тело одного запроса
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class WebhookServer:
+    """POST <path> — апдейт (проверка секрета, 503 при переполненной очереди),
+    GET /healthz — состояние."""
+
+    def __init__(self, app, path: str, secret: str, max_queue: int):
+        self.app = app
+        self.path = path
+        self.secret = secret.encode()
+        self.max_queue = max_queue
+        self.stats = {"accepted": 0, "rejected": 0, "busy": 0, "bad": 0}
+        self._server = None
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            status, body = await asyncio.wait_for(self._serve(reader), _READ_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, body = 400, b""
+        reason = _REASONS.get(status, "OK")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _serve(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            return 400, b""
+        method, target = request_line[0], request_line[1].split("?", 1)[0]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if target == "/healthz":
+            return 200, json.dumps({"ok": True, "queue": self.app.update_queue.qsize(), **self.stats}).encode()
+        if target != self.path:
+            return 404, b""
+        if method != "POST":
+            return 405, b""
+
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            self.stats["rejected"] += 1
+            return 403, b""
+
+        length = int(headers.get("content-length", 0))
+        if length > _MAX_BODY:
+            return 413, b""
+        raw = await reader.readexactly(length)
+
+        # обработчики не успевают — пусть Telegram повторит позже
+        if self.app.update_queue.qsize() >= self.max_queue:
+            self.stats["busy"] += 1
+            return 503, b""
+
+        try:
+            update = Update.de_json(json.loads(raw), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            self.stats["bad"] += 1
+            return 400, b""
+        await self.app.update_queue.put(update)
+        self.stats["accepted"] += 1
+        return 200, b""
+
+
+async def _serve_forever(app, host: str, port: int, path: str, secret: str, url: str, max_queue: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        if not url:
+            print(f"⚠️ WEBHOOK_SECRET не задан, временный секрет: {secret}")
+
+    # тот же жизненный цикл, что у run_polling: initialize -> post_init -> start
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    if url:
+        await app.bot.set_webhook(url + path, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    await app.start()
+
+    server = WebhookServer(app, path, secret, max_queue)
+    await server.start(host, port)
+    print(f"✅ Webhook: http://{host}:{port}{path}")
+    try:
+        await stop.wait()
+    finally:
+        # ... и обратный порядок: stop -> post_stop -> shutdown -> post_shutdown
+        await server.close()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app, host: str, port: int, path: str, secret: str, url: str = "", max_queue: int = 1000):
+    """Запуск вместо app.run_polling()."""
+    asyncio.run(_serve_forever(app, host, port, path, secret, url, max_queue))